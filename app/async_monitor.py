@@ -0,0 +1,142 @@
+import app.monitor, app.connector, app.writer
+import asyncio
+import logging
+import os
+import serial
+
+"""
+async_monitor.py
+A monitor that listens to every device in its connection list at once, from a single process.
+Each device is read when the event loop reports it readable; all of them share one interpreter, and one
+DatabaseWriter batches their writes.
+"""
+
+logger = logging.getLogger("logger")
+
+__author__ = 'Goyder'
+
+# Queue size of the DatabaseWriter, if the parameters don't give one.
+DEFAULT_WRITER_QUEUE_SIZE = 10000
+
+
+class AsyncMonitor(app.monitor.Monitor):
+    """
+    Monitor variant that handles many serial devices concurrently, using asyncio.
+    """
+
+    def __init__(self, input_parameters):
+        """
+        Accepts the same parameters as Monitor, plus:
+            rescan_interval: Seconds between checks of connection_list for newly attached devices.
+        writer_policy defaults to drop_oldest, and may not be block: a full queue must never stall the event loop that
+        every device is read from.
+        :param input_parameters: Dictionary of input parameters required for the monitor.
+        :return:
+        """
+        super().__init__(input_parameters)
+        if self.connection_type != "serial":
+            raise TypeError("AsyncMonitor only supports serial connections.")
+        self.writer_policy = input_parameters.get('writer_policy', app.writer.POLICY_DROP_OLDEST)
+        if self.writer_policy == app.writer.POLICY_BLOCK:
+            raise ValueError("AsyncMonitor can't use the '{0}' writer policy; it would stall the event loop.".format(
+                app.writer.POLICY_BLOCK
+            ))
+
+        self.rescan_interval = input_parameters.get('rescan_interval', 5.0)
+        # Every device funnels into one writer, so reading is never held up by a commit.
+        if self.writer_queue_size is None:
+            self.writer_queue_size = DEFAULT_WRITER_QUEUE_SIZE
+
+        # Connectors currently open, by connection name.
+        self.connectors = {}
+
+    def generate_components(self):
+        """
+        Generate the shared database writer and interpreter. Connectors are opened as devices are found.
+        :return:
+        """
+        self._generate_storage()
+
+    def run(self, runs=None, duration=None):
+        """
+        Listen to every available device until stopped.
+        :param runs: Number of scans of the connection list to complete, or None to loop forever.
+        :param duration: Seconds to run for, or None to run forever.
+        :return:
+        """
+        try:
+            asyncio.run(self._run_async(runs, duration))
+        finally:
+            # Don't lose whatever is still sitting in the write queue.
+            self.writer.flush()
+
+    async def _run_async(self, runs, duration):
+        """
+        Watch the connection list, and each device found on it.
+        :param runs: Number of scans of the connection list to complete, or None to loop forever.
+        :param duration: Seconds to run for, or None to run forever.
+        :return:
+        """
+        device_tasks = {}
+        stop_time = None if duration is None else asyncio.get_running_loop().time() + duration
+        runs_complete = 0
+        try:
+            while True:
+                # Check if we have done enough runs
+                if runs is not None:
+                    if runs_complete >= runs:
+                        break
+                    runs_complete += 1
+
+                # Start watching any device that has appeared, or whose watcher has finished.
+                for connection_name in self.connection_list:
+                    task = device_tasks.get(connection_name)
+                    if (task is None or task.done()) and os.path.exists(connection_name):
+                        device_tasks[connection_name] = asyncio.ensure_future(self._watch_device(connection_name))
+
+                if stop_time is None:
+                    await asyncio.sleep(self.rescan_interval)
+                else:
+                    remaining = stop_time - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(self.rescan_interval, remaining))
+        finally:
+            for task in device_tasks.values():
+                task.cancel()
+            await asyncio.gather(*device_tasks.values(), return_exceptions=True)
+
+    async def _watch_device(self, connection_name):
+        """
+        Read from a single device until it is disconnected.
+        :param connection_name: Name of the serial device, e.g. /dev/ttyUSB0.
+        :return:
+        """
+        # A time_out of 0 makes reads return straight away with whatever has arrived.
+        connector = app.connector.SerialConnector(connection_name, time_out=0, bulk_read=True)
+        try:
+            connector.connect()
+        except (serial.SerialException, OSError) as e:
+            logger.info("Could not connect to {0}: {1}".format(connection_name, e))
+            return
+        logger.info("Connected to {0}.".format(connection_name))
+
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        file_descriptor = connector.fileno()
+        loop.add_reader(file_descriptor, readable.set)
+        self.connectors[connection_name] = connector
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                try:
+                    messages = connector.retrieve_available_messages()
+                except (serial.SerialException, OSError, TypeError):
+                    logger.info("Device {0} disconnected.".format(connection_name))
+                    return
+                self._process_messages(connector, messages)
+        finally:
+            loop.remove_reader(file_descriptor)
+            del self.connectors[connection_name]
+            connector.close_connection()
@@ -1,5 +1,8 @@
 import serial
 import os
+import select
+import socket
+import app.frames
 
 """
 connector.py
@@ -8,6 +11,13 @@ Class to retrieve information from external connections.
 
 __author__ = 'Goyder'
 
+# A partial line longer than this is assumed to be noise, and discarded.
+MAX_PARTIAL_LINE_BYTES = 4096
+# Most bytes taken from a socket in one read.
+RECEIVE_BYTES = 4096
+# Responses not yet sent beyond this are assumed to be going nowhere, and discarded. The device asks again.
+MAX_UNSENT_BYTES = 4096
+
 class Connector(object):
     """
     Root class to define the connector class.
@@ -27,6 +37,27 @@ class Connector(object):
         """
         raise NotImplementedError("Function must be created in a sub-class.")
 
+    def retrieve_messages(self):
+        """
+        Retrieve every message available from the external object.
+        :return: List of strings - and, once start_frames has been called, bytes for each binary frame.
+        """
+        return [self.retrieve_data()]
+
+    def can_read_frames(self):
+        """
+        :return: True if the connector can take binary frames from the stream it reads; see app.frames.
+        """
+        return False
+
+    def start_frames(self, sensors):
+        """
+        Take binary frames, as well as text lines, from the connection from now on.
+        :param sensors: Names of the sensors the device's frames refer to, by index.
+        :return:
+        """
+        raise NotImplementedError("Connector can't read binary frames.")
+
     def is_connected(self):
         """
         Check if current object's connection is valid.
@@ -46,15 +77,95 @@ class Connector(object):
         raise NotImplementedError("Function must be created in a sub-class.")
 
 
-class SerialConnector(Connector):
+class StreamConnector(Connector):
+    """
+    Root class for connectors reading a stream of bytes, taking text lines - and binary frames, once started - off it.
+    """
+
+    def __init__(self):
+        """
+        :return:
+        """
+        # Bytes of a line that has not been completely received yet.
+        self._partial_line = bytearray()
+
+        # Set once the device has agreed to send binary frames, and the sensors they refer to, by index.
+        self.frames = False
+        self.frame_sensors = ()
+        # Frames discarded for a bad checksum.
+        self.bad_frames = 0
+
+    def _reset_stream(self):
+        """
+        Forget what was read from a previous connection.
+        :return:
+        """
+        self._partial_line.clear()
+        # A device that reconnects starts again in text, and asks for frames again if it wants them.
+        self.frames = False
+        self.frame_sensors = ()
+
+    def can_read_frames(self):
+        """
+        :return: True if the connector can take binary frames from the stream it reads.
+        """
+        return True
+
+    def start_frames(self, sensors):
+        """
+        Take binary frames, as well as text lines, from the connection from now on.
+        :param sensors: Names of the sensors the device's frames refer to, by index.
+        :return:
+        """
+        if not self.can_read_frames():
+            raise ValueError("Binary frames can only be read in bulk.")
+        self.frames = True
+        self.frame_sensors = tuple(sensors)
+
+    def _split_lines(self, received):
+        """
+        Add received bytes to the partial line, and take off any complete lines - and frames, once started.
+        :param received: Bytes read from the connection.
+        :return: List of complete lines, decoded, and frames.
+        """
+        self._partial_line += received
+        if self.frames:
+            messages, bad_frames = app.frames.take_messages(self._partial_line)
+            self.bad_frames += bad_frames
+            if len(self._partial_line) > MAX_PARTIAL_LINE_BYTES:
+                self._partial_line.clear()
+            return messages
+
+        end_of_last_line = self._partial_line.rfind(b"\n") + 1
+        if end_of_last_line == 0:
+            if len(self._partial_line) > MAX_PARTIAL_LINE_BYTES:
+                self._partial_line.clear()
+            return []
+
+        lines = self._partial_line[:end_of_last_line].decode(errors="ignore").split("\n")
+        del self._partial_line[:end_of_last_line]
+        # The text ended with a newline, so the last piece is empty.
+        return [line + "\n" for line in lines[:-1]]
+
+
+class SerialConnector(StreamConnector):
     """
     Connector implemented for a Serial connection, specifically _not_ a Bluetooth unit.
     """
 
-    def __init__(self, serial_name, time_out=1.0):
+    def __init__(self, serial_name, time_out=1.0, bulk_read=False):
+        """
+        :param serial_name: Name of the serial device, e.g. /dev/ttyUSB0.
+        :param time_out: Seconds to wait for data before giving up on a read.
+        :param bulk_read: If True, retrieve_messages drains everything the device has sent in one read, rather than
+        reading a single line.
+        :return:
+        """
+        super().__init__()
         self.serial_connection = None
         self.serial_name = serial_name
         self.time_out = time_out
+        self.bulk_read = bulk_read
 
     def connect(self):
         """
@@ -63,6 +174,7 @@ class SerialConnector(Connector):
         """
         self.serial_connection = serial.Serial(self.serial_name, timeout=self.time_out)
         self.serial_connection.flushInput()
+        self._reset_stream()
 
     def retrieve_data(self):
         """
@@ -71,6 +183,47 @@ class SerialConnector(Connector):
         """
         return self.serial_connection.readline().decode(errors="ignore")
 
+    def retrieve_messages(self):
+        """
+        Retrieve every complete message available from the connection.
+        In bulk mode, everything waiting is read at once, and any incomplete line is kept for the next call.
+        :return: List of strings, each ending in a newline as retrieve_data's do. Empty if no line was completed.
+        """
+        if not self.bulk_read:
+            return [self.retrieve_data()]
+
+        # Wait, up to the timeout, for the first byte - then take everything else that has arrived with it.
+        received = self.serial_connection.read(1)
+        if not received:
+            return []
+        waiting = self.serial_connection.in_waiting
+        if waiting:
+            received += self.serial_connection.read(waiting)
+        return self._split_lines(received)
+
+    def retrieve_available_messages(self):
+        """
+        Retrieve the complete messages among whatever has already arrived, without waiting.
+        Intended for a connection opened with a time_out of 0, and read when an event loop reports it readable.
+        :return: List of strings, as retrieve_messages returns.
+        """
+        # If the device has come undone, this raises a SerialException or OSError rather than returning nothing.
+        received = self.serial_connection.read(max(1, self.serial_connection.in_waiting))
+        return self._split_lines(received)
+
+    def fileno(self):
+        """
+        :return: File descriptor of the open connection, for registering with an event loop.
+        """
+        return self.serial_connection.fileno()
+
+    def can_read_frames(self):
+        """
+        Frames can only be taken from bulk reads; reading a line at a time would cut them wherever a newline byte falls.
+        :return: True if the connector can take binary frames from the stream it reads.
+        """
+        return self.bulk_read
+
     def is_connected(self):
         """
         Return if the connection is open.
@@ -111,7 +264,167 @@ class SerialConnector(Connector):
         self.serial_connection.write(message)
 
 
-class BluetoothConnector(Connector):
+class BluetoothConnector(StreamConnector):
+    """
+    Connector implemented over a stream socket - RFCOMM, for a Bluetooth unit such as the HC-05.
+    Reads are always made in bulk: whatever has arrived is taken in one read, and split into lines (and frames).
+    """
+
+    def __init__(self, address, port=1, time_out=1.0, socket_factory=None):
+        """
+        :param address: Address of the device, e.g. 98:D3:31:FC:20:34.
+        :param port: RFCOMM channel of the device.
+        :param time_out: Seconds to wait for data before giving up on a read. 0 never waits - for reading when an
+        event loop reports the connection readable.
+        :param socket_factory: Function of the address and port returning a connected stream socket. Defaults to
+        rfcomm_socket; any other stream socket, e.g. a TCP connection or one end of a socket.socketpair(), may stand
+        in for the device.
+        :return:
+        """
+        super().__init__()
+        self.socket_connection = None
+        self.address = address
+        self.port = port
+        self.time_out = time_out
+        self.socket_factory = rfcomm_socket if socket_factory is None else socket_factory
+
+        # Bytes written, but not yet taken by the socket.
+        self._unsent = bytearray()
+
+    def connect(self):
+        """
+        Connect to the device. Raises an OSError if it can't be reached.
+        :return:
+        """
+        self.close_connection()
+        self.socket_connection = self.socket_factory(self.address, self.port)
+        self.socket_connection.settimeout(self.time_out)
+        self._reset_stream()
+        self._unsent.clear()
+
+    def retrieve_data(self):
+        """
+        Retrieve the first message available from the connection.
+        :return: String - empty if none arrived in time.
+        """
+        messages = self.retrieve_messages()
+        return messages[0] if messages else ""
+
+    def retrieve_messages(self):
+        """
+        Retrieve every complete message available from the connection, waiting up to the timeout for the first bytes.
+        A connection found to be lost is closed, for the next is_connected to report.
+        :return: List of strings, each ending in a newline as SerialConnector's do - and bytes for each binary frame,
+        once start_frames has been called. Empty if no line was completed.
+        """
+        try:
+            return self.retrieve_available_messages()
+        except OSError:
+            self.close_connection()
+            return []
+
+    def retrieve_available_messages(self):
+        """
+        Retrieve the complete messages among whatever has already arrived.
+        Intended for a connection opened with a time_out of 0, and read when an event loop reports it readable.
+        :return: List of strings and frames, as retrieve_messages returns.
+        """
+        self._send_unsent()
+        try:
+            received = self.socket_connection.recv(RECEIVE_BYTES)
+        except (BlockingIOError, socket.timeout):
+            return []
+        if not received:
+            self.close_connection()
+            raise ConnectionResetError("Device closed the connection.")
+        return self._split_lines(received)
+
+    def fileno(self):
+        """
+        :return: File descriptor of the open connection, for registering with an event loop.
+        """
+        return self.socket_connection.fileno()
+
+    def is_connected(self):
+        """
+        Return if the connection is open. A connection the device has closed is closed here too.
+        :return:
+        """
+        if self.socket_connection is None:
+            return False
+
+        # A closed connection reads as readable, with nothing to read. Look without taking anything.
+        try:
+            if select.select([self.socket_connection], [], [], 0)[0]:
+                if not self.socket_connection.recv(1, socket.MSG_PEEK):
+                    self.close_connection()
+                    return False
+        except (BlockingIOError, socket.timeout):
+            pass
+        except (OSError, ValueError):
+            self.close_connection()
+            return False
+
+        return True
+
+    def close_connection(self):
+        """
+        Close the connection if open.
+        :return:
+        """
+        if self.socket_connection is None:
+            return
+        try:
+            self.socket_connection.close()
+        except OSError:
+            pass
+        self.socket_connection = None
+
+    def write_data(self, message):
+        """
+        Push the data back to the device.
+        Note that the device distinguishes messages via a newline character. Whatever the socket can't take yet is
+        kept, and sent ahead of the next write or read. If the connection has been lost, it is closed, and the message
+        dropped; the device asks again once reconnected.
+        :param message:
+        :return:
+        """
+        message = (message + "\n").encode("ASCII")
+        if len(self._unsent) + len(message) > MAX_UNSENT_BYTES:
+            self._unsent.clear()
+        self._unsent += message
+        try:
+            self._send_unsent()
+        except OSError:
+            self.close_connection()
+
+    def _send_unsent(self):
+        """
+        Send as much of the unsent bytes as the socket will take without waiting.
+        :return:
+        """
+        if not self._unsent:
+            return
+        try:
+            sent = self.socket_connection.send(self._unsent)
+        except (BlockingIOError, socket.timeout):
+            return
+        del self._unsent[:sent]
+
+
+def rfcomm_socket(address, port):
     """
-    Sub-class for a Bluetooth connector.
+    Open an RFCOMM connection to a Bluetooth device.
+    :param address: Address of the device, e.g. 98:D3:31:FC:20:34.
+    :param port: RFCOMM channel of the device.
+    :return: Connected socket.socket.
     """
+    if not hasattr(socket, "AF_BLUETOOTH") or not hasattr(socket, "BTPROTO_RFCOMM"):
+        raise OSError("RFCOMM sockets are not available on this platform.")
+    connection = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    try:
+        connection.connect((address, port))
+    except OSError:
+        connection.close()
+        raise
+    return connection
@@ -1,5 +1,11 @@
 import sqlite3
+import collections
 import os
+import time
+import calendar
+import datetime
+import logging
+import app.notifier
 
 __author__ = 'Goyder'
 
@@ -8,26 +14,166 @@ database.py
 Module for the database object.
 Accepts data ready for database injection.
 Handles the interaction with database files.
+
+Two layouts of database file are understood:
+1. The original layout: a single 'data' table, with the sensor ID and time stored as text in every row.
+2. A compact layout: a 'readings' table storing time as integer epoch milliseconds and the sensor as a small
+   integer referencing a 'sensors' lookup table. A 'data' view presents it in the original layout.
+The layout is recorded in the file's user_version; files of the original layout have a user_version of 0.
+
+Either layout may also carry rollup tables: per-sensor count, total, minimum and maximum over each minute, hour and
+day, kept up to date as rows are written.
 """
 
+logger = logging.getLogger("logger")
+
+SCHEMA_V1 = 1
+SCHEMA_V2 = 2
+schema_versions = (SCHEMA_V1, SCHEMA_V2)
+
 table_definition = {'row_ID': 'INTEGER', 'Time': 'DATETIME', 'Debug': 'INTEGER', 'Value': 'REAL', 'ID': 'VARCHAR'}
 # The database has these columns.
 database_columns = tuple([column for column in table_definition.keys()])
 # In order to accept a dictionary to be written to, it must have these keys.
 input_database_keys = tuple([column for column in database_columns if column != "row_ID"])
 
+
+class Reading(collections.namedtuple("Reading", ["ID", "Time", "Value", "Debug"])):
+    """
+    A single reading, ready for writing. The fields are in the order rows are written in, so the Database can buffer
+    a Reading as it is.
+    Compares as the tuple it is. To compare with the dictionaries readings used to be, convert one way or the other:
+    Reading.from_mapping(dictionary), or reading._asdict().
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_mapping(cls, value_dictionary):
+        """
+        :param value_dictionary: A dictionary with (at least) the keys of input_database_keys.
+        :return: A Reading of its values.
+        """
+        return cls(value_dictionary["ID"], value_dictionary["Time"], value_dictionary["Value"],
+                   value_dictionary["Debug"])
+
+
+# Indexes to support the time-range queries made by the web front-end.
+index_definitions = {
+    # Covers "SELECT Time, ID, Value ... WHERE Time BETWEEN ..." without touching the table.
+    "data_time_idx": "CREATE INDEX IF NOT EXISTS data_time_idx ON data (Time, ID, Value);",
+    # Covers the same query restricted to a single sensor.
+    "data_id_time_idx": "CREATE INDEX IF NOT EXISTS data_id_time_idx ON data (ID, Time, Value);",
+    # Only non-debug rows, for finding the range of real data.
+    "data_time_no_debug_idx": "CREATE INDEX IF NOT EXISTS data_time_no_debug_idx ON data (Time) WHERE Debug = 0;",
+}
+
+# The compact layout.
+readings_table_definition = {
+    'row_ID': 'INTEGER', 'sensor_ID': 'INTEGER', 'Time': 'INTEGER', 'Value': 'REAL', 'Debug': 'INTEGER'
+}
+sensors_table_definition = {'sensor_ID': 'INTEGER', 'ID': 'VARCHAR'}
+readings_index_definitions = {
+    "readings_time_idx": "CREATE INDEX IF NOT EXISTS readings_time_idx ON readings (Time, sensor_ID, Value);",
+    "readings_sensor_time_idx":
+        "CREATE INDEX IF NOT EXISTS readings_sensor_time_idx ON readings (sensor_ID, Time, Value);",
+    "readings_time_no_debug_idx":
+        "CREATE INDEX IF NOT EXISTS readings_time_no_debug_idx ON readings (Time) WHERE Debug = 0;",
+}
+
+data_table_creation_statement = """
+CREATE TABLE data(
+    row_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    ID VARCHAR,
+    Time DATETIME,
+    Value REAL,
+    Debug INTEGER
+);
+"""
+sensors_table_creation_statement = """
+CREATE TABLE sensors(
+    sensor_ID INTEGER PRIMARY KEY NOT NULL,
+    ID VARCHAR UNIQUE NOT NULL
+);
+"""
+readings_table_creation_statement = """
+CREATE TABLE readings(
+    row_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    sensor_ID INTEGER NOT NULL REFERENCES sensors (sensor_ID),
+    Time INTEGER,
+    Value REAL,
+    Debug INTEGER
+);
+"""
+# Presents the compact layout as the original one, so anything reading 'data' keeps working.
+data_view_creation_statement = """
+CREATE VIEW data AS
+SELECT
+    readings.row_ID AS row_ID,
+    sensors.ID AS ID,
+    strftime('%Y-%m-%d %H:%M:%S', readings.Time / 1000, 'unixepoch') AS Time,
+    readings.Value AS Value,
+    readings.Debug AS Debug
+FROM readings JOIN sensors ON readings.sensor_ID = sensors.sensor_ID;
+"""
+
+# Rollup resolutions, and the number of seconds in each bucket. Each has a table named 'rollup_<resolution>'.
+rollup_resolutions = {"minute": 60, "hour": 60 * 60, "day": 60 * 60 * 24}
+
+
 class Database(object):
     """
     Handles creating and writing data to the database object.
     """
 
-    def __init__(self, database_location, overwrite=False):
+    def __init__(self, database_location, overwrite=False, buffer_size=1, flush_interval=None, cache_size=2000,
+                 schema_version=SCHEMA_V1, rollups=False, notify=False):
         """
         :param overwrite: If True, the Database should clear and overwrite any database it finds.
+        :param buffer_size: Number of rows to accumulate before they are committed in a single transaction.
+        A size of 1 commits every row as it arrives.
+        :param flush_interval: Maximum number of seconds a row may sit in the buffer before it is committed.
+        None means rows are only committed once the buffer is full.
+        :param cache_size: Size of SQLite's page cache for our connection, in kibibytes.
+        :param schema_version: Layout to create new databases with. Existing databases of an older layout are
+        migrated up to it; databases of a newer layout are used as they are.
+        :param rollups: If True, build the rollup tables if the database doesn't have them. Rollup tables that
+        already exist are always kept up to date, regardless of this setting.
+        :param notify: If True, announce the latest row ID through a notification file after each commit, so other
+        processes can pick up new rows without polling the database.
         :return:
         """
+        if buffer_size < 1:
+            raise ValueError("Database buffer_size must be at least 1. Was given: {0}".format(buffer_size))
+        if schema_version not in schema_versions:
+            raise ValueError("Database schema_version must be one of {0}. Was given: {1}".format(
+                schema_versions,
+                schema_version
+            ))
+
         self.overwrite = overwrite
         self.database_location = database_location
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.schema_version = schema_version
+        self.rollups = rollups
+        if notify:
+            self.notifier = app.notifier.FileNotifier(app.notifier.notify_location_for(database_location))
+        else:
+            self.notifier = None
+
+        # A single connection is opened on first use and held until close() is called.
+        self.connection = None
+
+        # Rows waiting to be committed, and the monotonic time by which they must be.
+        self._buffer = []
+        self._flush_deadline = None
+
+        # Sensor names already resolved to their integer IDs, for the compact layout.
+        self._sensor_IDs = {}
+
+        # Whether the database has rollup tables that need updating as rows are written.
+        self._maintain_rollups = False
 
     def create_database(self):
         """
@@ -38,67 +184,461 @@ class Database(object):
         create_new_database = True
 
         if os.path.exists(self.database_location):
-            if self.database_is_valid() and not self.overwrite:
-                create_new_database = False
-            elif self.overwrite:  # We just totally scrap the file. We could just drop the reference table...
+            if self.overwrite:  # We just totally scrap the file. We could just drop the reference table...
                 self.delete_database()
+            elif self.database_is_valid():
+                create_new_database = False
             else:
                 raise(sqlite3.DatabaseError("Database already exists, but is invalid for writing to."))
 
         if create_new_database:
-            database_creation_statement = """
-            CREATE TABLE data(
-                row_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                ID VARCHAR,
-                Time DATETIME,
-                Value REAL,
-                Debug INTEGER
-            );
-            """
-            with sqlite3.connect(self.database_location) as conn:
+            with self.connect() as conn:
                 cur = conn.cursor()
-                cur.execute(database_creation_statement)
+                if self.schema_version == SCHEMA_V2:
+                    cur.execute(sensors_table_creation_statement)
+                    cur.execute(readings_table_creation_statement)
+                    cur.execute(data_view_creation_statement)
+                else:
+                    cur.execute(data_table_creation_statement)
+                cur.execute("PRAGMA user_version={0:d};".format(self.schema_version))
+            self._create_indexes()
+        else:
+            existing_schema_version = self.existing_schema_version()
+            if existing_schema_version < self.schema_version:
+                self.migrate_database()
+            else:
+                self.schema_version = existing_schema_version
 
-    def database_is_valid(self):
+        self._prepare_rollups()
+        self._configure_connection()
+
+    def connect(self):
+        """
+        Return the connection to the database file, opening it if required.
+        :return: A sqlite3 connection.
+        """
+        if self.connection is None:
+            # The connection may be handed to a DatabaseWriter's thread; only one thread uses it at a time.
+            self.connection = sqlite3.connect(self.database_location, check_same_thread=False)
+        return self.connection
+
+    def _configure_connection(self):
+        """
+        Tune the database for a single writer and concurrent readers.
+        WAL journaling lets the web front-end read while we write, and is recorded in the file itself.
+        :return:
+        """
+        cur = self.connect().cursor()
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute("PRAGMA synchronous=NORMAL;")
+        # Negative values are interpreted by SQLite as kibibytes rather than pages.
+        cur.execute("PRAGMA cache_size=-{0:d};".format(self.cache_size))
+
+    def _create_indexes(self, schema_version=None):
         """
-        Check if an existing database is valid for these purposes.
+        Create any of our indexes that the database is missing.
+        :param schema_version: Layout of the database. Defaults to the layout of this object.
         :return:
         """
-        with sqlite3.connect(self.database_location) as conn:
+        if schema_version is None:
+            schema_version = self.schema_version
+
+        if schema_version == SCHEMA_V2:
+            statements = readings_index_definitions.values()
+        else:
+            statements = index_definitions.values()
+
+        with self.connect() as conn:
             cur = conn.cursor()
-            try:
-                statement = "PRAGMA table_info(data);"
-                cur = cur.execute(statement)
-                column_info = {column[1]: column[2] for column in cur.fetchall()}
-            except:
-                return False
+            for statement in statements:
+                cur.execute(statement)
 
-        return column_info == table_definition
+    def existing_schema_version(self):
+        """
+        Work out which layout the existing database file has.
+        :return: SCHEMA_V1 or SCHEMA_V2, or None if the file is of neither layout.
+        """
+        try:
+            cur = self.connect().cursor()
+            user_version = cur.execute("PRAGMA user_version;").fetchone()[0]
+            if user_version == SCHEMA_V2:
+                if _table_info(cur, "readings") == readings_table_definition and \
+                        _table_info(cur, "sensors") == sensors_table_definition:
+                    return SCHEMA_V2
+            elif user_version in (0, SCHEMA_V1):
+                if _table_info(cur, "data") == table_definition:
+                    return SCHEMA_V1
+        except:
+            pass
+        return None
+
+    def database_is_valid(self):
+        """
+        Check if an existing database is valid for these purposes. Either layout is valid.
+        A valid database that predates our indexes is upgraded in place.
+        :return:
+        """
+        schema_version = self.existing_schema_version()
+        if schema_version is None:
+            return False
+
+        self._create_indexes(schema_version)
+        return True
+
+    def migrate_database(self):
+        """
+        Convert an existing database of the original layout to the compact layout, keeping row IDs.
+        The conversion happens in a single transaction, so a failure leaves the original untouched.
+        :return:
+        """
+        self.flush()
+        conn = self.connect()
+        cur = conn.cursor()
+        had_rollups = self._rollup_tables_exist()
+        cur.execute("BEGIN;")
+        try:
+            # Rollups are keyed on the sensor and time, so are rebuilt in the new layout afterwards.
+            for resolution in rollup_resolutions.keys():
+                cur.execute("DROP TABLE IF EXISTS rollup_{0};".format(resolution))
+            cur.execute(sensors_table_creation_statement)
+            cur.execute(readings_table_creation_statement)
+            cur.execute("INSERT INTO sensors (ID) SELECT DISTINCT ID FROM data WHERE ID IS NOT NULL ORDER BY ID;")
+            # 2440587.5 is the Julian day of the Unix epoch.
+            cur.execute("""
+            INSERT INTO readings (row_ID, sensor_ID, Time, Value, Debug)
+            SELECT
+                data.row_ID,
+                sensors.sensor_ID,
+                CAST(round((julianday(data.Time) - 2440587.5) * 86400000) AS INTEGER),
+                data.Value,
+                data.Debug
+            FROM data JOIN sensors ON data.ID = sensors.ID;
+            """)
+            cur.execute("DROP TABLE data;")
+            cur.execute(data_view_creation_statement)
+            for statement in readings_index_definitions.values():
+                cur.execute(statement)
+            cur.execute("PRAGMA user_version={0:d};".format(SCHEMA_V2))
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+        self.schema_version = SCHEMA_V2
+        self._sensor_IDs = {}
+        if had_rollups:
+            self.backfill_rollups()
+        # Hand the space used by the old table back to the file system.
+        cur.execute("VACUUM;")
 
     def delete_database(self):
         """
-        Delete a database file.
+        Delete a database file, along with any journal files left beside it.
         :return:
         """
+        self.close_connection()
         os.remove(self.database_location)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.database_location + suffix):
+                os.remove(self.database_location + suffix)
 
     def write_to_database(self, value_dictionary):
         """
         Write a dictionary of values to the database.
-        :param parseable_dictionary: A dictionary of key-value pairs ready for writing.
+        Rows are buffered, and committed together once the buffer is full or the flush interval has passed.
+        :param value_dictionary: A Reading, or a dictionary of key-value pairs ready for writing.
+        :return:
+        """
+        self.write_many_to_database((value_dictionary,))
+
+    def write_many_to_database(self, value_dictionaries):
+        """
+        Write several dictionaries of values to the database, as write_to_database does for one.
+        :param value_dictionaries: An iterable of Readings, or dictionaries of key-value pairs ready for writing.
+        :return:
+        """
+        self._buffer_rows(value_dictionaries)
+        if not self._buffer:
+            return
+        if self._flush_deadline is None and self.flush_interval is not None:
+            self._flush_deadline = time.monotonic() + self.flush_interval
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def commit_many_to_database(self, value_dictionaries):
+        """
+        Write several dictionaries of values to the database, and commit them - with anything already buffered -
+        before returning, whatever the buffer size.
+        :param value_dictionaries: An iterable of Readings, or dictionaries of key-value pairs ready for writing.
+        :return: The number of rows written.
+        """
+        self._buffer_rows(value_dictionaries)
+        return self.flush()
+
+    def _buffer_rows(self, value_dictionaries):
+        """
+        Add rows to the buffer, without committing them.
+        :param value_dictionaries: An iterable of Readings, or dictionaries of key-value pairs ready for writing.
         :return:
         """
         # Key question - do we want to validate before attempting to write to the database?
-        with sqlite3.connect(self.database_location) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO data (ID, Time, Value, Debug) VALUES (?, ?, ?, ?);",
-                (value_dictionary["ID"],
-                 value_dictionary["Time"],
-                 value_dictionary["Value"],
-                 value_dictionary["Debug"]
-                 )
+        # Readings are already rows; only dictionaries need converting.
+        self._buffer.extend(
+            value_dictionary if type(value_dictionary) is Reading else Reading.from_mapping(value_dictionary)
+            for value_dictionary in value_dictionaries
+        )
+
+    def flush_if_due(self):
+        """
+        Commit the buffered rows if they have been waiting longer than the flush interval.
+        Intended to be called periodically by whatever is driving the writes, so quiet periods still get committed.
+        :return: True if a flush took place.
+        """
+        if self._flush_deadline is not None and time.monotonic() >= self._flush_deadline:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """
+        Commit all buffered rows to the database in a single transaction.
+        :return: The number of rows written.
+        """
+        if not self._buffer:
+            self._flush_deadline = None
+            return 0
+
+        rows = self._buffer
+        try:
+            with self.connect() as conn:
+                cur = conn.cursor()
+                if self.schema_version == SCHEMA_V2:
+                    encoded_rows = [(self._get_sensor_ID(cur, ID), datetime_to_epoch_ms(Time), Value, Debug)
+                                    for ID, Time, Value, Debug in rows]
+                    cur.executemany(
+                        "INSERT INTO readings (sensor_ID, Time, Value, Debug) VALUES (?, ?, ?, ?);",
+                        encoded_rows
+                    )
+                else:
+                    encoded_rows = rows
+                    # sqlite3 reads exact tuples directly, but any subclass - a Reading - an item at a time.
+                    cur.executemany("INSERT INTO data (ID, Time, Value, Debug) VALUES (?, ?, ?, ?);", map(tuple, rows))
+
+                if self._maintain_rollups:
+                    self._update_rollups(cur, encoded_rows)
+        except:
+            # Any sensors registered in the failed transaction were rolled back with it.
+            self._sensor_IDs = {}
+            raise
+
+        # Only clear the buffer once the rows are safely committed.
+        self._buffer = []
+        self._flush_deadline = None
+
+        if self.notifier is not None:
+            self._notify()
+
+        return len(rows)
+
+    def _notify(self):
+        """
+        Announce the latest row ID. The rows are already committed, so a failure here is logged rather than raised.
+        :return:
+        """
+        raw_table = "readings" if self.schema_version == SCHEMA_V2 else "data"
+        try:
+            latest_row_ID = self.connect().execute("SELECT max(row_ID) FROM {0};".format(raw_table)).fetchone()[0]
+            self.notifier.notify(latest_row_ID)
+        except OSError as e:
+            logger.warning("Could not write notification: {0}".format(e))
+
+    def _get_sensor_ID(self, cur, sensor_name):
+        """
+        Find the integer ID of a sensor in the compact layout, registering the sensor if it is new.
+        :param cur: Cursor within the current transaction.
+        :param sensor_name: Sensor ID as sent by the device, e.g. "Temperature".
+        :return: Integer sensor ID.
+        """
+        try:
+            return self._sensor_IDs[sensor_name]
+        except KeyError:
+            pass
+
+        cur.execute("INSERT OR IGNORE INTO sensors (ID) VALUES (?);", (sensor_name,))
+        sensor_ID = cur.execute("SELECT sensor_ID FROM sensors WHERE ID = ?;", (sensor_name,)).fetchone()[0]
+        self._sensor_IDs[sensor_name] = sensor_ID
+        return sensor_ID
+
+    def _prepare_rollups(self):
+        """
+        Work out whether rollups need maintaining, building them if they have been asked for but don't exist.
+        :return:
+        """
+        if self._rollup_tables_exist():
+            self._maintain_rollups = True
+        elif self.rollups:
+            self.backfill_rollups()
+
+    def _rollup_tables_exist(self):
+        """
+        :return: True if the database has a rollup table for every resolution.
+        """
+        cur = self.connect().cursor()
+        return all(_table_info(cur, "rollup_{0}".format(resolution)) for resolution in rollup_resolutions.keys())
+
+    def _rollup_key_column(self):
+        """
+        :return: Name of the column identifying the sensor, in both the raw and rollup tables.
+        """
+        if self.schema_version == SCHEMA_V2:
+            return "sensor_ID"
+        return "ID"
+
+    def _update_rollups(self, cur, encoded_rows):
+        """
+        Fold newly written rows into the rollup tables.
+        Rows are aggregated here first, so a buffer full of readings costs one upsert per sensor per bucket.
+        :param cur: Cursor within the transaction that wrote the rows.
+        :param encoded_rows: Tuples of (sensor, time, value, debug) as they were inserted into the raw table.
+        :return:
+        """
+        aggregates = {resolution: {} for resolution in rollup_resolutions.keys()}
+        for key, Time, Value, Debug in encoded_rows:
+            if Value is None:
+                continue
+            if self.schema_version == SCHEMA_V2:
+                epoch_ms = Time
+            else:
+                epoch_ms = datetime_to_epoch_ms(Time)
+
+            for resolution, seconds in rollup_resolutions.items():
+                bucket = epoch_ms - epoch_ms % (seconds * 1000)
+                aggregate = aggregates[resolution].get((bucket, key))
+                if aggregate is None:
+                    aggregates[resolution][(bucket, key)] = [1, Value, Value, Value]
+                else:
+                    aggregate[0] += 1
+                    aggregate[1] += Value
+                    aggregate[2] = min(aggregate[2], Value)
+                    aggregate[3] = max(aggregate[3], Value)
+
+        key_column = self._rollup_key_column()
+        for resolution, buckets in aggregates.items():
+            if self.schema_version == SCHEMA_V2:
+                parameters = [(bucket, key) + tuple(aggregate) for (bucket, key), aggregate in buckets.items()]
+            else:
+                parameters = [(epoch_ms_to_text(bucket), key) + tuple(aggregate)
+                              for (bucket, key), aggregate in buckets.items()]
+            cur.executemany(
+                """
+                INSERT INTO rollup_{0} (Time, {1}, Count, Total, Minimum, Maximum) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (Time, {1}) DO UPDATE SET
+                    Count = Count + excluded.Count,
+                    Total = Total + excluded.Total,
+                    Minimum = min(Minimum, excluded.Minimum),
+                    Maximum = max(Maximum, excluded.Maximum);
+                """.format(resolution, key_column),
+                parameters
             )
-            conn.commit()
 
+    def backfill_rollups(self):
+        """
+        Rebuild the rollup tables from every row in the raw table, creating the tables if required.
+        Used when adding rollups to an existing database; rows written afterwards are rolled up as they arrive.
+        :return:
+        """
+        self.flush()
+        key_column = self._rollup_key_column()
+        if self.schema_version == SCHEMA_V2:
+            key_type, time_type, raw_table = "INTEGER", "INTEGER", "readings"
+        else:
+            key_type, time_type, raw_table = "VARCHAR", "DATETIME", "data"
+
+        with self.connect() as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN;")
+            for resolution, seconds in rollup_resolutions.items():
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_{0}(
+                    Time {1} NOT NULL,
+                    {2} {3} NOT NULL,
+                    Count INTEGER,
+                    Total REAL,
+                    Minimum REAL,
+                    Maximum REAL,
+                    PRIMARY KEY (Time, {2})
+                ) WITHOUT ROWID;
+                """.format(resolution, time_type, key_column, key_type))
+                cur.execute("DELETE FROM rollup_{0};".format(resolution))
+
+                # Buckets must be computed exactly as _update_rollups computes them.
+                if self.schema_version == SCHEMA_V2:
+                    bucket = "Time - Time % {0:d}".format(seconds * 1000)
+                else:
+                    bucket = "datetime(CAST(strftime('%s', Time) AS INTEGER) / {0:d} * {0:d}, 'unixepoch')".format(
+                        seconds
+                    )
+                cur.execute("""
+                INSERT INTO rollup_{0} (Time, {1}, Count, Total, Minimum, Maximum)
+                SELECT {2} AS Bucket, {1}, count(Value), sum(Value), min(Value), max(Value)
+                FROM {3}
+                WHERE Value IS NOT NULL AND Time IS NOT NULL
+                GROUP BY Bucket, {1};
+                """.format(resolution, key_column, bucket, raw_table))
 
+        self._maintain_rollups = True
+
+    def close(self):
+        """
+        Commit anything still buffered and close the connection.
+        Should be called before the Database object is discarded.
+        :return:
+        """
+        self.flush()
+        self.close_connection()
+
+    def close_connection(self):
+        """
+        Close the connection to the database file, if it is open.
+        :return:
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def datetime_to_epoch_ms(value):
+    """
+    Convert a datetime to integer milliseconds since the Unix epoch, as stored by the compact layout.
+    Naive datetimes - which is what the devices send - are stored as though they were UTC, so they read back
+    unchanged.
+    :param value: A datetime, or a string in ISO format.
+    :return: Integer milliseconds.
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+def epoch_ms_to_text(epoch_ms):
+    """
+    Convert epoch milliseconds back to the text form the original layout stores times in.
+    :param epoch_ms: Integer milliseconds since the Unix epoch.
+    :return: String of format "YYYY-MM-DD HH:MM:SS".
+    """
+    value = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=epoch_ms)
+    return value.isoformat(sep=" ", timespec="seconds")
+
+
+def _table_info(cur, table_name):
+    """
+    Retrieve the column names and types of a table.
+    :param cur: Database cursor.
+    :param table_name: Name of the table to examine.
+    :return: Dictionary of column name: column type.
+    """
+    cur = cur.execute("PRAGMA table_info({0});".format(table_name))
+    return {column[1]: column[2] for column in cur.fetchall()}
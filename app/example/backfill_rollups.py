@@ -0,0 +1,34 @@
+import os, sys
+sys.path.insert(0, os.path.abspath('../..'))
+import app.database
+__author__ = 'Goyder'
+
+"""
+backfill_rollups.py
+Build, or rebuild, the minute/hour/day rollup tables of an existing database file.
+Once built, the monitor keeps them up to date as it writes.
+"""
+
+
+def main(database_location):
+    """
+    Rebuild the rollups of a database file.
+    :param database_location: Path to the database file.
+    :return:
+    """
+    if not os.path.exists(database_location):
+        print("No database found at: {0}".format(database_location))
+        return
+
+    database = app.database.Database(database_location)
+    database.create_database()
+    database.backfill_rollups()
+    database.close()
+    print("Rollups rebuilt for: {0}".format(database_location))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python backfill_rollups.py [DATABASE].db")
+    else:
+        main(sys.argv[1])
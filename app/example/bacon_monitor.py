@@ -3,7 +3,7 @@ import yaml
 import time
 import os, sys
 sys.path.insert(0, os.path.abspath('../..'))
-import app.connector, app.interpreter, app.database, app.monitor
+import app.connector, app.interpreter, app.database, app.monitor, app.async_monitor
 __author__ = 'Goyder'
 
 def main(app_config, logging_config):
@@ -17,7 +17,11 @@ def main(app_config, logging_config):
     # Construct the bacon monitoring objects
     parameters = app.monitor.read_config_yaml(app_config)
 
-    monitor = app.monitor.Monitor(parameters)
+    # With multi_device, every device in the connection list is monitored at once.
+    if parameters.get('multi_device', False):
+        monitor = app.async_monitor.AsyncMonitor(parameters)
+    else:
+        monitor = app.monitor.Monitor(parameters)
     logger.info("System running. Ctrl-c to exit program.")
     while True:
         try:
@@ -0,0 +1,60 @@
+import os, sys
+sys.path.insert(0, os.path.abspath('../..'))
+import timeit
+import app.interpreter
+__author__ = 'Goyder'
+
+"""
+benchmark_parser.py
+Compare the single-pass data message parser against the original two-step parse.
+"""
+
+MESSAGE = "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,ID:Temperature,Debug:0,"
+TIME_STRING = "20:47:40 23/01/2017"
+
+
+def two_step_parse(message):
+    """
+    The original parse: a string dictionary, then values.
+    :param message: Data message.
+    :return:
+    """
+    return app.interpreter._parse_string_dict_to_value_dict(app.interpreter._parse_data_message_to_string_dict(message))
+
+
+def time_per_call(function, argument, number):
+    """
+    :param function: Function to time.
+    :param argument: Argument to call it with.
+    :param number: Number of calls per repeat.
+    :return: Best time per call of five repeats, in microseconds.
+    """
+    return min(timeit.repeat(lambda: function(argument), repeat=5, number=number)) / number * 1e6
+
+
+def main(number):
+    """
+    Time each parser and print the results.
+    :param number: Number of calls per repeat.
+    :return:
+    """
+    results = [
+        ("Message, two-step parse", time_per_call(two_step_parse, MESSAGE, number)),
+        ("Message, single pass", time_per_call(app.interpreter._parse_data_message, MESSAGE, number)),
+        ("Time, strptime", time_per_call(
+            lambda time_string: app.interpreter.datetime.datetime.strptime(time_string, app.interpreter.TIME_FORMAT),
+            TIME_STRING, number
+        )),
+        ("Time, fixed format", time_per_call(app.interpreter._parse_time, TIME_STRING, number)),
+    ]
+    for name, microseconds in results:
+        print("{0:<28}{1:8.2f} us/call".format(name, microseconds))
+    print("Message speed-up: {0:.1f}x".format(results[0][1] / results[1][1]))
+    print("Time speed-up:    {0:.1f}x".format(results[2][1] / results[3][1]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python benchmark_parser.py [CALLS PER REPEAT]")
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) == 2 else 100000)
@@ -0,0 +1,128 @@
+import os, sys
+sys.path.insert(0, os.path.abspath('../..'))
+import tempfile
+import time
+import app.interpreter, app.monitor
+__author__ = 'Goyder'
+
+"""
+benchmark_reconnect_storm.py
+Time a reconnection storm: a fleet of devices all coming back at once, each sending a burst of time requests along
+with its first readings. Compares answering every message as it comes against answering each read in one go, with the
+time response made once a second.
+"""
+
+
+class RecordingConnector(object):
+    """
+    Stands in for a device's connector, keeping count of what is written back to it.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes_written = 0
+
+    def write_data(self, message):
+        message = (message + "\n").encode("ASCII")
+        self.writes += 1
+        self.bytes_written += len(message)
+
+
+def generate_monitor(database_location):
+    """
+    Build a monitor with a real interpreter and database, but no device of its own.
+    :param database_location: Path to the database file.
+    :return:
+    """
+    monitor = app.monitor.Monitor({
+        "connection_type": "serial",
+        "database_location": database_location,
+        "overwrite": True,
+        "timeout": 1.0,
+        "connection_list": [],
+        "buffer_size": 10000
+    })
+    monitor._generate_storage()
+    return monitor
+
+
+def generate_storm(devices, requests_per_device):
+    """
+    :param devices: Number of devices reconnecting.
+    :param requests_per_device: Time requests each sends before it gets an answer.
+    :return: The messages each device has sent, as read in one go.
+    """
+    storm = []
+    for device in range(devices):
+        messages = ["R001\n"] * requests_per_device
+        messages.append("Flag:D001,Time:12:00:00 23/01/2017,Value:{0},ID:Sensor{0},Debug:0,\n".format(device))
+        storm.append(messages)
+    return storm
+
+
+def uncached_time_response():
+    """
+    The time response as it was made before being cached.
+    :return:
+    """
+    return time.strftime("T%H%M%S%d%m%Y")
+
+
+def run_storm(monitor, storm, batched):
+    """
+    :param monitor: Monitor to handle the storm.
+    :param storm: Messages from each device.
+    :param batched: True to answer each device's read in one go; False to answer every message as it comes.
+    :return: Seconds taken, and the connectors written to.
+    """
+    connectors = [RecordingConnector() for _ in storm]
+    start = time.perf_counter()
+    for connector, messages in zip(connectors, storm):
+        if batched:
+            monitor._process_messages(connector, messages)
+        else:
+            for message in messages:
+                monitor._process_messages(connector, [message])
+    monitor.writer.flush()
+    return time.perf_counter() - start, connectors
+
+
+def main(devices, requests_per_device):
+    """
+    Run the storm each way and print the results.
+    :param devices: Number of devices reconnecting.
+    :param requests_per_device: Time requests each sends before it gets an answer.
+    :return:
+    """
+    storm = generate_storm(devices, requests_per_device)
+    cached_time_response = app.interpreter._get_time_response
+    with tempfile.TemporaryDirectory() as directory:
+        for index, (name, time_response, batched) in enumerate([
+            ("Per message, uncached time", uncached_time_response, False),
+            ("Per message, cached time", cached_time_response, False),
+            ("Batched, cached time", cached_time_response, True),
+        ]):
+            # A database of its own each time, so no run pays for the rows of another.
+            monitor = generate_monitor(os.path.join(directory, "storm{0}.db".format(index)))
+            app.interpreter._get_time_response = time_response
+            try:
+                seconds, connectors = min(
+                    (run_storm(monitor, storm, batched) for _ in range(5)), key=lambda result: result[0]
+                )
+            finally:
+                app.interpreter._get_time_response = cached_time_response
+            print("{0:<30}{1:8.1f} ms {2:8d} writes {3:10d} bytes".format(
+                name, seconds * 1000,
+                sum(connector.writes for connector in connectors),
+                sum(connector.bytes_written for connector in connectors)
+            ))
+            monitor.writer.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 3):
+        print("Usage: python benchmark_reconnect_storm.py [DEVICES] [REQUESTS PER DEVICE]")
+    elif len(sys.argv) == 3:
+        main(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        main(500, 20)
@@ -0,0 +1,38 @@
+import os, sys
+sys.path.insert(0, os.path.abspath('../..'))
+import app.database, app.interpreter
+__author__ = 'Goyder'
+
+"""
+replay_log.py
+Load a captured serial log - one message per line - into a database file, e.g. to backfill historical data.
+"""
+
+
+def main(log_location, database_location):
+    """
+    Interpret every line of a log, writing its data to a database.
+    :param log_location: Path to the log file.
+    :param database_location: Path to the database file. Created if it doesn't exist.
+    :return:
+    """
+    if not os.path.exists(log_location):
+        print("No log found at: {0}".format(log_location))
+        return
+
+    database = app.database.Database(database_location, buffer_size=10000)
+    database.create_database()
+    interpreter = app.interpreter.Interpreter(database)
+    with open(log_location, errors="replace") as log:
+        counts = interpreter.interpret_many(log, batch_size=10000)
+    database.close()
+
+    for status, count in sorted(counts.items(), key=lambda item: item[0].value):
+        print("{0:<16}{1}".format(status.value, count))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python replay_log.py [LOG] [DATABASE].db")
+    else:
+        main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,110 @@
+import binascii
+import collections
+import datetime
+import struct
+
+"""
+frames.py
+The compact binary frame a device may send readings in, in place of text data messages.
+A frame is 14 bytes, against the ~70 of a text data message:
+    sync (0xA5), length of the payload (10),
+    payload: sensor index (uint8), time (uint32 seconds since 1970 on the device's clock), value (float32),
+    flags (uint8),
+    CRC-16/XMODEM of the length and payload (uint16).
+All fields are little-endian, as the Arduino stores them.
+Frames and text lines may arrive on the same connection: a text line never contains the sync byte.
+"""
+
+__author__ = 'Goyder'
+
+SYNC = 0xA5
+FLAG_DEBUG = 0x01
+
+HEADER = struct.Struct("<BB")
+READING_PAYLOAD = struct.Struct("<BIfB")
+CHECKSUM = struct.Struct("<H")
+FRAME_SIZE = HEADER.size + READING_PAYLOAD.size + CHECKSUM.size
+
+# A decoded frame.
+Frame = collections.namedtuple("Frame", ["sensor_index", "epoch", "value", "flags"])
+
+_SYNC_BYTES = bytes([SYNC])
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_frame(sensor_index, epoch, value, flags=0):
+    """
+    Build a frame, as a device would send it.
+    :param sensor_index: Index of the sensor in the list the device gave when it asked to send frames.
+    :param epoch: Seconds since 1970 on the device's clock.
+    :param value: Value of the reading.
+    :param flags: Combination of the FLAG_* values.
+    :return: Bytes of the frame.
+    """
+    body = bytes([READING_PAYLOAD.size]) + READING_PAYLOAD.pack(sensor_index, epoch, value, flags)
+    return _SYNC_BYTES + body + CHECKSUM.pack(binascii.crc_hqx(body, 0))
+
+
+def decode_frame(frame):
+    """
+    Unpack a frame, as taken off a connection by take_messages.
+    :param frame: Bytes of a complete frame, with a correct checksum.
+    :return: Frame.
+    """
+    if len(frame) != FRAME_SIZE:
+        raise ValueError("Frame of {0} bytes is not a reading frame.".format(len(frame)))
+    return Frame(*READING_PAYLOAD.unpack_from(frame, HEADER.size))
+
+
+def epoch_to_datetime(epoch):
+    """
+    :param epoch: Seconds since 1970 on the device's clock. The clock is set from the time response, in local time.
+    :return: datetime.datetime, in the same local time as the text data messages give.
+    """
+    return _EPOCH + datetime.timedelta(seconds=epoch)
+
+
+def take_messages(received):
+    """
+    Take every complete text line and frame off the front of the bytes received from a connection.
+    Frames with a bad checksum are skipped, and the search for the next frame or line restarts from the byte after
+    their sync byte. Text cut short by a frame is discarded.
+    :param received: bytearray of the bytes received. Whatever is taken is removed from it; the rest is kept for when
+    more has arrived.
+    :return: List of the messages, in the order they arrived - strings for text lines, each ending in a newline, and
+    bytes for frames - and the number of bad frames skipped.
+    """
+    messages = []
+    bad_frames = 0
+    position = 0
+    end = len(received)
+    while position < end:
+        if received[position] == SYNC:
+            if end - position < HEADER.size:
+                break
+            frame_end = position + HEADER.size + received[position + 1] + CHECKSUM.size
+            if frame_end > end:
+                break
+            frame = bytes(received[position:frame_end])
+            checksum, = CHECKSUM.unpack_from(frame, len(frame) - CHECKSUM.size)
+            if binascii.crc_hqx(frame[1:-CHECKSUM.size], 0) == checksum:
+                messages.append(frame)
+                position = frame_end
+            else:
+                bad_frames += 1
+                position += 1
+            continue
+
+        end_of_line = received.find(b"\n", position)
+        sync = received.find(_SYNC_BYTES, position, end if end_of_line < 0 else end_of_line)
+        if sync >= 0:
+            # The text was cut short by a frame.
+            position = sync
+        elif end_of_line >= 0:
+            messages.append(received[position:end_of_line + 1].decode(errors="ignore"))
+            position = end_of_line + 1
+        else:
+            break
+
+    del received[:position]
+    return messages, bad_frames
@@ -1,5 +1,12 @@
 import time, datetime
+import collections
+import enum
+import itertools
+import logging
+import re
 import app.database
+import app.frames
+import app.writer
 
 """
 interpreter.py
@@ -7,12 +14,71 @@ Module for the interpreter object
 Accepts and takes action based on input objects.
 """
 
+logger = logging.getLogger("logger")
+
 ERROR_COULD_NOT_UNDERSTAND = "ERROR 001 - Could not understand message."
 ERROR_WRONG_TYPE = "ERROR 002 - Interpret command requires a string for input."
 ERROR_MISSING_KEYS_IN_MESSAGE = "ERROR 003 - Message was missing crucial keys for writing to database."
 ERROR_COULD_NOT_PARSE_VALUES = "ERROR 004 - Could not parse values."
+ERROR_COULD_NOT_WRITE = "ERROR 005 - Could not write to database."
 REQUEST_TIME_STRING_FLAG = "R001"  # Deliberately truncated. We only care about this index string.
 DATA_MESSAGE_FLAG = "D001"
+# A device offering to send binary frames, e.g. "Flag:N001,Sensors:Temperature;Humidity,". See app.frames.
+FRAME_REQUEST_FLAG = "N001"
+# The response accepting a device's offer of binary frames.
+FRAMES_ACCEPTED_RESPONSE = "F001"
+# A batch of readings a device has buffered, each of "ID|seconds since 1970 on the device's clock|Value|Debug", e.g.
+# "Flag:B001,Device:Cupboard,Seq:42,Readings:Temperature|1485204460|22.70|0;Humidity|1485204460|51.2|0,".
+BATCH_MESSAGE_FLAG = "B001"
+BATCH_READING_SEPARATOR = ";"
+BATCH_FIELD_SEPARATOR = "|"
+# The acknowledgement of a batch, e.g. "A001,Seq:42". Until it arrives, the device keeps the batch to send again.
+BATCH_ACKNOWLEDGEMENT_FLAG = "A001"
+TIME_FORMAT = "%H:%M:%S %d/%m/%Y"
+
+# The flag of a message: its first token, or the value of a leading Flag field - e.g. "R001\n", "Flag:D001,...".
+FLAG_PATTERN = re.compile(r"\s*(?:Flag:)?([^,\s]+)")
+# A Flag field anywhere in a message, for messages whose fields arrive in another order.
+FLAG_FIELD_PATTERN = re.compile(r"(?:^|,)\s*Flag:([^,\s]+)")
+# A "Key:Value" field of a data message. Only the first colon separates the two, as the time has colons of its own.
+DATA_FIELD_PATTERN = re.compile(r"([^,:]+):([^,]*)")
+# TIME_FORMAT, as the Arduino sends it: every field zero-padded.
+TIME_PATTERN = re.compile(r"(\d\d):(\d\d):(\d\d) (\d\d)/(\d\d)/(\d\d\d\d)\Z", re.ASCII)
+
+
+class InterpretStatus(enum.Enum):
+    """
+    The outcome of interpreting a message.
+    """
+    EMPTY = "empty"  # Nothing but whitespace, e.g. from a read timing out.
+    RESPONSE = "response"  # The message asked for a response, which is the payload.
+    WRITTEN = "written"  # The message was data, and has been written. The payload is any acknowledgement to send back.
+    WRONG_TYPE = "wrong_type"
+    NOT_UNDERSTOOD = "not_understood"
+    MISSING_KEYS = "missing_keys"
+    BAD_VALUES = "bad_values"
+    FRAMES = "frames"  # The device offered to send binary frames. The payload is its sensors' names, by index.
+    WRITE_FAILED = "write_failed"  # Readings that were to be acknowledged couldn't be committed; nothing is sent back.
+
+
+# The status of a message, and its payload: the response to send back, or the error message.
+InterpretResult = collections.namedtuple("InterpretResult", ["status", "payload"])
+
+# Readings a device is to be told are safe, once they are; see Interpreter._parse_batch.
+Batch = collections.namedtuple("Batch", ["device", "sequence", "readings"])
+
+# Results that never vary, so needn't be built each time.
+EMPTY_RESULT = InterpretResult(InterpretStatus.EMPTY, None)
+WRITTEN_RESULT = InterpretResult(InterpretStatus.WRITTEN, None)
+WRONG_TYPE_RESULT = InterpretResult(InterpretStatus.WRONG_TYPE, ERROR_WRONG_TYPE)
+NOT_UNDERSTOOD_RESULT = InterpretResult(InterpretStatus.NOT_UNDERSTOOD, ERROR_COULD_NOT_UNDERSTAND)
+MISSING_KEYS_RESULT = InterpretResult(InterpretStatus.MISSING_KEYS, ERROR_MISSING_KEYS_IN_MESSAGE)
+BAD_VALUES_RESULT = InterpretResult(InterpretStatus.BAD_VALUES, ERROR_COULD_NOT_PARSE_VALUES)
+WRITE_FAILED_RESULT = InterpretResult(InterpretStatus.WRITE_FAILED, ERROR_COULD_NOT_WRITE)
+
+# The last time response made, and the wall-clock second it was made for.
+_time_response_second = None
+_time_response = None
 
 class Interpreter(object):
     """
@@ -26,12 +92,49 @@ class Interpreter(object):
         Define arguments here.
         :return:
         """
-        if not isinstance(database, app.database.Database):
-            raise TypeError("Interpreter requires a Database object to write to. Was given: {0}".format(
-                type(database)
-            ))
+        if not isinstance(database, (app.database.Database, app.writer.DatabaseWriter)):
+            raise TypeError(
+                "Interpreter requires a Database or DatabaseWriter object to write to. Was given: {0}".format(
+                    type(database)
+                ))
         self.database = database
 
+        # Number of messages interpreted, by InterpretStatus.
+        self.status_counts = collections.Counter()
+
+        # Functions handling each type of message, by flag; see register_handler.
+        self.handlers = {}
+        # Calls to each handler, and the seconds spent in them, by flag.
+        self.handler_calls = collections.Counter()
+        self.handler_seconds = collections.Counter()
+
+        self.register_handler(REQUEST_TIME_STRING_FLAG, self._handle_time_request)
+        self.register_handler(DATA_MESSAGE_FLAG, self._parse_data)
+        self.register_handler(FRAME_REQUEST_FLAG, self._handle_frame_request)
+        self.register_handler(BATCH_MESSAGE_FLAG, self._parse_batch)
+
+        # Sequence number of the last batch written, by device; see _parse_batch.
+        self._batch_sequences = {}
+
+    def register_handler(self, flag, handler):
+        """
+        Handle messages with the given flag using the given function, in place of any existing handler.
+        :param flag: Flag of the messages to handle, e.g. "D001".
+        :param handler: Function taking the message, and returning an InterpretResult and the reading to write - a
+        list of them, a Batch to commit before the result is acted on, or None if there isn't one. It should write
+        nothing itself, so readings can be batched by interpret_many.
+        :return:
+        """
+        self.handlers[flag] = handler
+
+    def handler_metrics(self):
+        """
+        :return: Dictionary, by flag, of the calls made to each handler and the total seconds spent in them.
+        """
+        return {
+            flag: {"calls": self.handler_calls[flag], "seconds": self.handler_seconds[flag]}
+            for flag in self.handler_calls
+        }
 
     def interpret(self, message):
         """
@@ -39,19 +142,134 @@ class Interpreter(object):
         :param message: A string; essentially the command to be carried out.
         :return: A message, indicating if everything worked or not.
         """
+        result = self.interpret_result(message)
+        status = result.status
+
+        if status is InterpretStatus.RESPONSE:
+            return result.payload
+        if status is InterpretStatus.WRITTEN:
+            return result.payload
+        if status is InterpretStatus.WRONG_TYPE:
+            raise TypeError(result.payload)
+        if status is InterpretStatus.MISSING_KEYS:
+            raise KeyError(result.payload)
+        if status is InterpretStatus.BAD_VALUES:
+            raise ValueError(result.payload)
+        if status is InterpretStatus.WRITE_FAILED:
+            raise IOError(result.payload)
+        # Empty messages - and offers of frames, with no connection here to accept them for - are simply not
+        # understood, as far as this API is concerned.
+        raise ValueError(ERROR_COULD_NOT_UNDERSTAND)
+
+    def interpret_result(self, message):
+        """
+        Interpret a message without raising for messages that can't be understood.
+        :param message: A string; essentially the command to be carried out.
+        :return: An InterpretResult.
+        """
+        result = self._interpret_result(message)
+        self.status_counts[result.status] += 1
+        return result
+
+    def interpret_frame(self, frame, sensors):
+        """
+        Interpret a binary frame, as taken off a connection that has started frames. See app.frames.
+        :param frame: Bytes of the frame.
+        :param sensors: Names of the sensors of the device the frame came from, by index.
+        :return: An InterpretResult.
+        """
+        result, reading = self._parse_frame(frame, sensors)
+        if reading is not None:
+            self.database.write_to_database(reading)
+        self.status_counts[result.status] += 1
+        return result
 
+    def interpret_many(self, messages, batch_size=1000):
+        """
+        Interpret many messages - e.g. the lines of a captured serial log - writing their data in batches.
+        Messages are taken lazily, so a file or generator of any length can be given. Messages that can't be
+        understood are counted rather than raised. Time requests are counted too, but there is no one to respond to.
+        Like write_to_database, the last batch may wait in the database's buffer until it is flushed.
+        :param messages: An iterable of strings.
+        :param batch_size: Most readings written to the database at once.
+        :return: A collections.Counter of the messages interpreted, by InterpretStatus.
+        """
+        counts = collections.Counter()
+        readings = self._readings(messages, counts)
+        while True:
+            batch = list(itertools.islice(readings, batch_size))
+            if not batch:
+                break
+            self.database.write_many_to_database(batch)
+        self.status_counts.update(counts)
+        return counts
+
+    def _readings(self, messages, counts):
+        """
+        Generate the readings to write from messages, counting every message by status.
+        :param messages: An iterable of strings.
+        :param counts: collections.Counter to count into.
+        :return: Generator of readings.
+        """
+        for message in messages:
+            result, reading = self._classify(message)
+            counts[result.status] += 1
+            if type(reading) is list:
+                yield from reading
+            elif type(reading) is Batch:
+                # Nothing is acknowledged here, but a batch in the log twice is still written once.
+                self._batch_sequences[reading.device] = reading.sequence
+                yield from reading.readings
+            elif reading is not None:
+                yield reading
+
+    def _interpret_result(self, message):
+        """
+        The work behind interpret_result, before counting.
+        :param message:
+        :return: An InterpretResult.
+        """
+        result, reading = self._classify(message)
+        if type(reading) is list:
+            self.database.write_many_to_database(reading)
+        elif type(reading) is Batch:
+            # The acknowledgement tells the device it may forget the readings, so they must be committed first -
+            # not left in a buffer, or on a queue that may drop them.
+            try:
+                self.database.commit_many_to_database(reading.readings)
+            except Exception:
+                logger.exception("Could not commit batch %s from %s.", reading.sequence, reading.device)
+                return WRITE_FAILED_RESULT
+            self._batch_sequences[reading.device] = reading.sequence
+        elif reading is not None:
+            self.database.write_to_database(reading)
+        return result
+
+    def _classify(self, message):
+        """
+        Work out what a message is, and parse it if it is data. Writes nothing.
+        :param message:
+        :return: An InterpretResult, and the reading to write - a list of them, a Batch, or None if there isn't one.
+        """
         # This object is meant to handle strings.
         if not isinstance(message, str):
-            raise TypeError(ERROR_WRONG_TYPE)
+            return WRONG_TYPE_RESULT, None
 
-        # Check for specific requests.
-        if self._message_is_time_request(message):
-            return _get_time_response()
+        # Read timeouts give us a lot of these; get rid of them as cheaply as possible.
+        if not message or message.isspace():
+            return EMPTY_RESULT, None
 
-        if self._message_is_data_message(message):
-            return self._write_to_database(message)
+        flag = _message_flag(message)
+        handler = self.handlers.get(flag)
+        if handler is None:
+            return NOT_UNDERSTOOD_RESULT, None
 
-        raise ValueError(ERROR_COULD_NOT_UNDERSTAND)
+        start = time.perf_counter()
+        try:
+            return handler(message)
+        finally:
+            self.handler_calls[flag] += 1
+            self.handler_seconds[flag] += time.perf_counter() - start
 
     def _message_is_time_request(self, message):
         """
@@ -59,10 +277,7 @@ class Interpreter(object):
         :param message: Message to analyse.
         :return: True/False.
         """
-        if REQUEST_TIME_STRING_FLAG in message:
-            return True
-        else:
-            return False
+        return _message_flag(message) == REQUEST_TIME_STRING_FLAG
 
     def _message_is_data_message(self, message):
         """
@@ -70,37 +285,134 @@ class Interpreter(object):
         :param message: Message to analyse.
         :return: True/False.
         """
-        if DATA_MESSAGE_FLAG in message:
-            return True
-        else:
-            return False
+        return _message_flag(message) == DATA_MESSAGE_FLAG
 
-    def _write_to_database(self, message):
+    def _handle_frame_request(self, message):
         """
-        Function to write a valid data message to an external database object.
-        :param message: Message to pass off.
-        :return: True/False.
+        Read the sensors named by a device offering to send binary frames. Whether to accept is up to whoever owns the
+        connection.
+        :param message: Message to handle.
+        :return: An InterpretResult with the sensor names as its payload, and None as there is nothing to write.
+        """
+        fields = dict(DATA_FIELD_PATTERN.findall(message))
+        if "Sensors" not in fields:
+            return MISSING_KEYS_RESULT, None
+        sensors = tuple(sensor.strip() for sensor in fields["Sensors"].split(";"))
+        # Frames have a single byte for the sensor index.
+        if not all(sensors) or len(sensors) > 256:
+            return BAD_VALUES_RESULT, None
+        return InterpretResult(InterpretStatus.FRAMES, sensors), None
+
+    def _parse_frame(self, frame, sensors):
+        """
+        Parse a binary frame, ready to write to an external database object.
+        :param frame: Bytes of the frame.
+        :param sensors: Names of the sensors of the device the frame came from, by index.
+        :return: An InterpretResult, and the parsed reading - or None if it couldn't be parsed.
+        """
+        try:
+            sensor_index, epoch, value, flags = app.frames.decode_frame(frame)
+        except ValueError:
+            return BAD_VALUES_RESULT, None
+        if sensor_index >= len(sensors):
+            return MISSING_KEYS_RESULT, None
+
+        # The value went over as a float32; keep only the digits it holds, so 22.7 isn't stored as 22.700000762939453.
+        reading = app.database.Reading(
+            sensors[sensor_index], app.frames.epoch_to_datetime(epoch), float("{0:.7g}".format(value)),
+            flags & app.frames.FLAG_DEBUG
+        )
+        return WRITTEN_RESULT, reading
+
+    def _parse_batch(self, message):
+        """
+        Parse a batch of readings, ready to write to an external database object in one go.
+        A device sends a batch again if its acknowledgement is lost; that batch is acknowledged again, but not written
+        twice. The acknowledgement is only sent once the readings have been committed; see _interpret_result.
+        :param message: Message to parse.
+        :return: An InterpretResult with the acknowledgement as its payload, and the Batch - or None if the batch
+        couldn't be parsed, or has already been written.
+        """
+        fields = dict(DATA_FIELD_PATTERN.findall(message))
+        for key in ("Device", "Seq", "Readings"):
+            if key not in fields:
+                return MISSING_KEYS_RESULT, None
+
+        device = fields["Device"]
+        try:
+            sequence = int(fields["Seq"])
+            readings = []
+            for entry in fields["Readings"].split(BATCH_READING_SEPARATOR):
+                if not entry:
+                    continue
+                ID, epoch, value, debug = entry.split(BATCH_FIELD_SEPARATOR)
+                readings.append(
+                    app.database.Reading(ID, app.frames.epoch_to_datetime(int(epoch)), float(value), int(debug))
+                )
+        except ValueError:
+            # Anything wrong, and none of the batch is written; without an acknowledgement, the device sends it again.
+            return BAD_VALUES_RESULT, None
+
+        acknowledgement = "{0},Seq:{1}".format(BATCH_ACKNOWLEDGEMENT_FLAG, sequence)
+        if self._batch_sequences.get(device) == sequence:
+            return InterpretResult(InterpretStatus.RESPONSE, acknowledgement), None
+        return InterpretResult(InterpretStatus.WRITTEN, acknowledgement), Batch(device, sequence, readings)
+
+    def _handle_time_request(self, message):
+        """
+        Respond to a time request with the current time.
+        :param message: Message to handle.
+        :return: An InterpretResult, and None as there is nothing to write.
+        """
+        return InterpretResult(InterpretStatus.RESPONSE, _get_time_response()), None
+
+    def _parse_data(self, message):
+        """
+        Parse a data message, ready to write to an external database object.
+        :param message: Message to parse.
+        :return: An InterpretResult, and the parsed reading - a list of them if the message held several, or None if
+        it couldn't be parsed.
         """
-        parsed_message = _parse_data_message_to_string_dict(message)
         try:
-            parsed_message = _parse_string_dict_to_value_dict(parsed_message)
+            parsed_message = _parse_data_message(message)
         except KeyError:
-            raise KeyError(ERROR_MISSING_KEYS_IN_MESSAGE)
+            return MISSING_KEYS_RESULT, None
         except ValueError:
-            raise ValueError(ERROR_COULD_NOT_PARSE_VALUES)
+            return BAD_VALUES_RESULT, None
 
-        self.database.write_to_database(parsed_message)
+        return WRITTEN_RESULT, parsed_message
 
+
+def _message_flag(message):
+    """
+    Find the flag saying what type of message this is.
+    :param message: Message to analyse.
+    :return: The flag, e.g. "D001", or None if there isn't one.
+    """
+    match = FLAG_PATTERN.match(message)
+    if match is None:
         return None
+    flag = match.group(1)
+    if ":" in flag:
+        # The message starts with some other field; the Flag field, if there is one, is further along.
+        match = FLAG_FIELD_PATTERN.search(message)
+        return None if match is None else match.group(1)
+    return flag
 
 
 def _get_time_response():
     """
     Produce a response for the Arduino timing circuit of format "T%H%M%S%d%m%Y".
     15 characters in total, starting with 'T'.
+    The response only changes once a second, so it is only formatted once a second - however many devices ask.
     :return: Time response string.
     """
-    return time.strftime("T%H%M%S%d%m%Y")
+    global _time_response_second, _time_response
+    second = int(time.time())
+    if second != _time_response_second:
+        _time_response = time.strftime("T%H%M%S%d%m%Y", time.localtime(second))
+        _time_response_second = second
+    return _time_response
 
 
 def _parse_data_message_to_string_dict(message):
@@ -139,9 +451,62 @@ def _parse_string_dict_to_value_dict(string_dict):
             raise KeyError("Expected to find key '{0}' in input dictionary.")
     try:
         output_dict['Value'] = float(string_dict['Value'])
-        output_dict['Time'] = datetime.datetime.strptime(string_dict['Time'], "%H:%M:%S %d/%m/%Y")
+        output_dict['Time'] = datetime.datetime.strptime(string_dict['Time'], TIME_FORMAT)
         output_dict['Debug'] = int(string_dict['Debug'])
     except (TypeError or ValueError):
         raise ValueError("Could not parse values into desired outputs.")
 
     return output_dict
+
+
+def _parse_data_message(message):
+    """
+    Convert a data message straight into a Reading we can pass to our database, in a single pass.
+    Gives the same values as _parse_data_message_to_string_dict followed by _parse_string_dict_to_value_dict.
+    A board with several sensors may send all their readings on one line, as several ID and Value pairs sharing the
+    one Time and Debug, e.g. "Flag:D001,Time:18:40:29 06/03/2017,ID:Temperature,Value:29.1,ID:Humidity,Value:69.2,
+    Debug:0," - the first ID goes with the first Value, and so on.
+    :param message: Data message.
+    :return: app.database.Reading, ready for passing to the database object - or a list of them, for a message with
+    several ID and Value pairs.
+    """
+    pairs = DATA_FIELD_PATTERN.findall(message)
+    fields = dict(pairs)
+
+    for key in app.database.input_database_keys:
+        if key not in fields:
+            raise KeyError("Expected to find key '{0}' in input dictionary.".format(key))
+
+    if len(fields) == len(pairs):
+        # No field repeated - one reading, as most messages are.
+        return app.database.Reading(
+            fields['ID'], _parse_time(fields['Time']), float(fields['Value']), int(fields['Debug'])
+        )
+
+    IDs = [value for key, value in pairs if key == 'ID']
+    values = [value for key, value in pairs if key == 'Value']
+    if len(IDs) != len(values):
+        raise KeyError("Expected an ID for each Value, but found {0} IDs and {1} Values.".format(
+            len(IDs), len(values)
+        ))
+    if len(IDs) == 1:
+        return app.database.Reading(IDs[0], _parse_time(fields['Time']), float(values[0]), int(fields['Debug']))
+
+    # The time is parsed once for the whole line.
+    reading_time = _parse_time(fields['Time'])
+    debug = int(fields['Debug'])
+    return [app.database.Reading(ID, reading_time, float(value), debug) for ID, value in zip(IDs, values)]
+
+
+def _parse_time(time_string):
+    """
+    Convert a time of TIME_FORMAT into a datetime, without the expense of strptime for the usual case.
+    :param time_string: Time string, e.g. "20:47:40 23/01/2017".
+    :return: datetime.datetime.
+    """
+    match = TIME_PATTERN.match(time_string)
+    if match is None:
+        # Anything unusual is left to strptime, which is slower but accepts or rejects exactly what it always has.
+        return datetime.datetime.strptime(time_string, TIME_FORMAT)
+    hour, minute, second, day, month, year = map(int, match.groups())
+    return datetime.datetime(year, month, day, hour, minute, second)
@@ -1,3 +1,5 @@
+#include <Time.h>
+#include <util/crc16.h>
 
 int val = 0;
 char tempSensor[] = "wallace_temp_1";
@@ -6,26 +8,140 @@ String message;
 
 #define TEMP_PIN 0
 #define TEMP_SENSOR_NAME "cupboard_T_001"
+#define TEMP_SENSOR_INDEX 0 // Position of the sensor in the list offered with the frame request.
+
+// Binary frames; see app/frames.py for the layout.
+#define FRAME_SYNC 0xA5
+#define FRAME_PAYLOAD_LENGTH 10
+#define FRAME_FLAG_DEBUG 0x01
+
+bool framesAccepted = false; // Set once the monitor has answered our offer of frames.
+bool framesOffered = false;
+
+// Batches of readings, kept until the monitor acknowledges them - so nothing is lost while it is away.
+// Set USE_BATCHES to 0 to send each reading as it is taken, as a frame or a line of text.
+#define USE_BATCHES 1
+#define DEVICE_NAME "cupboard"
+#define BATCH_CAPACITY 60 // Readings kept while waiting; once full, the oldest are dropped.
+#define BATCH_SIZE 10 // Readings sent together.
+#define ACK_TIMEOUT_MS 5000 // Time to wait for an acknowledgement before sending a batch again.
+
+struct Reading {
+  unsigned long epoch;
+  int value;
+};
+Reading pending[BATCH_CAPACITY];
+int pendingStart = 0;
+int pendingCount = 0;
+int inFlight = 0; // Readings at the front of pending that have been sent, but not acknowledged.
+unsigned int sequence = 0;
+unsigned long sentAt = 0;
 
 void setup() {
   Serial.begin(9600); // Fix the baudrate
   pinMode(13, OUTPUT); // Will be used for basic signalling.
+  // A fresh start to the sequence, so the monitor doesn't take our first batch for a repeat of one sent before a reset.
+  randomSeed(analogRead(1));
+  sequence = random(65536);
 }
 
 void loop() {
-  // Listen first.
-  // Capability is not currently used.
+  // Listen first. The monitor's responses come a line at a time.
   while(Serial.available())
   {
-    message+=char(Serial.read()); // Store the output.
+    char received = char(Serial.read());
+    if (received == '\n') {
+      handle_response(message);
+      message = "";
+    } else {
+      message += received;
+    }
   }
-  message=""; // Not used; clear it out.
 
-  // Take a temperature reading and send it back.
-  int temperature = get_temperature();
-  String output = prepare_reading(TEMP_SENSOR_NAME, temperature);
-  Serial.println(output);
-  delay(1000); 
+  // Readings need a time; until the monitor has given us one, keep asking.
+  if (timeStatus() == timeNotSet) {
+    Serial.println("R001");
+  } else if (USE_BATCHES) {
+    keep_reading(now(), get_temperature());
+    send_batch_if_due();
+  } else {
+    // Offer binary frames once. A monitor that doesn't know them says nothing, and we carry on in text.
+    if (!framesOffered) {
+      Serial.println("Flag:N001,Sensors:" TEMP_SENSOR_NAME ",");
+      framesOffered = true;
+    }
+
+    // Take a temperature reading and send it back.
+    int temperature = get_temperature();
+    if (framesAccepted) {
+      send_frame(TEMP_SENSOR_INDEX, now(), temperature, 0);
+    } else {
+      send_reading(TEMP_SENSOR_NAME, temperature, 0);
+    }
+  }
+  delay(1000);
+}
+
+void handle_response(String response) {
+  if (response.startsWith("T") && response.length() == 15) {
+    // Time response, "THHMMSSddmmYYYY".
+    setTime(response.substring(1, 3).toInt(), response.substring(3, 5).toInt(), response.substring(5, 7).toInt(),
+            response.substring(7, 9).toInt(), response.substring(9, 11).toInt(), response.substring(11, 15).toInt());
+  } else if (response == "F001") {
+    framesAccepted = true;
+  } else if (response.startsWith("A001,Seq:") && inFlight > 0 && response.substring(9).toInt() == sequence) {
+    // The batch is safely with the monitor.
+    pendingStart = (pendingStart + inFlight) % BATCH_CAPACITY;
+    pendingCount -= inFlight;
+    inFlight = 0;
+    sequence++;
+  }
+}
+
+void keep_reading(unsigned long epoch, int value) {
+  if (pendingCount == BATCH_CAPACITY) {
+    if (inFlight == BATCH_CAPACITY) {
+      return; // Every reading is in the batch awaiting acknowledgement; it must go out unchanged if sent again.
+    }
+    // Drop the oldest reading not already sent.
+    for (int i = inFlight; i < pendingCount - 1; i++) {
+      pending[(pendingStart + i) % BATCH_CAPACITY] = pending[(pendingStart + i + 1) % BATCH_CAPACITY];
+    }
+    pendingCount--;
+  }
+  pending[(pendingStart + pendingCount) % BATCH_CAPACITY] = {epoch, value};
+  pendingCount++;
+}
+
+void send_batch_if_due() {
+  if (inFlight > 0) {
+    // Unacknowledged: send the same batch, with the same sequence number, once the wait is over.
+    if (millis() - sentAt < ACK_TIMEOUT_MS) {
+      return;
+    }
+  } else if (pendingCount >= BATCH_SIZE) {
+    inFlight = min(pendingCount, BATCH_SIZE);
+  } else {
+    return;
+  }
+
+  // e.g. "Flag:B001,Device:cupboard,Seq:42,Readings:cupboard_T_001|1485204460|22|0;...,"
+  Serial.print("Flag:B001,Device:" DEVICE_NAME ",Seq:");
+  Serial.print(sequence);
+  Serial.print(",Readings:");
+  for (int i = 0; i < inFlight; i++) {
+    Reading reading = pending[(pendingStart + i) % BATCH_CAPACITY];
+    if (i > 0) {
+      Serial.print(";");
+    }
+    Serial.print(TEMP_SENSOR_NAME "|");
+    Serial.print(reading.epoch);
+    Serial.print("|");
+    Serial.print(reading.value);
+    Serial.print("|0");
+  }
+  Serial.println(",");
+  sentAt = millis();
 }
 
 int get_temperature() {
@@ -36,9 +152,30 @@ int get_temperature() {
   return dat;
 }
 
-String prepare_reading(String tag, int value) {
-  String output = tag + "," + value + ",";
-  return output;
+void send_reading(const char *tag, int value, int debug) {
+  // Text data message, e.g. "Flag:D001,Time:20:47:40 23/01/2017,Value:22,ID:cupboard_T_001,Debug:0,"
+  char output[96];
+  snprintf(output, sizeof(output), "Flag:D001,Time:%02d:%02d:%02d %02d/%02d/%04d,Value:%d,ID:%s,Debug:%d,",
+           hour(), minute(), second(), day(), month(), year(), value, tag, debug);
+  Serial.println(output);
 }
 
+void send_frame(byte sensorIndex, unsigned long epoch, float value, byte flags) {
+  // 14 bytes, against the ~70 of the text message.
+  byte frame[FRAME_PAYLOAD_LENGTH + 4];
+  frame[0] = FRAME_SYNC;
+  frame[1] = FRAME_PAYLOAD_LENGTH;
+  frame[2] = sensorIndex;
+  memcpy(frame + 3, &epoch, 4); // The AVR is little-endian, as the frame is.
+  memcpy(frame + 7, &value, 4);
+  frame[11] = flags;
 
+  // CRC-16/XMODEM of the length and payload.
+  uint16_t crc = 0;
+  for (int i = 1; i < FRAME_PAYLOAD_LENGTH + 2; i++) {
+    crc = _crc_xmodem_update(crc, frame[i]);
+  }
+  frame[12] = crc & 0xFF;
+  frame[13] = crc >> 8;
+  Serial.write(frame, sizeof(frame));
+}
@@ -1,6 +1,10 @@
-import app.interpreter, app.connector, app.database
+import app.interpreter, app.connector, app.database, app.writer, app.config
+import heapq
 import logging
 import os
+import selectors
+import socket
+import time
 import yaml
 
 """
@@ -33,43 +37,138 @@ class Monitor(object):
         self.timeout            = input_parameters['timeout']
         self.connection_type    = input_parameters['connection_type']
 
+        # Optional parameters
+        self.buffer_size        = input_parameters.get('buffer_size', 1)
+        self.flush_interval     = input_parameters.get('flush_interval', None)
+        self.cache_size         = input_parameters.get('cache_size', 2000)
+        self.bulk_read          = input_parameters.get('bulk_read', False)
+        # Where to find the device, for the bluetooth connection_type.
+        self.bt_addr            = input_parameters.get('bt_addr', app.config.bt_addr)
+        self.bt_port            = input_parameters.get('bt_port', app.config.bt_port)
+        # If event_loop is set, run() sleeps until the device has data or a scheduled task is due.
+        self.event_loop             = input_parameters.get('event_loop', False)
+        self.reconnect_interval     = input_parameters.get('reconnect_interval', 5.0)
+        self.health_check_interval  = input_parameters.get('health_check_interval', 30.0)
+        self.schema_version     = input_parameters.get('schema_version', app.database.SCHEMA_V1)
+        self.rollups            = input_parameters.get('rollups', False)
+        self.notify             = input_parameters.get('notify', False)
+        # If writer_queue_size is given, writes are made from a thread of their own; see app.writer.
+        self.writer_queue_size  = input_parameters.get('writer_queue_size', None)
+        self.writer_batch_size  = input_parameters.get('writer_batch_size', 100)
+        self.writer_policy      = input_parameters.get('writer_policy', app.writer.POLICY_BLOCK)
+
         # Define our components
         self.database       = None
+        self.writer         = None  # Whatever the interpreter writes through: the database, or a DatabaseWriter.
         self.interpreter    = None
         self.connector      = None
         self.connection     = None
 
+        # State of the event loop, while it runs.
+        self._selector      = None
+        self._scheduled     = []
+        self._wake_sender   = None
+        self._schedule_sequence = 0
+        self._stopping      = False
+        self._connector_file_descriptor = None  # Registered with the selector while the device is connected.
+
     def generate_components(self):
         """
         :return:
         """
+        self._generate_storage()
+
+        try:
+            if self.connection_type == "serial":
+                self.connection = choose_serial_connection(self.connection_list)
+                self.connector = self._generate_serial_connector(self.connection)
+            if self.connection_type == "bluetooth":
+                self.connector = self._generate_bluetooth_connector()
+        except:
+            raise ValueError("Could not generate the connector object.")
+
+    def _generate_storage(self):
+        """
+        Generate the database, the writer in front of it if one is wanted, and the interpreter that writes to them.
+        :return:
+        """
+        # Release the previous database connection if we are being regenerated.
+        if self.writer is not None:
+            self.writer.close()
+
         # Generate a database object
         try:
-            self.database = app.database.Database(self.database_location, overwrite=self.overwrite)
+            self.database = app.database.Database(
+                self.database_location,
+                overwrite=self.overwrite,
+                buffer_size=self.buffer_size,
+                flush_interval=self.flush_interval,
+                cache_size=self.cache_size,
+                schema_version=self.schema_version,
+                rollups=self.rollups,
+                notify=self.notify
+            )
             self.database.create_database()
         except:
             raise ValueError("Could not generate the database object.")
 
+        if self.writer_queue_size is not None:
+            try:
+                self.writer = app.writer.DatabaseWriter(
+                    self.database,
+                    queue_size=self.writer_queue_size,
+                    batch_size=self.writer_batch_size,
+                    policy=self.writer_policy
+                )
+            except:
+                raise ValueError("Could not generate the database writer object.")
+        else:
+            self.writer = self.database
+
         # Generate the interpreter object
         try:
-            self.interpreter = app.interpreter.Interpreter(self.database)
+            self.interpreter = app.interpreter.Interpreter(self.writer)
         except:
             raise ValueError("Could not generate the interpreter object.")
 
-        try:
-            if self.connection_type == "serial":
-                self.connection = choose_serial_connection(self.connection_list)
-                self.connector = app.connector.SerialConnector(self.connection, time_out=self.timeout)
-            if self.connection_type == "bluetooth":
-                self.connector = app.connector.BluetoothConnector()
-        except:
-            raise ValueError("Could not generate the connector object.")
+    def _generate_serial_connector(self, connection):
+        """
+        :param connection: Name of the serial device, e.g. /dev/ttyUSB0.
+        :return: A SerialConnector for the device, set up for the way the monitor runs.
+        """
+        if self.event_loop:
+            # The event loop only reads once data has arrived, so reads need never wait.
+            return app.connector.SerialConnector(connection, time_out=0, bulk_read=True)
+        return app.connector.SerialConnector(connection, time_out=self.timeout, bulk_read=self.bulk_read)
+
+    def _generate_bluetooth_connector(self):
+        """
+        :return: A BluetoothConnector for the device at bt_addr, set up for the way the monitor runs.
+        """
+        # As for serial, the event loop only reads once data has arrived.
+        time_out = 0 if self.event_loop else self.timeout
+        return app.connector.BluetoothConnector(self.bt_addr, self.bt_port, time_out=time_out)
 
     def run(self, runs=None):
         """
         Begin talking between components.
         :return:
         """
+        try:
+            if self.event_loop and hasattr(self.connector, "fileno"):
+                self._run_event_loop(runs)
+            else:
+                self._run(runs)
+        finally:
+            # Don't lose whatever is still sitting in the write buffer.
+            self.writer.flush()
+
+    def _run(self, runs):
+        """
+        The main loop behind run().
+        :param runs: Number of loops to complete, or None to loop forever.
+        :return:
+        """
         runs_complete = 0
         while True:
             # Check if we have done enough runs
@@ -78,30 +177,240 @@ class Monitor(object):
                     break
                 runs_complete += 1
 
-            # Open the connection if it doesn't exist.
-            if not self.connector.is_connected():
+            # Commit buffered writes that have waited long enough, even if no new data arrives.
+            self.writer.flush_if_due()
+
+            # Open the connection if it doesn't exist. Once open, this is the only check made per loop.
+            connected = self.connector.is_connected()
+            if not connected:
                 logger.info("Device not connected. Attempting to connect now.")
                 self.connector.connect()
+                connected = self.connector.is_connected()
+
+            # Read everything available from the connection, and handle it in one pass.
+            if connected:
+                self._process_messages(self.connector, self.connector.retrieve_messages())
+
+    def _run_event_loop(self, runs):
+        """
+        An alternative to _run() that sleeps until the device has data, or a scheduled task is due.
+        The tasks are reconnecting, committing buffered writes, and checking the connection's health.
+        :param runs: Number of times to wake up, or None to loop until stop() is called.
+        :return:
+        """
+        self._selector = selectors.DefaultSelector()
+        self._scheduled = []
+        self._stopping = False
+        self._connector_file_descriptor = None
+
+        # stop() wakes the loop by writing to this pair.
+        wake_receiver, self._wake_sender = socket.socketpair()
+        wake_receiver.setblocking(False)
+        self._selector.register(wake_receiver, selectors.EVENT_READ)
+
+        self._schedule(0, self._reconnect_task)
+        self._schedule(self.health_check_interval, self._health_check_task)
+        if self.flush_interval is not None:
+            self._schedule(self.flush_interval, self._flush_task)
+
+        try:
+            runs_complete = 0
+            while not self._stopping:
+                if runs is not None:
+                    if runs_complete >= runs:
+                        break
+                    runs_complete += 1
+
+                timeout = None
+                if self._scheduled:
+                    timeout = max(0.0, self._scheduled[0][0] - time.monotonic())
+                for key, events in self._selector.select(timeout):
+                    if key.fileobj is wake_receiver:
+                        wake_receiver.recv(4096)
+                    else:
+                        self._read_connector()
+
+                now = time.monotonic()
+                while self._scheduled and self._scheduled[0][0] <= now:
+                    due, sequence, task = heapq.heappop(self._scheduled)
+                    task()
+        finally:
+            self._unregister_connector()
+            self._selector.close()
+            self._selector = None
+            wake_receiver.close()
+            self._wake_sender.close()
+            self._wake_sender = None
+
+    def stop(self):
+        """
+        Ask the event loop to finish. Safe to call from another thread, or a signal handler.
+        :return:
+        """
+        self._stopping = True
+        try:
+            self._wake_sender.send(b"\0")
+        except (AttributeError, OSError):
+            pass
+
+    def _schedule(self, delay, task):
+        """
+        Have the event loop call a task after a delay.
+        :param delay: Seconds from now.
+        :param task: Function of no arguments.
+        :return:
+        """
+        # The sequence number keeps tasks due at the same time in order, and stops the functions being compared.
+        self._schedule_sequence += 1
+        heapq.heappush(self._scheduled, (time.monotonic() + delay, self._schedule_sequence, task))
+
+    def _reconnect_task(self):
+        """
+        Connect to the device, and start listening to it. Tries again later if the device isn't there.
+        :return:
+        """
+        if self._connector_file_descriptor is not None:
+            return
+        connected = self._connect()
+        if not connected and self.connection_type == "serial":
+            # The device may not have existed when we started, or may have come back under another name.
+            connection = choose_serial_connection(self.connection_list)
+            if connection is not None and connection != self.connection:
+                logger.info("Found device {0}.".format(connection))
+                self.connection = connection
+                self.connector = self._generate_serial_connector(connection)
+                connected = self._connect()
+
+        if connected:
+            logger.info("Device connected.")
+            self._connector_file_descriptor = self.connector.fileno()
+            self._selector.register(self._connector_file_descriptor, selectors.EVENT_READ)
+        else:
+            logger.info("Device not connected. Trying again in {0} seconds.".format(self.reconnect_interval))
+            self._schedule(self.reconnect_interval, self._reconnect_task)
+
+    def _connect(self):
+        """
+        Try to connect the connector.
+        :return: True if it is connected.
+        """
+        try:
+            self.connector.connect()
+            return self.connector.is_connected()
+        except (OSError, TypeError, ValueError) as e:
+            logger.debug(e)
+            return False
+
+    def _health_check_task(self):
+        """
+        Check the connection is still good, as a disconnection isn't always reported as readable.
+        :return:
+        """
+        if self._connector_file_descriptor is not None and not self.connector.is_connected():
+            self._connection_lost()
+        if hasattr(self.writer, "metrics"):
+            logger.debug("Writer: {0}".format(self.writer.metrics()))
+        logger.debug("Handlers: {0}".format(self.interpreter.handler_metrics()))
+        self._schedule(self.health_check_interval, self._health_check_task)
+
+    def _flush_task(self):
+        """
+        Commit buffered writes that have waited long enough, even if no new data arrives.
+        :return:
+        """
+        self.writer.flush_if_due()
+        self._schedule(self.flush_interval, self._flush_task)
+
+    def _read_connector(self):
+        """
+        Read and handle whatever the device has sent.
+        :return:
+        """
+        try:
+            messages = self.connector.retrieve_available_messages()
+        except (OSError, TypeError):
+            self._connection_lost()
+            return
+        self._process_messages(self.connector, messages)
+
+    def _connection_lost(self):
+        """
+        Stop listening to a device that has gone, and schedule a reconnection.
+        :return:
+        """
+        logger.info("Device disconnected.")
+        self._unregister_connector()
+        self.connector.close_connection()
+        self._schedule(self.reconnect_interval, self._reconnect_task)
+
+    def _unregister_connector(self):
+        """
+        :return:
+        """
+        if self._connector_file_descriptor is not None:
+            self._selector.unregister(self._connector_file_descriptor)
+            self._connector_file_descriptor = None
+
+    def _process_messages(self, connector, messages):
+        """
+        Interpret the messages read from a connector in one go, and send back their responses in a single write.
+        A request repeated within the batch - e.g. a device asking for the time again and again while it reconnects -
+        is answered once.
+        :param connector: Connector the messages came from, and the responses go back to.
+        :param messages: Strings retrieved from the connector.
+        :return:
+        """
+        # Responses, in the order they were made, without repeats.
+        responses = {}
+        for message in messages:
+            response = self._process_message(connector, message)
+            if response is not None:
+                responses[response] = None
+
+        if responses:
+            logger.info("Response: %s", ", ".join(responses))
+            # Each response is a line of its own, as the device reads them.
+            connector.write_data("\n".join(responses))
+
+    def _process_message(self, connector, message):
+        """
+        Interpret a single message.
+        :param connector: Connector the message came from.
+        :param message: String retrieved from the connector, or bytes of a binary frame.
+        :return: The response to send back, or None.
+        """
+        if isinstance(message, bytes):
+            result = self.interpreter.interpret_frame(message, connector.frame_sensors)
+            if result.status is not app.interpreter.InterpretStatus.WRITTEN:
+                logger.debug("Frame %s: %s", message.hex(), result.payload)
+            return None
+
+        result = self.interpreter.interpret_result(message)
+
+        # Thanks to the timeout, we do receive a lot of empty messages. Leave them be.
+        if result.status is app.interpreter.InterpretStatus.EMPTY:
+            return None
 
-            # Read from the connection.
-            response = None
-            if self.connector.is_connected():
-                message = self.connector.retrieve_data()
-                # Thanks to the timeout, we do receive a lot of empty messages.
-                if message is not "":
-                    logger.info("Message: {0}".format(message.strip()))
-                else:
-                    logger.debug("Message: {0}".format(message))
-
-                try:
-                    response = self.interpreter.interpret(message)
-                    logger.info("Response: {0}".format(response))
-                except ValueError as e:
-                    logger.debug(e)
-                    if "ERROR" in e.args[0]:
-                        pass
-                if response is not None:
-                    self.connector.write_data(response)
+        logger.info("Message: %s", message.strip())
+        if result.status is app.interpreter.InterpretStatus.RESPONSE:
+            return result.payload
+        if result.status is app.interpreter.InterpretStatus.FRAMES:
+            # Only accept if frames can be read from this connection; otherwise the device carries on in text.
+            if not connector.can_read_frames():
+                logger.info("Device offered binary frames, but its connection is read a line at a time.")
+                return None
+            connector.start_frames(result.payload)
+            logger.info("Device switched to binary frames, for sensors: %s", ", ".join(result.payload))
+            return app.interpreter.FRAMES_ACCEPTED_RESPONSE
+        if result.status is app.interpreter.InterpretStatus.WRITTEN:
+            # A batch is acknowledged; a single reading isn't.
+            return result.payload
+        if result.status is app.interpreter.InterpretStatus.WRITE_FAILED:
+            # Without an acknowledgement, the device keeps the readings, and sends them again.
+            logger.warning(result.payload)
+            return None
+        logger.debug(result.payload)
+        return None
 
 
 def choose_serial_connection(potential_connections):
@@ -0,0 +1,56 @@
+import os
+
+"""
+notifier.py
+Lets other processes - e.g. the web front-end - know that new rows have been written, without them having to keep
+querying the database. The latest row ID is written to a small file beside the database, which readers can watch
+with a cheap os.stat().
+"""
+
+__author__ = 'Goyder'
+
+
+class FileNotifier(object):
+    """
+    Announces the latest row written, through a file.
+    """
+
+    def __init__(self, notify_location):
+        """
+        :param notify_location: Path of the file to write to. By convention, the database path plus ".notify".
+        :return:
+        """
+        self.notify_location = notify_location
+
+    def notify(self, latest_row_ID):
+        """
+        Record the ID of the latest row written.
+        The file is replaced in a single step, so readers never see it half-written.
+        :param latest_row_ID: Integer row ID.
+        :return:
+        """
+        temporary_location = self.notify_location + ".tmp"
+        with open(temporary_location, "w") as f:
+            f.write(str(latest_row_ID))
+        os.replace(temporary_location, self.notify_location)
+
+
+def notify_location_for(database_location):
+    """
+    :param database_location: Path of a database file.
+    :return: Path of the notification file for that database.
+    """
+    return database_location + ".notify"
+
+
+def read_notification(notify_location):
+    """
+    Read the latest row ID announced through a notification file.
+    :param notify_location: Path of the file.
+    :return: Integer row ID, or None if nothing has been announced.
+    """
+    try:
+        with open(notify_location) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
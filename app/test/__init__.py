@@ -1,4 +1,5 @@
 import datetime
+import app.database
 
 DATA_MESSAGE = "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,ID:Temperature,Debug:0,"
 DATA_MESSAGE_DEBUG = "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,ID:Temperature,Debug:1,"
@@ -32,6 +33,9 @@ DATA_MESSAGE_PARSED_DICT_DEBUG = {
     "Value": 22.70,
     "Debug": 1
 }
+# The same, as the Reading records the parser gives.
+DATA_MESSAGE_READING = app.database.Reading.from_mapping(DATA_MESSAGE_PARSED_DICT)
+DATA_MESSAGE_READING_DEBUG = app.database.Reading.from_mapping(DATA_MESSAGE_PARSED_DICT_DEBUG)
 
 # Note that these values assume that this is the first entry in the database.
 DATA_MESSAGE_OUT_OF_DATABASE = (1, 'Temperature', '2017-01-23 20:47:40', 22.7, 0)
@@ -0,0 +1,116 @@
+import unittest
+import os
+import threading
+import time
+import app.async_monitor
+import app.writer
+import app.test
+import app.test.test_database as test_database
+import app.test.test_monitor as test_monitor
+
+"""
+test_async_monitor.py
+Tests for the AsyncMonitor, using pseudo-terminals to stand in for the serial devices.
+"""
+
+__author__ = 'Goyder'
+
+
+def open_pseudo_devices(count):
+    """
+    Open a number of pseudo-terminals for the monitor to connect to.
+    :param count: Number of devices.
+    :return: List of (device file descriptor, name the monitor connects to).
+    """
+    devices = []
+    for _ in range(count):
+        device, terminal = os.openpty()
+        devices.append((device, os.ttyname(terminal), terminal))
+    return devices
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "Pseudo-terminals are not available on this platform.")
+class TestAsyncMonitor(unittest.TestCase):
+    """
+    Run the AsyncMonitor against several devices at once.
+    """
+
+    def setUp(self):
+        self.database_filename = "test.db"
+        test_database.remove_database_files(self.database_filename)
+        self.devices = open_pseudo_devices(20)
+
+    def tearDown(self):
+        for device, name, terminal in self.devices:
+            os.close(device)
+            os.close(terminal)
+
+    def generate_monitor(self, **kwargs):
+        """
+        Build an AsyncMonitor listening to the pseudo-devices.
+        :return:
+        """
+        parameters = test_monitor.generate_input_parameter_object_minus_inputs()
+        parameters["connection_list"] = [name for device, name, terminal in self.devices] + ["/dev/not_a_device"]
+        parameters["rescan_interval"] = 0.1
+        parameters.update(kwargs)
+        monitor = app.async_monitor.AsyncMonitor(parameters)
+        monitor.generate_components()
+        return monitor
+
+    def test_monitor_reads_every_device(self):
+        """
+        Data from every device should reach the database, and each device should get its own time responses.
+        :return:
+        """
+        monitor = self.generate_monitor()
+
+        def send_messages():
+            # Give the monitor a moment to connect, then send a partial line to check it is carried over.
+            time.sleep(0.3)
+            for device, name, terminal in self.devices:
+                os.write(device, (app.test.DATA_MESSAGE + "\nR001\n" + app.test.DATA_MESSAGE[:10]).encode())
+            time.sleep(0.1)
+            for device, name, terminal in self.devices:
+                os.write(device, (app.test.DATA_MESSAGE[10:] + "\n").encode())
+
+        sender = threading.Thread(target=send_messages)
+        sender.start()
+        monitor.run(duration=1.0)
+        sender.join()
+        monitor.writer.close()
+
+        self.assertEqual(
+            2 * len(self.devices),
+            test_database.count_rows(self.database_filename),
+            "Not every device's data reached the database."
+        )
+        for device, name, terminal in self.devices:
+            response = os.read(device, 1024).decode()
+            self.assertEqual(True, response.startswith("T"), "Device {0} got no time response.".format(name))
+
+    def test_monitor_requires_serial(self):
+        parameters = test_monitor.generate_input_parameter_object_minus_inputs()
+        parameters["connection_type"] = "bluetooth"
+        self.assertRaises(TypeError, app.async_monitor.AsyncMonitor, parameters)
+
+    def test_monitor_defaults_to_non_blocking_policy(self):
+        monitor = self.generate_monitor()
+        self.assertEqual(app.writer.POLICY_DROP_OLDEST, monitor.writer.policy, "Writer could block the event loop.")
+        monitor.writer.close()
+
+    def test_monitor_rejects_blocking_policy(self):
+        parameters = test_monitor.generate_input_parameter_object_minus_inputs()
+        parameters["writer_policy"] = app.writer.POLICY_BLOCK
+        self.assertRaises(ValueError, app.async_monitor.AsyncMonitor, parameters)
+
+    def test_monitor_completes_runs(self):
+        """
+        run(runs) should keep the meaning it has for Monitor: stop after that many loops.
+        :return:
+        """
+        monitor = self.generate_monitor(rescan_interval=0.05)
+        start = time.time()
+        monitor.run(3)
+        monitor.writer.close()
+        self.assertEqual(True, time.time() - start < 1.0, "run(runs) did not stop after the given number of runs.")
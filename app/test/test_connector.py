@@ -1,6 +1,8 @@
 import unittest
-import app.interpreter, app.database, app.connector
+import unittest.mock as mock
+import app.interpreter, app.database, app.connector, app.frames
 import os
+import socket
 import time
 
 __author__ = 'Goyder'
@@ -130,5 +132,221 @@ class IntegrationTestSerialConnector(unittest.TestCase):
         )
 
 
+class TestSerialConnectorBulkRead(unittest.TestCase):
+    """
+    Tests of the bulk read mode, against a mocked serial device.
+    """
+
+    def generate_connector(self, chunks, bulk_read=True):
+        """
+        Build a connected SerialConnector whose device delivers the given chunks of bytes, one per read.
+        :param chunks: List of bytes objects.
+        :param bulk_read: Bulk read mode of the connector.
+        :return: The connector and the mocked device.
+        """
+        device = mock.Mock()
+        pending = bytearray()
+        chunks = list(chunks)
+
+        def read(size=1):
+            # The first byte of each chunk is waited for; the rest of it is then in_waiting.
+            if not pending and chunks:
+                pending.extend(chunks.pop(0))
+            received = bytes(pending[:size])
+            del pending[:size]
+            device.in_waiting = len(pending)
+            return received
+
+        device.read.side_effect = read
+        device.in_waiting = 0
+        with mock.patch("app.connector.serial.Serial", return_value=device):
+            connector = app.connector.SerialConnector("/dev/null", time_out=0.1, bulk_read=bulk_read)
+            connector.connect()
+        return connector, device
+
+    def test_bulk_read_returns_all_complete_lines(self):
+        connector, device = self.generate_connector([b"R001\nD001,ID:Temperature\nD001,ID:Humidity\n"])
+
+        messages = connector.retrieve_messages()
+
+        self.assertEqual(
+            True,
+            messages == ["R001\n", "D001,ID:Temperature\n", "D001,ID:Humidity\n"],
+            "Bulk read did not return each line, as readline would have."
+        )
+        self.assertEqual(2, device.read.call_count, "Bulk read should take everything waiting in one more read.")
+
+    def test_bulk_read_carries_partial_lines_over(self):
+        connector, device = self.generate_connector([b"D001,ID:Temp", b"erature\nR0", b"01\n"])
+
+        self.assertEqual(True, connector.retrieve_messages() == [], "A partial line was returned.")
+        self.assertEqual(
+            True,
+            connector.retrieve_messages() == ["D001,ID:Temperature\n"],
+            "Partial line was not completed by the next read."
+        )
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"], "Final line was not returned.")
+
+    def test_bulk_read_returns_nothing_on_timeout(self):
+        connector, device = self.generate_connector([])
+        self.assertEqual(True, connector.retrieve_messages() == [], "Messages were returned from a silent device.")
+
+    def test_bulk_read_discards_overlong_partial_lines(self):
+        noise = b"x" * (app.connector.MAX_PARTIAL_LINE_BYTES + 1)
+        connector, device = self.generate_connector([noise, b"R001\n"])
+
+        connector.retrieve_messages()
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"], "Noise was kept in the partial line.")
+
+    def test_default_mode_reads_a_line(self):
+        connector, device = self.generate_connector([])
+        device.readline.return_value = b"R001\n"
+        connector.bulk_read = False
+
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"], "Default mode should read one line.")
 
+    def test_frames_read_once_started(self):
+        frame = app.frames.encode_frame(1, 1485204460, 22.7)
+        connector, device = self.generate_connector([b"R001\n" + frame[:6], frame[6:] + b"R001\n"])
+        connector.start_frames(["Temperature", "Humidity"])
 
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"], "Line before the frame was not returned.")
+        self.assertEqual(True, connector.retrieve_messages() == [frame, "R001\n"],
+                         "Frame split across reads was not returned whole, with the line after it.")
+        self.assertEqual(True, connector.frame_sensors == ("Temperature", "Humidity"), "Sensors were not kept.")
+
+    def test_frames_need_bulk_read(self):
+        connector, device = self.generate_connector([], bulk_read=False)
+        self.assertEqual(False, connector.can_read_frames(), "Frames can't be read a line at a time.")
+        self.assertRaises(ValueError, connector.start_frames, ["Temperature"])
+
+    def test_reconnecting_returns_to_text(self):
+        connector, device = self.generate_connector([])
+        connector.start_frames(["Temperature"])
+        with mock.patch("app.connector.serial.Serial", return_value=device):
+            connector.connect()
+        self.assertEqual(False, connector.frames, "Device was still expected to send frames after reconnecting.")
+
+
+class TestBluetoothConnector(unittest.TestCase):
+    """
+    Tests of the Bluetooth connector, with one end of a socket pair standing in for the device.
+    """
+
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for connection in self.sockets:
+            connection.close()
+
+    def socket_factory(self, address, port):
+        """
+        Stand-in for rfcomm_socket: connects to a new device end, kept as self.device.
+        :param address:
+        :param port:
+        :return: The monitor's end of the connection.
+        """
+        self.connected_to = (address, port)
+        self.device, connection = socket.socketpair()
+        self.sockets += [self.device, connection]
+        return connection
+
+    def generate_connector(self, time_out=0.1):
+        """
+        :param time_out: Timeout of the connector's reads.
+        :return: A connected BluetoothConnector.
+        """
+        connector = app.connector.BluetoothConnector("98:D3:31:FC:20:34", 1, time_out=time_out,
+                                                     socket_factory=self.socket_factory)
+        connector.connect()
+        return connector
+
+    def test_connects_through_factory(self):
+        connector = app.connector.BluetoothConnector("98:D3:31:FC:20:34", 1, socket_factory=self.socket_factory)
+        self.assertEqual(False, connector.is_connected(), "Connector was connected before connecting.")
+        connector.connect()
+        self.assertEqual(True, connector.is_connected(), "Connector was not connected.")
+        self.assertEqual(True, self.connected_to == ("98:D3:31:FC:20:34", 1), "Device address was not used.")
+
+    def test_lines_carried_over_between_reads(self):
+        connector = self.generate_connector()
+        self.device.sendall(b"R001\nD001,ID:Temp")
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"], "Complete line was not returned.")
+        self.device.sendall(b"erature\n")
+        self.assertEqual(True, connector.retrieve_messages() == ["D001,ID:Temperature\n"],
+                         "Partial line was not completed by the next read.")
+
+    def test_read_times_out_with_nothing(self):
+        connector = self.generate_connector(time_out=0.05)
+        self.assertEqual(True, connector.retrieve_messages() == [], "Messages were returned from a silent device.")
+        connector = self.generate_connector(time_out=0)
+        self.assertEqual(True, connector.retrieve_available_messages() == [], "A read without data waited or failed.")
+        self.assertEqual(True, connector.is_connected(), "A silent device was taken for a lost one.")
+
+    def test_frames_read_once_started(self):
+        frame = app.frames.encode_frame(1, 1485204460, 22.7)
+        connector = self.generate_connector()
+        self.assertEqual(True, connector.can_read_frames(), "Sockets are always read in bulk.")
+        connector.start_frames(["Temperature", "Humidity"])
+        self.device.sendall(b"R001\n" + frame + b"R001\n")
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n", frame, "R001\n"],
+                         "Frame was not returned between the lines.")
+
+    def test_write_data_reaches_device(self):
+        connector = self.generate_connector()
+        connector.write_data("T\nA001,Seq:1")
+        self.device.settimeout(1.0)
+        self.assertEqual(b"T\nA001,Seq:1\n", self.device.recv(64), "Responses were not written in one go.")
+
+    def test_unsent_bytes_kept_for_later(self):
+        connector = self.generate_connector()
+        sent = []
+        results = [BlockingIOError, 2, 4]
+
+        def send(data):
+            # The connector sends from its buffer; keep what it held at the time.
+            sent.append(bytes(data))
+            result = results.pop(0)
+            if result is BlockingIOError:
+                raise result
+            return result
+
+        connector.socket_connection = mock.Mock()
+        connector.socket_connection.send.side_effect = send
+        connector.socket_connection.recv.side_effect = BlockingIOError
+        connector.write_data("T")
+        connector.write_data("F001")
+        connector.retrieve_available_messages()
+        self.assertEqual(True, sent == [b"T\n", b"T\nF001\n", b"F001\n"],
+                         "Bytes the socket couldn't take were not sent again, in order.")
+
+    def test_lost_connection_noticed(self):
+        connector = self.generate_connector()
+        self.device.close()
+        self.assertEqual(False, connector.is_connected(), "A closed connection was reported as connected.")
+
+        connector = self.generate_connector(time_out=0)
+        self.device.close()
+        self.assertRaises(ConnectionError, connector.retrieve_available_messages)
+        self.assertEqual(False, connector.is_connected(), "Connection was not closed once lost.")
+
+        connector = self.generate_connector()
+        self.device.close()
+        self.assertEqual(True, connector.retrieve_messages() == [], "A lost connection returned messages.")
+        self.assertEqual(False, connector.is_connected(), "Connection was not closed once lost.")
+
+    def test_reconnecting_starts_afresh(self):
+        connector = self.generate_connector()
+        connector.start_frames(["Temperature"])
+        self.device.sendall(b"D001,ID:Temp")
+        connector.retrieve_messages()
+        connector.connect()
+        self.device.sendall(b"R001\n")
+        self.assertEqual(False, connector.frames, "Device was still expected to send frames after reconnecting.")
+        self.assertEqual(True, connector.retrieve_messages() == ["R001\n"],
+                         "Bytes from the old connection were kept.")
+
+    def test_rfcomm_unavailable(self):
+        with mock.patch("app.connector.socket", spec=[]):
+            self.assertRaises(OSError, app.connector.rfcomm_socket, "98:D3:31:FC:20:34", 1)
@@ -1,7 +1,7 @@
 import unittest
 import os
 import unittest.mock as mock
-import app.database, app.interpreter
+import app.database, app.interpreter, app.notifier
 import app.test
 import app.test.test_interpreter as test_interpreter
 import sqlite3
@@ -315,6 +315,554 @@ class TestWriteToDatabase(unittest.TestCase):
         )
 
 
+class TestReading(unittest.TestCase):
+    """
+    Test the Reading record, and its conversion to and from the dictionaries readings used to be.
+    """
+
+    def generate_reading(self):
+        return app.database.Reading.from_mapping(app.test.DATA_MESSAGE_PARSED_DICT)
+
+    def test_reading_converts_to_and_from_dictionary(self):
+        reading = self.generate_reading()
+        as_dictionary = reading._asdict()
+        for key in app.database.input_database_keys:
+            self.assertEqual(True, as_dictionary[key] == app.test.DATA_MESSAGE_PARSED_DICT[key],
+                             "Reading did not give back its {0}.".format(key))
+        self.assertEqual(True, app.database.Reading.from_mapping(as_dictionary) == reading,
+                         "Reading did not round trip through a dictionary.")
+        self.assertEqual(True, reading[2] == reading.Value, "Reading could not be indexed as a row.")
+
+    def test_reading_compares_as_tuple(self):
+        reading = self.generate_reading()
+        self.assertEqual(True, reading == tuple(reading), "Reading did not equal its row.")
+        self.assertEqual(False, reading == app.test.DATA_MESSAGE_PARSED_DICT, "Reading equalled a dictionary.")
+        self.assertEqual(True, reading != app.test.DATA_MESSAGE_READING_DEBUG, "Different readings were equal.")
+
+    def test_reading_is_compact(self):
+        reading = self.generate_reading()
+        self.assertRaises(AttributeError, setattr, reading, "Value", 1.0)
+        self.assertEqual(False, hasattr(reading, "__dict__"), "Reading carries a dictionary of its own.")
+
+    def test_readings_and_dictionaries_written_alike(self):
+        database_filename = "test.db"
+        remove_database_files(database_filename)
+        database = app.database.Database(database_filename, buffer_size=2)
+        database.create_database()
+        database.write_to_database(self.generate_reading())
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+
+        with sqlite3.connect(database_filename) as conn:
+            rows = conn.execute("SELECT ID, Time, Value, Debug FROM data;").fetchall()
+        self.assertEqual(True, len(rows) == 2 and rows[0] == rows[1],
+                         "Reading and dictionary were written differently.")
+
+
+class TestBufferedWrites(unittest.TestCase):
+    """
+    Test that the Database object can accumulate writes and commit them together.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        remove_database_files(self.database_filename)
+
+    def test_rows_are_held_until_buffer_is_full(self):
+        """
+        Nothing should be committed until the buffer reaches its size, and then everything should be.
+        """
+        database = app.database.Database(self.database_filename, buffer_size=3)
+        database.create_database()
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        self.assertEqual(
+            0,
+            count_rows(self.database_filename),
+            "Rows were committed before the write buffer was full."
+        )
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        self.assertEqual(
+            3,
+            count_rows(self.database_filename),
+            "Rows were not committed once the write buffer was full."
+        )
+
+    def test_explicit_flush_and_close_commit_rows(self):
+        """
+        Calling flush() or close() should commit whatever is in the buffer.
+        """
+        database = app.database.Database(self.database_filename, buffer_size=100)
+        database.create_database()
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        self.assertEqual(1, database.flush(), "Flush did not report the number of rows written.")
+        self.assertEqual(1, count_rows(self.database_filename), "Flush did not commit the buffered row.")
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+        self.assertEqual(2, count_rows(self.database_filename), "Close did not commit the buffered row.")
+
+    def test_rows_are_flushed_once_deadline_passes(self):
+        """
+        A row should not sit in the buffer longer than the flush interval.
+        """
+        database = app.database.Database(self.database_filename, buffer_size=100, flush_interval=0.0)
+        database.create_database()
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        self.assertEqual(
+            1,
+            count_rows(self.database_filename),
+            "Row was not committed even though the flush interval had passed."
+        )
+        self.assertEqual(False, database.flush_if_due(), "An empty buffer should not need flushing.")
+
+    def test_commit_many_commits_and_counts_everything(self):
+        """
+        commit_many_to_database should commit the rows given and those already buffered, and count them all - even
+        where the buffer size alone would have committed some on the way.
+        """
+        database = app.database.Database(self.database_filename, buffer_size=2)
+        database.create_database()
+
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        committed = database.commit_many_to_database([app.test.DATA_MESSAGE_PARSED_DICT] * 3)
+        self.assertEqual(4, committed, "Rows committed were not all counted.")
+        self.assertEqual(4, count_rows(self.database_filename), "Rows were not all committed.")
+
+    def test_buffer_size_must_be_positive(self):
+        """
+        A buffer that can hold nothing makes no sense.
+        """
+        self.assertRaises(ValueError, app.database.Database, self.database_filename, buffer_size=0)
+
+
+class TestDatabaseConnection(unittest.TestCase):
+    """
+    Test that the Database object holds a single, tuned connection.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        remove_database_files(self.database_filename)
+
+    def test_connection_is_reused(self):
+        """
+        Creating, validating and writing should all happen over the same connection.
+        """
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        connection = database.connection
+
+        database.database_is_valid()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+
+        self.assertEqual(
+            True,
+            database.connection is connection,
+            "Database opened a new connection instead of reusing the existing one."
+        )
+
+    def test_database_uses_write_ahead_log(self):
+        """
+        The database should be created in WAL mode, so readers are not blocked by the writer.
+        """
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.close()
+
+        with sqlite3.connect(self.database_filename) as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+
+        self.assertEqual("wal", journal_mode, "Database was not created in WAL mode.")
+
+    def test_close_releases_connection(self):
+        """
+        Closing the database should commit buffered rows and release the connection.
+        """
+        database = app.database.Database(self.database_filename, buffer_size=10)
+        database.create_database()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+
+        self.assertEqual(None, database.connection, "Connection was not released on close.")
+        self.assertEqual(1, count_rows(self.database_filename), "Buffered row was not committed on close.")
+
+
+class TestDatabaseIndexes(unittest.TestCase):
+    """
+    Test that the database carries the indexes the web front-end relies on.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        remove_database_files(self.database_filename)
+
+    def test_new_database_has_indexes(self):
+        """
+        A freshly created database should have all of our indexes.
+        """
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.close()
+
+        index_names = extract_index_names(self.database_filename)
+        for index_name in app.database.index_definitions.keys():
+            self.assertEqual(
+                True,
+                index_name in index_names,
+                "Database creation did not build index: {0}".format(index_name)
+            )
+
+    def test_existing_database_is_upgraded_with_indexes(self):
+        """
+        A valid database from before the indexes existed should gain them, and keep its data.
+        """
+        with sqlite3.connect(self.database_filename) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+            CREATE TABLE data(
+                row_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                ID VARCHAR,
+                Time DATETIME,
+                Value REAL,
+                Debug INTEGER
+            );
+            """)
+            cur.execute("INSERT INTO data (ID, Time, Value, Debug) VALUES (?, ?, ?, ?);",
+                        ("Temperature", datetime.datetime.now(), 20.0, 0))
+            conn.commit()
+
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.close()
+
+        index_names = extract_index_names(self.database_filename)
+        for index_name in app.database.index_definitions.keys():
+            self.assertEqual(
+                True,
+                index_name in index_names,
+                "Existing database was not upgraded with index: {0}".format(index_name)
+            )
+        self.assertEqual(1, count_rows(self.database_filename), "Existing data was lost during upgrade.")
+
+
+class TestCompactSchema(unittest.TestCase):
+    """
+    Test the compact (version 2) database layout, and migration to it from the original layout.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        remove_database_files(self.database_filename)
+
+    def test_compact_database_round_trips_through_data_view(self):
+        """
+        A value written to a compact database should read back from the 'data' view as it would from the original.
+        """
+        database = app.database.Database(self.database_filename, schema_version=app.database.SCHEMA_V2)
+        database.create_database()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+
+        with sqlite3.connect(self.database_filename) as conn:
+            output_data = conn.execute("SELECT * FROM data;").fetchone()
+            stored_time = conn.execute("SELECT Time FROM readings;").fetchone()[0]
+
+        self.assertEqual(
+            app.test.DATA_MESSAGE_OUT_OF_DATABASE,
+            output_data,
+            "Data read back from the compact layout did not match the original layout."
+        )
+        self.assertEqual(
+            app.database.datetime_to_epoch_ms(app.test.DATA_MESSAGE_PARSED_DICT["Time"]),
+            stored_time,
+            "Time was not stored as epoch milliseconds."
+        )
+
+    def test_compact_database_is_recognised_as_valid(self):
+        """
+        Reopening a compact database should recognise its layout rather than rejecting it.
+        """
+        database = app.database.Database(self.database_filename, schema_version=app.database.SCHEMA_V2)
+        database.create_database()
+        database.close()
+
+        database = app.database.Database(self.database_filename)
+        self.assertEqual(True, database.database_is_valid(), "Compact database was not recognised as valid.")
+        database.create_database()
+        self.assertEqual(
+            app.database.SCHEMA_V2,
+            database.schema_version,
+            "Database object did not adopt the layout of the existing file."
+        )
+
+    def test_original_database_is_migrated(self):
+        """
+        Opening an original database with schema_version 2 should migrate it, keeping every row.
+        """
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT_DEBUG)
+        database.close()
+
+        with sqlite3.connect(self.database_filename) as conn:
+            original_data = conn.execute("SELECT * FROM data ORDER BY row_ID;").fetchall()
+
+        database = app.database.Database(self.database_filename, schema_version=app.database.SCHEMA_V2)
+        database.create_database()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+
+        with sqlite3.connect(self.database_filename) as conn:
+            migrated_data = conn.execute("SELECT * FROM data ORDER BY row_ID;").fetchall()
+            sensors = conn.execute("SELECT ID FROM sensors;").fetchall()
+
+        self.assertEqual(original_data, migrated_data[:2], "Migrated data did not match the original data.")
+        self.assertEqual(3, len(migrated_data), "Could not write to the database after migration.")
+        self.assertEqual([("Temperature",)], sensors, "Sensor IDs were not stored once each.")
+
+    def test_invalid_schema_version_rejected(self):
+        """
+        Only the layouts we know about can be asked for.
+        """
+        self.assertRaises(ValueError, app.database.Database, self.database_filename, schema_version=3)
+
+
+class TestRollups(unittest.TestCase):
+    """
+    Test the minute/hour/day rollup tables.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        remove_database_files(self.database_filename)
+
+    def write_sample_readings(self, database):
+        """
+        Write a spread of readings across two sensors, several minutes and two days.
+        :param database: Database object to write to.
+        :return:
+        """
+        start = datetime.datetime(2017, 1, 23, 23, 58, 0)
+        for i in range(300):
+            for sensor_ID in ("Temperature", "Humidity"):
+                database.write_to_database({
+                    "ID": sensor_ID,
+                    "Time": start + datetime.timedelta(seconds=i * 2),
+                    "Value": float(i % 17),
+                    "Debug": 0
+                })
+        database.flush()
+
+    def check_incremental_rollups_match_backfill(self, schema_version):
+        """
+        Rollups updated as rows are written must equal rollups rebuilt from scratch.
+        :param schema_version: Layout of database to test.
+        :return:
+        """
+        database = app.database.Database(
+            self.database_filename,
+            buffer_size=7,
+            schema_version=schema_version,
+            rollups=True
+        )
+        database.create_database()
+        self.write_sample_readings(database)
+
+        incremental = extract_rollups(self.database_filename)
+        database.backfill_rollups()
+        database.close()
+        backfilled = extract_rollups(self.database_filename)
+
+        for resolution in app.database.rollup_resolutions.keys():
+            self.assertEqual(
+                True,
+                len(backfilled[resolution]) > 0,
+                "Backfill produced no rows at resolution: {0}".format(resolution)
+            )
+            self.assertEqual(
+                len(backfilled[resolution]),
+                len(incremental[resolution]),
+                "Incremental rollups had a different number of buckets at resolution: {0}".format(resolution)
+            )
+            for incremental_row, backfilled_row in zip(incremental[resolution], backfilled[resolution]):
+                self.assertEqual(incremental_row[:3], backfilled_row[:3], "Rollup bucket or count differed.")
+                self.assertAlmostEqual(incremental_row[3], backfilled_row[3], msg="Rollup total differed.")
+                self.assertEqual(incremental_row[4:], backfilled_row[4:], "Rollup minimum or maximum differed.")
+
+    def test_incremental_rollups_match_backfill(self):
+        """
+        Check the original layout.
+        """
+        self.check_incremental_rollups_match_backfill(app.database.SCHEMA_V1)
+
+    def test_incremental_rollups_match_backfill_compact_layout(self):
+        """
+        Check the compact layout.
+        """
+        self.check_incremental_rollups_match_backfill(app.database.SCHEMA_V2)
+
+    def test_rollups_are_maintained_without_being_requested(self):
+        """
+        Once a database has rollups, later writers must keep them up to date even if they didn't ask for them.
+        """
+        database = app.database.Database(self.database_filename, rollups=True)
+        database.create_database()
+        database.close()
+
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.write_to_database(app.test.DATA_MESSAGE_PARSED_DICT)
+        database.close()
+
+        rollups = extract_rollups(self.database_filename)
+        self.assertEqual(
+            [("2017-01-23 20:00:00", "Temperature", 1, 22.7, 22.7, 22.7)],
+            rollups["hour"],
+            "Rollups were not updated by a writer that did not request them."
+        )
+
+
+class TestNotification(unittest.TestCase):
+    """
+    Test the notification file written for other processes after each commit.
+    """
+
+    def setUp(self):
+        """
+        Start each test from a fresh database file, with no notification file.
+        :return:
+        """
+        self.database_filename = "test.db"
+        self.notify_filename = app.notifier.notify_location_for(self.database_filename)
+        remove_database_files(self.database_filename)
+        if os.path.exists(self.notify_filename):
+            os.remove(self.notify_filename)
+
+    def tearDown(self):
+        """
+        :return:
+        """
+        if os.path.exists(self.notify_filename):
+            os.remove(self.notify_filename)
+
+    def check_notification_follows_commits(self, schema_version):
+        """
+        The notification file should hold the row ID of the latest committed row, and only change on a commit.
+        :param schema_version: Layout of database to test.
+        :return:
+        """
+        database = app.database.Database(self.database_filename, buffer_size=3, schema_version=schema_version,
+                                          notify=True)
+        database.create_database()
+        for i in range(2):
+            database.write_to_database({"ID": "Temperature", "Time": datetime.datetime(2017, 1, 23, 12, 0, i),
+                                        "Value": 20.0, "Debug": 0})
+        self.assertEqual(
+            None,
+            app.notifier.read_notification(self.notify_filename),
+            "A notification was written before any rows were committed."
+        )
+
+        database.write_to_database({"ID": "Temperature", "Time": datetime.datetime(2017, 1, 23, 12, 0, 2),
+                                    "Value": 20.0, "Debug": 0})
+        self.assertEqual(3, app.notifier.read_notification(self.notify_filename), "Notification after first commit.")
+
+        database.write_to_database({"ID": "Humidity", "Time": datetime.datetime(2017, 1, 23, 12, 0, 3),
+                                    "Value": 50.0, "Debug": 0})
+        database.close()
+        self.assertEqual(4, app.notifier.read_notification(self.notify_filename), "Notification after final flush.")
+
+    def test_notification_follows_commits(self):
+        self.check_notification_follows_commits(app.database.SCHEMA_V1)
+
+    def test_notification_follows_commits_compact_schema(self):
+        self.check_notification_follows_commits(app.database.SCHEMA_V2)
+
+    def test_no_notification_by_default(self):
+        database = app.database.Database(self.database_filename)
+        database.create_database()
+        database.write_to_database({"ID": "Temperature", "Time": datetime.datetime(2017, 1, 23, 12, 0, 0),
+                                    "Value": 20.0, "Debug": 0})
+        database.close()
+        self.assertEqual(False, os.path.exists(self.notify_filename), "Notification file written without notify.")
+
+
+def remove_database_files(database_filename):
+    """
+    Remove a database file, along with any write-ahead log left beside it - or it would be replayed into the next
+    database created under the same name.
+    :param database_filename: Filename of the database.
+    :return:
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database_filename + suffix):
+            os.remove(database_filename + suffix)
+
+
+def extract_rollups(database_filename):
+    """
+    Read every rollup table of a database file.
+    :param database_filename: Filename of a database to examine.
+    :return: Dictionary of resolution: rows of (Time, sensor, Count, Total, Minimum, Maximum).
+    """
+    rollups = {}
+    with sqlite3.connect(database_filename) as conn:
+        cur = conn.cursor()
+        for resolution in app.database.rollup_resolutions.keys():
+            cur = cur.execute("SELECT * FROM rollup_{0} ORDER BY 1, 2;".format(resolution))
+            rollups[resolution] = cur.fetchall()
+    return rollups
+
+
+def extract_index_names(database_filename):
+    """
+    For a given database file, list the indexes built on the data table.
+    :param database_filename: Filename of a database to examine.
+    :return: Tuple of index names.
+    """
+    with sqlite3.connect(database_filename) as conn:
+        cur = conn.cursor()
+        cur = cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'data';")
+        return tuple([row[0] for row in cur.fetchall()])
+
+
+def count_rows(database_filename):
+    """
+    Count the rows committed to the data table of a database file.
+    :param database_filename: Filename of a database to examine.
+    :return: Number of rows.
+    """
+    with sqlite3.connect(database_filename) as conn:
+        cur = conn.cursor()
+        return cur.execute("SELECT count(*) FROM data;").fetchone()[0]
+
+
 def extract_column_names(database_filename):
     """
     For a given database file, ensure that we can go in and extract the right column names from the database we want.
@@ -0,0 +1,91 @@
+import unittest
+import datetime
+import struct
+import app.frames
+
+"""
+test_frames.py
+Tests for the binary frames a device may send readings in.
+"""
+
+__author__ = 'Goyder'
+
+# 20:47:40 23/01/2017, on the device's clock.
+EPOCH = 1485204460
+
+
+class TestFrameEncoding(unittest.TestCase):
+    """
+    Test building and unpacking single frames.
+    """
+
+    def test_frame_layout(self):
+        frame = app.frames.encode_frame(3, EPOCH, 22.7, app.frames.FLAG_DEBUG)
+        self.assertEqual(app.frames.FRAME_SIZE, len(frame), "Frame was not of the expected size.")
+        self.assertEqual(14, len(frame), "Frame has grown.")
+        self.assertEqual(True, frame[:2] == bytes([app.frames.SYNC, 10]), "Frame did not start with sync and length.")
+        self.assertEqual(True, struct.unpack("<BIfB", frame[2:12])[:2] == (3, EPOCH),
+                         "Payload was not little-endian sensor index and time.")
+
+    def test_frame_round_trip(self):
+        sensor_index, epoch, value, flags = app.frames.decode_frame(app.frames.encode_frame(3, EPOCH, -1.5, 1))
+        self.assertEqual(True, (sensor_index, epoch, value, flags) == (3, EPOCH, -1.5, 1), "Frame did not round trip.")
+
+    def test_decode_rejects_other_frames(self):
+        self.assertRaises(ValueError, app.frames.decode_frame, app.frames.encode_frame(0, EPOCH, 1.0)[:-1])
+
+    def test_epoch_to_datetime(self):
+        self.assertEqual(True, app.frames.epoch_to_datetime(EPOCH) == datetime.datetime(2017, 1, 23, 20, 47, 40),
+                         "Device time was not converted as the text messages give it.")
+
+
+class TestTakeMessages(unittest.TestCase):
+    """
+    Test taking frames and text lines off a stream of received bytes.
+    """
+
+    def take(self, received):
+        """
+        :param received: Bytes received.
+        :return: The messages and bad frame count, and what was left behind.
+        """
+        received = bytearray(received)
+        messages, bad_frames = app.frames.take_messages(received)
+        return messages, bad_frames, bytes(received)
+
+    def test_frames_and_lines_mixed(self):
+        first = app.frames.encode_frame(0, EPOCH, 1.0)
+        second = app.frames.encode_frame(1, EPOCH, 2.0)
+        messages, bad_frames, left = self.take(b"R001\n" + first + second + b"R001\n")
+        self.assertEqual(True, messages == ["R001\n", first, second, "R001\n"], "Messages were not taken in order.")
+        self.assertEqual(0, bad_frames, "Good frames were counted as bad.")
+        self.assertEqual(b"", left, "Bytes were left behind.")
+
+    def test_frame_containing_newline(self):
+        # A value whose bytes include a newline must not split the frame.
+        frame = app.frames.encode_frame(ord("\n"), ord("\n"), 0.0)
+        messages, bad_frames, left = self.take(frame)
+        self.assertEqual(True, messages == [frame], "Frame was split at a newline byte.")
+
+    def test_partial_messages_kept(self):
+        frame = app.frames.encode_frame(0, EPOCH, 1.0)
+        for received in [frame[:1], frame[:5], b"R00", frame + b"R0"]:
+            messages, bad_frames, left = self.take(received)
+            expected_left = received[len(frame):] if received.startswith(frame) else received
+            self.assertEqual(True, left == expected_left, "Partial message {0!r} was not kept.".format(received))
+
+    def test_bad_frame_skipped(self):
+        good = app.frames.encode_frame(0, EPOCH, 1.0)
+        bad = bytearray(app.frames.encode_frame(1, EPOCH, 2.0))
+        bad[8] ^= 0xFF
+        messages, bad_frames, left = self.take(bytes(bad) + good + b"R001\n")
+        self.assertEqual(1, bad_frames, "Bad frame was not counted.")
+        # The rest of the bad frame is searched again, and may give up garbage lines - here, an empty one, as the
+        # length byte is a newline. The interpreter makes nothing of them.
+        messages = [message for message in messages if not (isinstance(message, str) and message.isspace())]
+        self.assertEqual(True, messages == [good, "R001\n"], "Stream did not recover after a bad frame.")
+
+    def test_text_cut_short_by_frame_discarded(self):
+        frame = app.frames.encode_frame(0, EPOCH, 1.0)
+        messages, bad_frames, left = self.take(b"Flag:D001,Ti" + frame)
+        self.assertEqual(True, messages == [frame], "Text cut short by a frame was kept.")
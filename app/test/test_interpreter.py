@@ -1,10 +1,13 @@
 import unittest
 import unittest.mock as mock
 import importlib
+import datetime
 import app.interpreter
 import app.database
+import app.frames
+import app.writer
 from app.test import DATA_MESSAGE, DATA_MESSAGE_DEBUG, DATA_MESSAGE_DICT, DATA_MESSAGE_DICT_DEBUG, \
-    DATA_MESSAGE_PARSED_DICT
+    DATA_MESSAGE_PARSED_DICT, DATA_MESSAGE_PARSED_DICT_DEBUG, DATA_MESSAGE_READING, DATA_MESSAGE_READING_DEBUG
 
 """
 test_interpreter.py
@@ -122,6 +125,18 @@ class TestInterpreterTimeResponses(unittest.TestCase):
         )
 
 
+    def test_time_response_made_once_a_second(self):
+        importlib.reload(app.interpreter)
+        with mock.patch("app.interpreter.time.time", side_effect=[1000.1, 1000.9, 1001.0]), \
+                mock.patch("app.interpreter.time.strftime", side_effect=["T1", "T2"]) as strftime:
+            responses = [app.interpreter._get_time_response() for _ in range(3)]
+
+        self.assertEqual(True, responses == ["T1", "T1", "T2"], "Time response was not reused within the second.")
+        self.assertEqual(2, strftime.call_count, "Time response was formatted more than once a second.")
+        self.assertEqual(True, strftime.call_args_list[1][0][1] == app.interpreter.time.localtime(1001),
+                         "Time response was not formatted for the new second.")
+
+
 class TestInterpreterDatabaseCalls(unittest.TestCase):
     """
     Tests to query that the interpreter is making the right calls to the database object when it receives a valid
@@ -168,7 +183,7 @@ class TestInterpreterDatabaseCalls(unittest.TestCase):
 
         interpreter.database.write_to_database = mock.Mock()
         interpreter.interpret(DATA_MESSAGE)
-        interpreter.database.write_to_database.assert_called_with(DATA_MESSAGE_PARSED_DICT)
+        interpreter.database.write_to_database.assert_called_with(DATA_MESSAGE_READING)
 
     def test_interpreter_write_to_database_fails_with_missing_keys(self):
         """
@@ -199,6 +214,395 @@ class TestInterpreterDatabaseCalls(unittest.TestCase):
             self.assertRaises(ValueError, interpreter.interpret, mangled_message)
 
 
+class TestInterpreterResults(unittest.TestCase):
+    """
+    Tests of the result-object API, which reports problems without raising.
+    """
+
+    def setUp(self):
+        """
+        Ensure that we don't have overlap with other mocks from other classes.
+        :return:
+        """
+        importlib.reload(app.interpreter)
+
+    def check_status(self, message, status):
+        """
+        Interpret a message, and check its status.
+        :param message: Message to interpret.
+        :param status: InterpretStatus expected.
+        :return: The result.
+        """
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result(message)
+        self.assertEqual(
+            True,
+            result.status is status,
+            "Message {0!r} gave status {1}, not {2}.".format(message, result.status, status)
+        )
+        return result
+
+    def test_empty_and_whitespace_messages(self):
+        for message in ["", "\n", "  \r\n"]:
+            result = self.check_status(message, app.interpreter.InterpretStatus.EMPTY)
+            self.assertEqual(None, result.payload, "Empty message had a payload.")
+
+    def test_time_request(self):
+        result = self.check_status("R001\n", app.interpreter.InterpretStatus.RESPONSE)
+        self.assertEqual(True, result.payload.startswith("T"), "Time request did not give a time response.")
+
+    def test_data_message_is_written(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result(DATA_MESSAGE)
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITTEN, "Data was not written.")
+        interpreter.database.write_to_database.assert_called_with(DATA_MESSAGE_READING)
+
+    def test_error_statuses(self):
+        result = self.check_status("garbage message.", app.interpreter.InterpretStatus.NOT_UNDERSTOOD)
+        self.assertEqual(app.interpreter.ERROR_COULD_NOT_UNDERSTAND, result.payload, "Wrong error message.")
+        result = self.check_status(DATA_MESSAGE.replace("Value", ""), app.interpreter.InterpretStatus.MISSING_KEYS)
+        self.assertEqual(app.interpreter.ERROR_MISSING_KEYS_IN_MESSAGE, result.payload, "Wrong error message.")
+        result = self.check_status(DATA_MESSAGE.replace("22.70", "Unparseable."),
+                                   app.interpreter.InterpretStatus.BAD_VALUES)
+        self.assertEqual(app.interpreter.ERROR_COULD_NOT_PARSE_VALUES, result.payload, "Wrong error message.")
+        result = self.check_status(1.0, app.interpreter.InterpretStatus.WRONG_TYPE)
+        self.assertEqual(app.interpreter.ERROR_WRONG_TYPE, result.payload, "Wrong error message.")
+
+    def test_errors_are_not_written(self):
+        interpreter = generate_interpreter_object()
+        for message in ["", "garbage message.", DATA_MESSAGE.replace("Value", "")]:
+            interpreter.interpret_result(message)
+        self.assertEqual(False, interpreter.database.write_to_database.called, "A bad message was written.")
+
+    def test_interpret_still_raises(self):
+        """
+        The raising API should raise just as it did before the result API existed.
+        :return:
+        """
+        interpreter = generate_interpreter_object()
+        self.assertRaises(ValueError, interpreter.interpret, "")
+        self.assertRaises(ValueError, interpreter.interpret, "garbage message.")
+        self.assertRaises(KeyError, interpreter.interpret, DATA_MESSAGE.replace("Value", ""))
+        self.assertRaises(ValueError, interpreter.interpret, DATA_MESSAGE.replace("22.70", "Unparseable."))
+        self.assertRaises(TypeError, interpreter.interpret, 1.0)
+        self.assertEqual(None, interpreter.interpret(DATA_MESSAGE), "Data message gave a response.")
+
+    def test_status_counts(self):
+        interpreter = generate_interpreter_object()
+        for message in ["", "", "R001", DATA_MESSAGE, "garbage message.", "garbage message.", "garbage message."]:
+            interpreter.interpret_result(message)
+        self.assertRaises(ValueError, interpreter.interpret, "")
+
+        counts = interpreter.status_counts
+        self.assertEqual(3, counts[app.interpreter.InterpretStatus.EMPTY], "Empty messages miscounted.")
+        self.assertEqual(1, counts[app.interpreter.InterpretStatus.RESPONSE], "Responses miscounted.")
+        self.assertEqual(1, counts[app.interpreter.InterpretStatus.WRITTEN], "Writes miscounted.")
+        self.assertEqual(3, counts[app.interpreter.InterpretStatus.NOT_UNDERSTOOD], "Errors miscounted.")
+
+
+class TestInterpreterMany(unittest.TestCase):
+    """
+    Tests of interpret_many, for replaying logs and loading historical data.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def test_readings_written_in_batches(self):
+        interpreter = generate_interpreter_object()
+        counts = interpreter.interpret_many([DATA_MESSAGE] * 7, batch_size=3)
+
+        batches = [call[0][0] for call in interpreter.database.write_many_to_database.call_args_list]
+        self.assertEqual(True, [len(batch) for batch in batches] == [3, 3, 1], "Readings were not batched.")
+        self.assertEqual(True, all(reading == DATA_MESSAGE_READING for batch in batches for reading in batch),
+                         "Readings were not parsed correctly.")
+        self.assertEqual(False, interpreter.database.write_to_database.called, "Readings were written one at a time.")
+        self.assertEqual(7, counts[app.interpreter.InterpretStatus.WRITTEN], "Written readings were not counted.")
+
+    def test_bad_messages_counted_not_raised(self):
+        interpreter = generate_interpreter_object()
+        messages = [DATA_MESSAGE, "", "R001", "Garbage", DATA_MESSAGE.replace("ID:", "Name:"),
+                    DATA_MESSAGE.replace("22.70", "warm"), 5,
+                    DATA_MESSAGE_DEBUG]
+        counts = interpreter.interpret_many(messages)
+
+        statuses = app.interpreter.InterpretStatus
+        expected = {statuses.WRITTEN: 2, statuses.EMPTY: 1, statuses.RESPONSE: 1, statuses.NOT_UNDERSTOOD: 1,
+                    statuses.MISSING_KEYS: 1, statuses.BAD_VALUES: 1, statuses.WRONG_TYPE: 1}
+        self.assertEqual(True, counts == expected, "Messages were not counted by status: {0}".format(counts))
+        self.assertEqual(True, interpreter.status_counts == expected, "Interpreter's counts were not updated.")
+
+    def test_messages_taken_lazily(self):
+        interpreter = generate_interpreter_object()
+        taken = []
+
+        def messages():
+            for i in range(5):
+                taken.append(i)
+                yield DATA_MESSAGE
+
+        def check_lazy(batch):
+            written = sum(len(call[0][0]) for call in interpreter.database.write_many_to_database.call_args_list)
+            self.assertEqual(written, len(taken), "Messages were taken before they were needed.")
+
+        interpreter.database.write_many_to_database.side_effect = check_lazy
+        interpreter.interpret_many(messages(), batch_size=2)
+        self.assertEqual(3, interpreter.database.write_many_to_database.call_count, "Readings were not all written.")
+
+    def test_nothing_written_without_data(self):
+        interpreter = generate_interpreter_object()
+        interpreter.interpret_many(iter(["R001", ""]))
+        self.assertEqual(False, interpreter.database.write_many_to_database.called, "An empty batch was written.")
+
+
+class TestInterpreterHandlers(unittest.TestCase):
+    """
+    Tests of dispatching messages to handlers by their flag.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def test_message_flag(self):
+        flags = {
+            "R001\n": "R001",
+            "R001 - please set time.": "R001",
+            DATA_MESSAGE: "D001",
+            "  Flag:D001,ID:Temperature": "D001",
+            "ID:Temperature,Flag:D001,Value:1": "D001",
+            "ID:Temperature,Value:1": None,
+            "garbage message.": "garbage",
+        }
+        for message, flag in flags.items():
+            self.assertEqual(flag, app.interpreter._message_flag(message), "Wrong flag for {0!r}.".format(message))
+
+    def test_flags_elsewhere_in_message_ignored(self):
+        interpreter = generate_interpreter_object()
+        message = DATA_MESSAGE.replace("ID:Temperature", "ID:R001_Temperature")
+        result = interpreter.interpret_result(message)
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITTEN,
+                         "Data message with R001 in its ID was not written.")
+
+        result = interpreter.interpret_result("S001,ID:D001,Value:1")
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.NOT_UNDERSTOOD,
+                         "Message was taken for data because of its ID.")
+
+    def test_registered_handler_used(self):
+        interpreter = generate_interpreter_object()
+        handled = []
+
+        def handle_status(message):
+            handled.append(message)
+            return app.interpreter.InterpretResult(app.interpreter.InterpretStatus.RESPONSE, "OK"), None
+
+        interpreter.register_handler("S001", handle_status)
+        self.assertEqual("OK", interpreter.interpret("S001,Battery:4.1\n"), "Registered handler's response was lost.")
+        self.assertEqual(True, handled == ["S001,Battery:4.1\n"], "Registered handler was not called.")
+
+    def test_handler_metrics(self):
+        interpreter = generate_interpreter_object()
+        for message in ["R001", DATA_MESSAGE, DATA_MESSAGE, "garbage message.", ""]:
+            interpreter.interpret_result(message)
+
+        metrics = interpreter.handler_metrics()
+        self.assertEqual(True, set(metrics) == {"R001", "D001"}, "Only handled flags should be counted.")
+        self.assertEqual(1, metrics["R001"]["calls"], "Time request handler calls were not counted.")
+        self.assertEqual(2, metrics["D001"]["calls"], "Data handler calls were not counted.")
+        self.assertEqual(True, metrics["D001"]["seconds"] > 0, "Time in the data handler was not counted.")
+
+
+class TestInterpreterFrames(unittest.TestCase):
+    """
+    Tests of offers of binary frames, and of the frames themselves.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def test_frame_request(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result("Flag:N001,Sensors:Temperature;Humidity,\n")
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.FRAMES, "Offer was not recognised.")
+        self.assertEqual(True, result.payload == ("Temperature", "Humidity"), "Sensors were not read in order.")
+
+        statuses = app.interpreter.InterpretStatus
+        for message, status in [("Flag:N001,\n", statuses.MISSING_KEYS),
+                                ("Flag:N001,Sensors:Temperature;;Humidity,\n", statuses.BAD_VALUES)]:
+            result = interpreter.interpret_result(message)
+            self.assertEqual(True, result.status is status, "Bad offer {0!r} gave {1}.".format(message, result.status))
+
+    def test_frame_written(self):
+        interpreter = generate_interpreter_object()
+        frame = app.frames.encode_frame(1, 1485204460, 22.7, app.frames.FLAG_DEBUG)
+        result = interpreter.interpret_frame(frame, ("Humidity", "Temperature"))
+
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITTEN, "Frame was not written.")
+        interpreter.database.write_to_database.assert_called_with(DATA_MESSAGE_READING_DEBUG)
+        self.assertEqual(1, interpreter.status_counts[app.interpreter.InterpretStatus.WRITTEN],
+                         "Frame was not counted.")
+
+    def test_frame_for_unknown_sensor(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_frame(app.frames.encode_frame(2, 1485204460, 22.7), ("Temperature",))
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.MISSING_KEYS,
+                         "Frame for a sensor the device never named was not rejected.")
+        self.assertEqual(False, interpreter.database.write_to_database.called,
+                         "Frame for an unknown sensor was written.")
+
+
+def generate_batch_message(sequence, readings=2, device="Cupboard"):
+    """
+    Helper function to generate a batch message.
+    :param sequence: Sequence number of the batch.
+    :param readings: Number of readings in it, a minute apart from 20:47:40 23/01/2017 on.
+    :param device: Name of the device sending it.
+    :return:
+    """
+    entries = ["Temperature|{0}|{1}|0".format(1485204460 + 60 * i, 22.7 + i) for i in range(readings)]
+    return "Flag:B001,Device:{0},Seq:{1},Readings:{2},\n".format(device, sequence, ";".join(entries))
+
+
+class TestInterpreterBatches(unittest.TestCase):
+    """
+    Tests of batches of readings, and their acknowledgement.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def test_batch_written_at_once_and_acknowledged(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result(generate_batch_message(42, readings=3))
+
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITTEN, "Batch was not written.")
+        self.assertEqual("A001,Seq:42", result.payload, "Batch was not acknowledged.")
+        self.assertEqual(1, interpreter.database.commit_many_to_database.call_count, "Batch was not committed at once.")
+        readings = interpreter.database.commit_many_to_database.call_args[0][0]
+        self.assertEqual(True, readings[0] == DATA_MESSAGE_READING, "First reading was not parsed correctly.")
+        self.assertEqual(True, [reading.Value for reading in readings] == [22.7, 23.7, 24.7],
+                         "Readings were not all written, in order.")
+
+    def test_batch_sent_again_not_written_twice(self):
+        interpreter = generate_interpreter_object()
+        interpreter.interpret_result(generate_batch_message(42))
+        result = interpreter.interpret_result(generate_batch_message(42))
+
+        self.assertEqual("A001,Seq:42", result.payload, "Batch sent again was not acknowledged again.")
+        self.assertEqual(1, interpreter.database.commit_many_to_database.call_count, "Batch was written twice.")
+
+        # The same sequence number from another device is a different batch.
+        interpreter.interpret_result(generate_batch_message(42, device="Shed"))
+        self.assertEqual(2, interpreter.database.commit_many_to_database.call_count,
+                         "Another device's batch was taken for a repeat.")
+
+    def test_batch_not_acknowledged_until_committed(self):
+        interpreter = generate_interpreter_object()
+        interpreter.database.commit_many_to_database.side_effect = app.database.sqlite3.OperationalError
+        result = interpreter.interpret_result(generate_batch_message(42))
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITE_FAILED,
+                         "A batch that wasn't committed was taken as written.")
+        self.assertEqual(False, interpreter.database.write_many_to_database.called, "Batch was left uncommitted.")
+
+        # Sent again once the database recovers, it is committed - not taken for a repeat.
+        interpreter.database.commit_many_to_database.side_effect = None
+        result = interpreter.interpret_result(generate_batch_message(42))
+        self.assertEqual("A001,Seq:42", result.payload, "Batch was not acknowledged once committed.")
+        self.assertEqual(2, interpreter.database.commit_many_to_database.call_count, "Batch was not committed again.")
+
+    def test_batch_committed_past_a_dropping_writer(self):
+        # A writer's queue may drop readings; an acknowledged batch must already be in the database.
+        database = mock.Mock(spec=app.database.Database)
+        database.commit_many_to_database.side_effect = lambda readings: len(readings)
+        writer = app.writer.DatabaseWriter(database, queue_size=1, policy=app.writer.POLICY_DROP_OLDEST)
+        interpreter = app.interpreter.Interpreter(writer)
+        result = interpreter.interpret_result(generate_batch_message(42, readings=3))
+        writer.close()
+
+        self.assertEqual("A001,Seq:42", result.payload, "Batch was not acknowledged.")
+        self.assertEqual(True, [len(call[0][0]) for call in database.commit_many_to_database.call_args_list] == [3],
+                         "Batch was not committed whole before being acknowledged.")
+        self.assertEqual(0, writer.metrics()["dropped"], "Readings of an acknowledged batch were dropped.")
+
+    def test_bad_batch_not_acknowledged(self):
+        interpreter = generate_interpreter_object()
+        statuses = app.interpreter.InterpretStatus
+        for message, status in [
+            (generate_batch_message(1).replace("Device:Cupboard,", ""), statuses.MISSING_KEYS),
+            (generate_batch_message(1).replace("Seq:1", "Seq:first"), statuses.BAD_VALUES),
+            (generate_batch_message(1).replace("|0;", "|0|1;"), statuses.BAD_VALUES),
+            (generate_batch_message(1).replace("22.7", "warm"), statuses.BAD_VALUES),
+        ]:
+            result = interpreter.interpret_result(message)
+            self.assertEqual(True, result.status is status, "Bad batch {0!r} gave {1}.".format(message, result.status))
+        self.assertEqual(False, interpreter.database.commit_many_to_database.called, "Part of a bad batch was written.")
+
+    def test_interpret_returns_acknowledgement(self):
+        interpreter = generate_interpreter_object()
+        self.assertEqual("A001,Seq:7", interpreter.interpret(generate_batch_message(7)), "Acknowledgement was lost.")
+        self.assertEqual(None, interpreter.interpret(DATA_MESSAGE), "A single reading was acknowledged.")
+
+    def test_interpret_many_takes_readings_from_batches(self):
+        interpreter = generate_interpreter_object()
+        interpreter.interpret_many([generate_batch_message(1, readings=3), DATA_MESSAGE], batch_size=10)
+        batches = [call[0][0] for call in interpreter.database.write_many_to_database.call_args_list]
+        self.assertEqual(True, [len(batch) for batch in batches] == [4], "Batch readings were not written.")
+
+
+MULTI_READING_MESSAGE = "Flag:D001,Time:20:47:40 23/01/2017,ID:Temperature,Value:22.70,ID:Humidity,Value:69.15," \
+                        "Debug:0,"
+
+
+class TestInterpreterMultiReadingMessages(unittest.TestCase):
+    """
+    Tests of data messages holding readings from several sensors at once.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def test_readings_written_at_once(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result(MULTI_READING_MESSAGE)
+
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.WRITTEN, "Readings were not written.")
+        self.assertEqual(False, interpreter.database.write_to_database.called, "Readings were written one at a time.")
+        self.assertEqual(1, interpreter.database.write_many_to_database.call_count,
+                         "Readings were not written at once.")
+        readings = interpreter.database.write_many_to_database.call_args[0][0]
+        self.assertEqual(True, readings[0] == DATA_MESSAGE_READING, "First reading was not parsed correctly.")
+        self.assertEqual(True, readings[1] == DATA_MESSAGE_READING._replace(ID="Humidity", Value=69.15),
+                         "Second reading was not parsed correctly.")
+
+    def test_pairs_in_either_order(self):
+        # The single reading messages give the Value before the ID; several pairs may do the same.
+        message = MULTI_READING_MESSAGE.replace("ID:Temperature,Value:22.70,ID:Humidity,Value:69.15",
+                                                "Value:22.70,ID:Temperature,Value:69.15,ID:Humidity")
+        readings = app.interpreter._parse_data_message(message)
+        self.assertEqual(True, [(reading.ID, reading.Value) for reading in readings] ==
+                         [("Temperature", 22.7), ("Humidity", 69.15)], "Pairs were not matched up in order.")
+
+    def test_single_pair_still_one_reading(self):
+        reading = app.interpreter._parse_data_message(DATA_MESSAGE)
+        self.assertEqual(True, isinstance(reading, app.database.Reading), "A single reading was not given alone.")
+
+    def test_unmatched_pairs_rejected(self):
+        interpreter = generate_interpreter_object()
+        result = interpreter.interpret_result(MULTI_READING_MESSAGE.replace("Value:69.15,", ""))
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.MISSING_KEYS,
+                         "An ID without a Value was accepted.")
+        result = interpreter.interpret_result(MULTI_READING_MESSAGE.replace("69.15", "damp"))
+        self.assertEqual(True, result.status is app.interpreter.InterpretStatus.BAD_VALUES,
+                         "A bad value was accepted.")
+        self.assertEqual(False, interpreter.database.write_many_to_database.called, "Part of a bad line was written.")
+
+    def test_interpret_many_takes_every_reading(self):
+        interpreter = generate_interpreter_object()
+        counts = interpreter.interpret_many([MULTI_READING_MESSAGE, DATA_MESSAGE], batch_size=10)
+        batches = [call[0][0] for call in interpreter.database.write_many_to_database.call_args_list]
+        self.assertEqual(True, [len(batch) for batch in batches] == [3], "Readings were not all written.")
+        self.assertEqual(2, counts[app.interpreter.InterpretStatus.WRITTEN], "Messages were not counted once each.")
+
+
 class TestInterpreterModulePrivateFunctions(unittest.TestCase):
     """
     Tests to non-public interface points, if necessary.
@@ -258,3 +662,70 @@ class TestInterpreterModulePrivateFunctions(unittest.TestCase):
             type(garbled_message_dict) == dict,
             "Attempting to parse the middle of a garbled message did not yield a response."
         )
+
+
+class TestInterpreterSinglePassParser(unittest.TestCase):
+    """
+    The single-pass parser should agree with the original two-step parse.
+    """
+
+    def setUp(self):
+        importlib.reload(app.interpreter)
+
+    def parse_in_two_steps(self, message):
+        """
+        :param message: Data message.
+        :return: The output of the original parsing functions.
+        """
+        return app.interpreter._parse_string_dict_to_value_dict(
+            app.interpreter._parse_data_message_to_string_dict(message)
+        )
+
+    def test_data_message_parsed(self):
+        self.assertEqual(True, app.interpreter._parse_data_message(DATA_MESSAGE) == DATA_MESSAGE_READING,
+                         "Data message was not parsed into the expected values.")
+        self.assertEqual(True,
+                         app.interpreter._parse_data_message(DATA_MESSAGE_DEBUG) == DATA_MESSAGE_READING_DEBUG,
+                         "Debug data message was not parsed into the expected values.")
+
+    def test_parsers_agree(self):
+        messages = [
+            DATA_MESSAGE,
+            DATA_MESSAGE + "\n",
+            "Debug:1,ID:Humidity,Value:-3,Time:00:00:00 01/12/2016,Flag:D001",
+            "Flag:D001,Time:1:2:3 4/5/2017,Value:1e3,ID:Temperature,Debug:0,",
+            "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,ID:Temperature,Debug:0,Extra:Something,",
+        ]
+        # The original parse also keeps the flag, other fields, and fragments without a colon - e.g. a trailing
+        # newline. Only the fields of a Reading are compared.
+        for message in messages:
+            single_pass = app.interpreter._parse_data_message(message)
+            two_steps = app.database.Reading.from_mapping(self.parse_in_two_steps(message))
+            self.assertEqual(
+                True,
+                single_pass == two_steps,
+                "Parsers disagreed on: {0}".format(message)
+            )
+
+    def test_parsers_reject_the_same_messages(self):
+        messages = [
+            DATA_MESSAGE[15:],
+            "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,Debug:0,",
+            "Flag:D001,Time:20:47:40 23/01/2017,Value:warm,ID:Temperature,Debug:0,",
+            "Flag:D001,Time:20:47:40 31/02/2017,Value:22.70,ID:Temperature,Debug:0,",
+            "Flag:D001,Time:yesterday,Value:22.70,ID:Temperature,Debug:0,",
+        ]
+        for message in messages:
+            with self.assertRaises((KeyError, ValueError)) as expected:
+                self.parse_in_two_steps(message)
+            self.assertRaises(type(expected.exception), app.interpreter._parse_data_message, message)
+
+    def test_parse_time(self):
+        expected = datetime.datetime(2017, 1, 23, 20, 47, 40)
+        self.assertEqual(True, app.interpreter._parse_time("20:47:40 23/01/2017") == expected,
+                         "Time was not decoded correctly.")
+        self.assertEqual(True,
+                         app.interpreter._parse_time("1:02:03 4/5/2017") == datetime.datetime(2017, 5, 4, 1, 2, 3),
+                         "Unpadded time was not decoded.")
+        self.assertRaises(ValueError, app.interpreter._parse_time, "24:00:00 23/01/2017")
+        self.assertRaises(ValueError, app.interpreter._parse_time, "20:47:40 23/01/2017 ")
@@ -1,6 +1,11 @@
 import unittest, unittest.mock
+import os
+import select
+import socket
+import threading
+import time
 from unittest.mock import patch
-import app.interpreter, app.monitor, app.database, app.connector
+import app.interpreter, app.monitor, app.database, app.connector, app.frames
 from importlib import reload
 
 __author__ = 'Goyder'
@@ -37,6 +42,17 @@ def generate_input_parameter_object_minus_inputs(*args):
     return parameters
 
 
+def interpret_result_for_time_requests(message):
+    """
+    Stand-in for Interpreter.interpret_result that answers time requests, and treats everything else as data.
+    :param message:
+    :return:
+    """
+    if "R001" in message:
+        return app.interpreter.InterpretResult(app.interpreter.InterpretStatus.RESPONSE, "T")
+    return app.interpreter.WRITTEN_RESULT
+
+
 class TestInputParameterValidation(unittest.TestCase):
     """
     Test the validation of inputs to the system.
@@ -316,9 +332,8 @@ class TestSerialSelection(unittest.TestCase):
 
         exists = unittest.mock.Mock()
         exists.side_effect = return_true_on_specific_option
-        app.monitor.os.path.exists = exists
-
-        connection = app.monitor.choose_serial_connection(connection_list)
+        with patch("app.monitor.os.path.exists", exists):
+            connection = app.monitor.choose_serial_connection(connection_list)
 
         self.assertEqual(
             True,
@@ -342,9 +357,8 @@ class TestSerialSelection(unittest.TestCase):
 
         exists = unittest.mock.Mock()
         exists.side_effect = return_true_on_specific_option
-        app.monitor.os.path.exists = exists
-
-        connection = app.monitor.choose_serial_connection(connection_list)
+        with patch("app.monitor.os.path.exists", exists):
+            connection = app.monitor.choose_serial_connection(connection_list)
 
         self.assertEqual(
             True,
@@ -352,3 +366,240 @@ class TestSerialSelection(unittest.TestCase):
             "Connection returned did not match required value."
         )
 
+
+class TestMonitorRun(unittest.TestCase):
+    """
+    Tests of the main loop, with mocked components.
+    """
+
+    def setUp(self):
+        reload(app.interpreter)
+        reload(app.monitor)
+        reload(app.database)
+        reload(app.connector)
+
+    def test_run_processes_each_message_in_a_batch(self):
+        """
+        Every message retrieved in one read should be interpreted, and only one connection check made per loop.
+        :return:
+        """
+        monitor = generate_monitor_object()
+        monitor.writer = unittest.mock.Mock()
+        monitor.interpreter = unittest.mock.Mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+        monitor.connector = unittest.mock.Mock()
+        monitor.connector.is_connected.return_value = True
+        monitor.connector.retrieve_messages.return_value = ["D001,A\n", "R001\n", "D001,B\n"]
+
+        monitor.run(runs=2)
+
+        self.assertEqual(6, monitor.interpreter.interpret_result.call_count, "Not every message was interpreted.")
+        self.assertEqual(2, monitor.connector.is_connected.call_count, "Connection was checked more than once a loop.")
+        self.assertEqual(2, monitor.connector.write_data.call_count, "Responses were not written back.")
+
+    def test_responses_to_a_batch_sent_together(self):
+        """
+        Time requests piling up in a single read - as when a device reconnects - should get a single reply.
+        :return:
+        """
+        monitor = generate_monitor_object()
+        monitor.interpreter = unittest.mock.Mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+        connector = unittest.mock.Mock()
+
+        monitor._process_messages(connector, ["R001\n", "D001,A\n", "R001\n", "R001\n", ""])
+        self.assertEqual(True, connector.write_data.call_args_list == [unittest.mock.call("T")],
+                         "Repeated time requests were not answered once.")
+
+        connector.reset_mock()
+        monitor.interpreter.interpret_result.side_effect = [
+            app.interpreter.InterpretResult(app.interpreter.InterpretStatus.RESPONSE, "T1"),
+            app.interpreter.InterpretResult(app.interpreter.InterpretStatus.RESPONSE, "T2"),
+        ]
+        monitor._process_messages(connector, ["R001\n", "R001\n"])
+        self.assertEqual(True, connector.write_data.call_args_list == [unittest.mock.call("T1\nT2")],
+                         "Different responses were not sent together, a line each.")
+
+        connector.reset_mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+        monitor._process_messages(connector, ["D001,A\n"])
+        self.assertEqual(False, connector.write_data.called, "A response was sent when none was due.")
+
+    def test_binary_frames_negotiated(self):
+        """
+        A device offering binary frames should be answered, and its frames written, if its connection can read them.
+        :return:
+        """
+        monitor = generate_monitor_object()
+        monitor.interpreter = app.interpreter.Interpreter(unittest.mock.Mock(spec=app.database.Database))
+        connector = unittest.mock.Mock(spec=app.connector.SerialConnector)
+        connector.can_read_frames.return_value = False
+
+        monitor._process_messages(connector, ["Flag:N001,Sensors:Temperature,\n"])
+        self.assertEqual(False, connector.write_data.called,
+                         "Frames were accepted on a connection that can't read them.")
+
+        connector.can_read_frames.return_value = True
+        monitor._process_messages(connector, ["Flag:N001,Sensors:Temperature,\n"])
+        connector.start_frames.assert_called_with(("Temperature",))
+        connector.write_data.assert_called_with(app.interpreter.FRAMES_ACCEPTED_RESPONSE)
+
+        connector.reset_mock()
+        connector.frame_sensors = ("Temperature",)
+        monitor._process_messages(connector, [app.frames.encode_frame(0, 1485204460, 22.7)])
+        self.assertEqual(True, monitor.interpreter.database.write_to_database.call_args[0][0] == app.database.Reading(
+            "Temperature", app.frames.epoch_to_datetime(1485204460), 22.7, 0
+        ), "Frame was not written.")
+        self.assertEqual(False, connector.write_data.called, "A frame was answered.")
+
+    def test_batch_acknowledged(self):
+        monitor = generate_monitor_object()
+        monitor.interpreter = app.interpreter.Interpreter(unittest.mock.Mock(spec=app.database.Database))
+        connector = unittest.mock.Mock()
+
+        monitor._process_messages(connector, [
+            "Flag:B001,Device:Cupboard,Seq:3,Readings:Temperature|1485204460|22.7|0,\n",
+            "Flag:D001,Time:20:47:40 23/01/2017,Value:22.70,ID:Temperature,Debug:0,\n",
+        ])
+        self.assertEqual(True, connector.write_data.call_args_list == [unittest.mock.call("A001,Seq:3")],
+                         "Batch was not acknowledged, or a single reading was.")
+        self.assertEqual(1, monitor.interpreter.database.commit_many_to_database.call_count, "Batch was not committed.")
+
+        # A batch that can't be committed isn't acknowledged, so the device keeps it.
+        connector.reset_mock()
+        monitor.interpreter.database.commit_many_to_database.side_effect = app.database.sqlite3.OperationalError
+        monitor._process_messages(connector, [
+            "Flag:B001,Device:Cupboard,Seq:4,Readings:Temperature|1485204460|22.7|0,\n",
+        ])
+        self.assertEqual(False, connector.write_data.called, "A batch that wasn't committed was acknowledged.")
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "Pseudo-terminals are not available on this platform.")
+    def test_event_loop_wakes_for_data_and_stops(self):
+        """
+        The event loop should handle data as soon as it arrives, without empty messages from timeouts, and finish
+        promptly when stopped.
+        :return:
+        """
+        device, terminal = os.openpty()
+        parameters = generate_input_parameter_object_minus_inputs()
+        parameters["event_loop"] = True
+        parameters["timeout"] = 5.0
+        monitor = app.monitor.Monitor(parameters)
+        monitor.writer = unittest.mock.Mock()
+        monitor.interpreter = unittest.mock.Mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+        monitor.connector = app.connector.SerialConnector(os.ttyname(terminal), time_out=0, bulk_read=True)
+
+        received = []
+
+        def talk_to_monitor():
+            time.sleep(0.2)
+            os.write(device, b"R001\nD001,")
+            time.sleep(0.1)
+            os.write(device, b"A\n")
+            received.append(os.read(device, 16))
+            time.sleep(0.1)
+            monitor.stop()
+
+        start = time.monotonic()
+        device_thread = threading.Thread(target=talk_to_monitor)
+        device_thread.start()
+        monitor.run()
+        device_thread.join()
+        os.close(device)
+        os.close(terminal)
+
+        self.assertEqual(True, time.monotonic() - start < 2.0, "Event loop did not stop promptly.")
+        self.assertEqual(
+            True,
+            [call[0][0] for call in monitor.interpreter.interpret_result.call_args_list] == ["R001\n", "D001,A\n"],
+            "Event loop did not hand over exactly the lines received."
+        )
+        self.assertEqual(True, received == [b"T\n"], "Response was not written back to the device.")
+
+    def test_event_loop_reads_bluetooth_device(self):
+        """
+        A Bluetooth device should be read by the event loop as a serial one is, here with a socket standing in for it.
+        :return:
+        """
+        parameters = generate_input_parameter_object_minus_inputs()
+        parameters["connection_type"] = "bluetooth"
+        parameters["event_loop"] = True
+        parameters["bt_addr"] = "00:11:22:33:44:55"
+        monitor = app.monitor.Monitor(parameters)
+        monitor.writer = unittest.mock.Mock()
+        monitor.interpreter = unittest.mock.Mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+        monitor.connector = monitor._generate_bluetooth_connector()
+        device, connection = socket.socketpair()
+        monitor.connector.socket_factory = unittest.mock.Mock(return_value=connection)
+
+        received = []
+
+        def talk_to_monitor():
+            device.sendall(b"R001\nD001,A\n")
+            device.settimeout(2.0)
+            received.append(device.recv(16))
+            monitor.stop()
+
+        device_thread = threading.Thread(target=talk_to_monitor)
+        device_thread.start()
+        monitor.run()
+        device_thread.join()
+        device.close()
+        monitor.connector.close_connection()
+
+        self.assertEqual(True, monitor.connector.socket_factory.call_args[0] == ("00:11:22:33:44:55", 1),
+                         "Device was not looked for at its address.")
+        self.assertEqual(True, received == [b"T\n"], "Response was not written back to the device.")
+        self.assertEqual(
+            True,
+            [call[0][0] for call in monitor.interpreter.interpret_result.call_args_list] == ["R001\n", "D001,A\n"],
+            "Event loop did not hand over exactly the lines received."
+        )
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "Pseudo-terminals are not available on this platform.")
+    def test_event_loop_finds_device_attached_later(self):
+        """
+        If no device existed when the monitor started, reconnecting should look through the connection list again,
+        rather than retrying the missing device forever.
+        :return:
+        """
+        device, terminal = os.openpty()
+        parameters = generate_input_parameter_object_minus_inputs()
+        parameters["event_loop"] = True
+        parameters["reconnect_interval"] = 0.05
+        parameters["connection_list"] = ["/dev/not_a_device", os.ttyname(terminal)]
+        monitor = app.monitor.Monitor(parameters)
+        monitor.writer = unittest.mock.Mock()
+        monitor.interpreter = unittest.mock.Mock()
+        monitor.interpreter.interpret_result.side_effect = interpret_result_for_time_requests
+
+        # Nothing is attached yet.
+        with patch("app.monitor.os.path.exists", return_value=False):
+            monitor.connection = app.monitor.choose_serial_connection(monitor.connection_list)
+        monitor.connector = monitor._generate_serial_connector(monitor.connection)
+
+        received = []
+
+        def talk_to_monitor():
+            time.sleep(0.2)
+            os.write(device, b"R001\n")
+            # Don't wait forever if the monitor never connects.
+            if select.select([device], [], [], 2.0)[0]:
+                received.append(os.read(device, 16))
+            monitor.stop()
+
+        device_thread = threading.Thread(target=talk_to_monitor)
+        device_thread.start()
+        monitor.run()
+        device_thread.join()
+        os.close(device)
+        os.close(terminal)
+
+        self.assertEqual(
+            True,
+            monitor.connection == parameters["connection_list"][1],
+            "Monitor did not choose the device once it appeared."
+        )
+        self.assertEqual(True, received == [b"T\n"], "Monitor did not read from the device once it appeared.")
@@ -0,0 +1,264 @@
+import unittest
+import unittest.mock as mock
+import threading
+import time
+import datetime
+import app.database, app.writer, app.interpreter
+import app.test.test_database as test_database
+
+"""
+test_writer.py
+Tests for the DatabaseWriter, which writes to the database from a thread of its own.
+"""
+
+__author__ = 'Goyder'
+
+
+def generate_reading(second, debug=0):
+    """
+    Helper function to generate a reading ready for writing.
+    :param second: Seconds past the minute, to tell readings apart.
+    :param debug: Debug flag of the reading.
+    :return:
+    """
+    return app.database.Reading("Temperature", datetime.datetime(2017, 1, 23, 12, 0, second), float(second), debug)
+
+
+class StalledDatabase(object):
+    """
+    Stands in for a Database whose commits are stalled until released, so the queue can be filled.
+    """
+
+    def __init__(self):
+        self.database = mock.Mock(spec=app.database.Database)
+        self.written = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.database.commit_many_to_database.side_effect = self.commit_many_to_database
+        self.database.flush.return_value = 0
+
+    def commit_many_to_database(self, value_dictionaries):
+        self.started.set()
+        self.release.wait(5)
+        self.written.extend(value_dictionaries)
+        return len(value_dictionaries)
+
+
+class TestDatabaseWriterCreation(unittest.TestCase):
+    """
+    Tests concerned with the creation of the DatabaseWriter object.
+    """
+
+    def test_writer_requires_database(self):
+        self.assertRaises(TypeError, app.writer.DatabaseWriter, "test.db")
+
+    def test_writer_rejects_unknown_policy(self):
+        database = mock.Mock(spec=app.database.Database)
+        self.assertRaises(ValueError, app.writer.DatabaseWriter, database, policy="drop_everything")
+
+    def test_interpreter_accepts_writer(self):
+        writer = app.writer.DatabaseWriter(mock.Mock(spec=app.database.Database))
+        app.interpreter.Interpreter(writer)
+        writer.close()
+
+
+class TestDatabaseWriterPolicies(unittest.TestCase):
+    """
+    Test what happens to readings when the queue fills up.
+    """
+
+    def fill_stalled_writer(self, policy, readings):
+        """
+        Write readings through a writer whose database is stalled on the first of them.
+        :param policy: Policy of the writer.
+        :param readings: Readings to write.
+        :return: The stalled database and the writer.
+        """
+        stalled = StalledDatabase()
+        writer = app.writer.DatabaseWriter(stalled.database, queue_size=3, batch_size=10, policy=policy)
+        writer.write_to_database(readings[0])
+        stalled.started.wait(5)
+        for reading in readings[1:]:
+            writer.write_to_database(reading)
+        return stalled, writer
+
+    def test_drop_oldest_keeps_newest(self):
+        readings = [generate_reading(i) for i in range(7)]
+        stalled, writer = self.fill_stalled_writer(app.writer.POLICY_DROP_OLDEST, readings)
+        self.assertEqual(3, writer.queue_depth(), "Queue grew beyond its size.")
+
+        stalled.release.set()
+        writer.close()
+        self.assertEqual(
+            True,
+            stalled.written == [readings[0]] + readings[-3:],
+            "The oldest queued readings were not the ones dropped."
+        )
+        self.assertEqual(3, writer.metrics()["dropped"], "Dropped readings were not counted.")
+
+    def test_drop_debug_keeps_real_readings(self):
+        readings = [generate_reading(0), generate_reading(1, debug=1), generate_reading(2), generate_reading(3),
+                    generate_reading(4, debug=1), generate_reading(5)]
+        stalled, writer = self.fill_stalled_writer(app.writer.POLICY_DROP_DEBUG, readings)
+
+        stalled.release.set()
+        writer.close()
+        self.assertEqual(
+            True,
+            stalled.written == [readings[0], readings[2], readings[3], readings[5]],
+            "Debug readings were not dropped first."
+        )
+        metrics = writer.metrics()
+        self.assertEqual(2, metrics["dropped"], "Dropped readings were not counted.")
+        self.assertEqual(2, metrics["dropped_debug"], "Dropped debug readings were not counted.")
+
+    def test_block_loses_nothing(self):
+        readings = [generate_reading(i) for i in range(10)]
+        stalled = StalledDatabase()
+        writer = app.writer.DatabaseWriter(stalled.database, queue_size=3, batch_size=2)
+
+        threading.Timer(0.2, stalled.release.set).start()
+        for reading in readings:
+            writer.write_to_database(reading)
+        writer.close()
+
+        self.assertEqual(True, stalled.written == readings, "Blocked writes were not all written, in order.")
+        metrics = writer.metrics()
+        self.assertEqual(0, metrics["dropped"], "Readings were dropped while blocking.")
+        self.assertEqual(3, metrics["max_queue_depth"], "Queue grew beyond its size.")
+
+    def test_block_loses_nothing_written_many_at_once(self):
+        readings = [generate_reading(i) for i in range(10)]
+        stalled = StalledDatabase()
+        writer = app.writer.DatabaseWriter(stalled.database, queue_size=3, batch_size=2)
+
+        threading.Timer(0.2, stalled.release.set).start()
+        writer.write_many_to_database(readings)
+        writer.close()
+
+        self.assertEqual(True, stalled.written == readings, "Blocked writes were not all written, in order.")
+        self.assertEqual(3, writer.metrics()["max_queue_depth"], "Queue grew beyond its size.")
+
+
+class TestDatabaseWriterIntegration(unittest.TestCase):
+    """
+    Test writing through to a real database.
+    """
+
+    def setUp(self):
+        self.database_filename = "test.db"
+        test_database.remove_database_files(self.database_filename)
+
+    def test_flush_commits_everything_queued(self):
+        database = app.database.Database(self.database_filename, buffer_size=1000)
+        database.create_database()
+        writer = app.writer.DatabaseWriter(database, batch_size=7)
+        for i in range(50):
+            writer.write_to_database(generate_reading(i))
+
+        writer.flush()
+        self.assertEqual(50, test_database.count_rows(self.database_filename), "Queued rows were not committed.")
+        self.assertEqual(50, writer.metrics()["written"], "Written rows were not counted.")
+        writer.close()
+
+    def test_written_counted_with_default_buffer_size(self):
+        # With a buffer of one, the Database commits rows as they are handed over; they must still be counted.
+        database = app.database.Database(self.database_filename, buffer_size=1)
+        database.create_database()
+        writer = app.writer.DatabaseWriter(database, batch_size=10)
+        for i in range(50):
+            writer.write_to_database(generate_reading(i))
+
+        writer.flush()
+        self.assertEqual(50, test_database.count_rows(self.database_filename), "Queued rows were not committed.")
+        self.assertEqual(50, writer.metrics()["written"], "Committed rows were not all counted.")
+        writer.close()
+
+    def test_interpret_many_through_writer(self):
+        database = app.database.Database(self.database_filename, buffer_size=1000)
+        database.create_database()
+        writer = app.writer.DatabaseWriter(database, batch_size=64)
+        interpreter = app.interpreter.Interpreter(writer)
+        messages = ("Flag:D001,Time:12:00:{0:02d} 23/01/2017,Value:{0},ID:Temperature,Debug:0,\n".format(i % 60)
+                    for i in range(500))
+
+        counts = interpreter.interpret_many(messages, batch_size=100)
+        writer.flush()
+        writer.close()
+        self.assertEqual(500, counts[app.interpreter.InterpretStatus.WRITTEN], "Readings were not counted.")
+        self.assertEqual(500, test_database.count_rows(self.database_filename), "Readings were not committed.")
+
+
+class FailingDatabase(object):
+    """
+    Stands in for a Database whose commits fail until it is repaired.
+    """
+
+    def __init__(self):
+        self.database = mock.Mock(spec=app.database.Database)
+        self.buffer = []
+        self.committed = []
+        self.failing = True
+        self.database.commit_many_to_database.side_effect = self.commit_many_to_database
+        self.database.flush.side_effect = self.flush
+
+    def commit_many_to_database(self, value_dictionaries):
+        self.buffer.extend(value_dictionaries)
+        return self.flush()
+
+    def flush(self):
+        if self.failing:
+            raise app.database.sqlite3.OperationalError("database is locked")
+        count = len(self.buffer)
+        self.committed.extend(self.buffer)
+        del self.buffer[:]
+        return count
+
+
+class TestDatabaseWriterFailures(unittest.TestCase):
+    """
+    Test what happens while the database can't be written to.
+    """
+
+    def wait_for(self, condition):
+        """
+        :param condition: Function returning True once the writer has caught up.
+        :return:
+        """
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("Timed out waiting for the writer.")
+
+    def test_failing_database_fills_queue_and_applies_policy(self):
+        failing = FailingDatabase()
+        writer = app.writer.DatabaseWriter(failing.database, queue_size=5, batch_size=2,
+                                           policy=app.writer.POLICY_DROP_OLDEST, idle_interval=0.01)
+        writer.write_to_database(generate_reading(0))
+        self.wait_for(lambda: writer.metrics()["write_errors"] > 0)
+
+        for i in range(1, 11):
+            writer.write_to_database(generate_reading(i))
+        metrics = writer.metrics()
+        self.assertEqual(0, metrics["written"], "Rows were counted as written when the commit failed.")
+        self.assertEqual(1, len(failing.buffer), "Queue was drained into the database while it was failing.")
+        self.assertEqual(5, metrics["queue_depth"], "Queue did not fill while the database was failing.")
+        self.assertEqual(5, metrics["dropped"], "Policy was not applied while the database was failing.")
+
+        failing.failing = False
+        self.wait_for(lambda: writer.metrics()["written"] == 6)
+        writer.close()
+        self.assertEqual(
+            True,
+            failing.committed == [generate_reading(0)] + [generate_reading(i) for i in range(6, 11)],
+            "The wrong readings were committed once the database recovered."
+        )
+
+    def test_flush_reports_failure(self):
+        failing = FailingDatabase()
+        writer = app.writer.DatabaseWriter(failing.database, idle_interval=0.01)
+        writer.write_to_database(generate_reading(0))
+        self.assertRaises(app.database.sqlite3.OperationalError, writer.flush)
+        failing.failing = False
+        writer.close()
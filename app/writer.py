@@ -0,0 +1,279 @@
+import collections
+import logging
+import threading
+import time
+import app.database
+
+"""
+writer.py
+Writes to the database from a thread of its own, so a slow commit never holds up reading from the device.
+Readings are put on a bounded queue, and the writer thread takes them off in batches.
+"""
+
+logger = logging.getLogger("logger")
+
+__author__ = 'Goyder'
+
+# What to do with a new reading when the queue is full.
+POLICY_BLOCK = "block"  # Wait for the writer thread to make room.
+POLICY_DROP_OLDEST = "drop_oldest"  # Discard the oldest reading waiting.
+POLICY_DROP_DEBUG = "drop_debug"  # Discard the oldest debug reading waiting; failing that, the oldest reading.
+policies = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_DEBUG)
+
+
+class DatabaseWriter(object):
+    """
+    Stands in front of a Database, taking writes onto a queue for a writer thread to commit.
+    Offers the same write_to_database, write_many_to_database, commit_many_to_database, flush, flush_if_due and close
+    methods as the Database itself.
+    """
+
+    def __init__(self, database, queue_size=1000, batch_size=100, policy=POLICY_BLOCK, idle_interval=0.5):
+        """
+        :param database: Database object to write to. Once the writer has started, only the writer should use it.
+        :param queue_size: Most readings that may wait to be written.
+        :param batch_size: Most readings the writer thread takes off the queue at once.
+        :param policy: One of policies; what to do with a new reading when the queue is full.
+        :param idle_interval: Seconds the writer thread waits for readings before checking whether it should stop,
+        and between attempts to commit while the database is failing.
+        :return:
+        """
+        if not isinstance(database, app.database.Database):
+            raise TypeError("DatabaseWriter requires a Database object to write to. Was given: {0}".format(
+                type(database)
+            ))
+        if queue_size < 1 or batch_size < 1:
+            raise ValueError("queue_size and batch_size must be at least 1.")
+        if policy not in policies:
+            raise ValueError("Provided policy, '{0}', was not of valid policies: {1}".format(policy, policies))
+
+        self.database = database
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.policy = policy
+        self.idle_interval = idle_interval
+
+        self._queue = collections.deque()
+        self._in_progress = 0
+        self._stopping = False
+        # Set while the database is failing, and rows handed to it are still to be committed.
+        self._retrying = False
+        self._condition = threading.Condition()
+        # Held whenever the database is being used, so flush() and close() can safely use it from other threads.
+        self._database_lock = threading.Lock()
+
+        # Metrics
+        self.max_queue_depth = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.dropped_debug = 0
+        self.batches = 0
+        self.write_errors = 0
+
+        self._thread = threading.Thread(target=self._write_loop, name="database-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write_to_database(self, value_dictionary):
+        """
+        Queue a dictionary of values for writing.
+        :param value_dictionary: A Reading, or a dictionary of key-value pairs ready for writing.
+        :return:
+        """
+        with self._condition:
+            self._put(value_dictionary)
+            self._condition.notify_all()
+
+    def write_many_to_database(self, value_dictionaries):
+        """
+        Queue several dictionaries of values for writing, as write_to_database does for one.
+        :param value_dictionaries: An iterable of Readings, or dictionaries of key-value pairs ready for writing.
+        :return:
+        """
+        with self._condition:
+            for value_dictionary in value_dictionaries:
+                self._put(value_dictionary)
+            self._condition.notify_all()
+
+    def commit_many_to_database(self, value_dictionaries):
+        """
+        Write several dictionaries of values to the database, and commit them before returning - for readings the
+        sender is to be told are safe. They skip the queue, so no policy can drop them; the caller waits for one commit.
+        :param value_dictionaries: An iterable of Readings, or dictionaries of key-value pairs ready for writing.
+        :return: The number of rows written.
+        """
+        with self._condition:
+            if self._stopping:
+                raise ValueError("DatabaseWriter has been closed.")
+        with self._database_lock:
+            committed = self.database.commit_many_to_database(value_dictionaries)
+        with self._condition:
+            self.written += committed
+            # Anything left over from a failed commit went with it.
+            self._retrying = False
+            self._condition.notify_all()
+        return committed
+
+    def _put(self, value_dictionary):
+        """
+        Queue a reading, applying the policy if the queue is full. Must be called with the condition held.
+        :param value_dictionary: A Reading, or a dictionary of key-value pairs ready for writing.
+        :return:
+        """
+        if self._stopping:
+            raise ValueError("DatabaseWriter has been closed.")
+        # Readings take less room on the queue than dictionaries.
+        if type(value_dictionary) is not app.database.Reading:
+            value_dictionary = app.database.Reading.from_mapping(value_dictionary)
+
+        if len(self._queue) >= self.queue_size:
+            if self.policy == POLICY_BLOCK:
+                while len(self._queue) >= self.queue_size:
+                    # Readings queued by this call may not have been announced yet.
+                    self._condition.notify_all()
+                    self._condition.wait()
+            elif not self._make_room(value_dictionary):
+                # The new reading was the one to go.
+                self._notify_dropped()
+                return
+
+        self._queue.append(value_dictionary)
+        self.enqueued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+    def _make_room(self, value_dictionary):
+        """
+        Drop a reading according to the policy. Must be called with the condition held.
+        :param value_dictionary: The reading waiting to be queued.
+        :return: True if a queued reading was dropped; False if the new reading should be dropped instead.
+        """
+        if self.policy == POLICY_DROP_DEBUG:
+            if value_dictionary.Debug:
+                self.dropped_debug += 1
+                return False
+            for i, queued in enumerate(self._queue):
+                if queued.Debug:
+                    del self._queue[i]
+                    self.dropped_debug += 1
+                    self._notify_dropped()
+                    return True
+
+        self._queue.popleft()
+        self._notify_dropped()
+        return True
+
+    def _notify_dropped(self):
+        """
+        Count a dropped reading, warning now and then.
+        :return:
+        """
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            logger.warning("Database write queue is full; {0} readings dropped so far.".format(self.dropped))
+
+    def queue_depth(self):
+        """
+        :return: Number of readings waiting to be written.
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def metrics(self):
+        """
+        :return: Dictionary of the writer's counters.
+        """
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "dropped_debug": self.dropped_debug,
+                "batches": self.batches,
+                "write_errors": self.write_errors,
+            }
+
+    def flush_if_due(self):
+        """
+        The writer thread commits each batch as it goes; nothing to do here.
+        :return: False.
+        """
+        return False
+
+    def flush(self):
+        """
+        Wait until every queued reading has been handed to the database, then commit them.
+        If the database is failing, the failure is raised here rather than waited out.
+        :return: The number of rows written by the final commit.
+        """
+        with self._condition:
+            while (self._queue or self._in_progress) and self._thread.is_alive() and not self._retrying:
+                self._condition.wait()
+        with self._database_lock:
+            committed = self.database.flush()
+        with self._condition:
+            self.written += committed
+            self._retrying = False
+        return committed
+
+    def close(self):
+        """
+        Write everything still queued, stop the writer thread, and close the database.
+        :return:
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._database_lock:
+            self.database.close()
+
+    def _write_loop(self):
+        """
+        Take batches off the queue and commit them, until closed and the queue is empty.
+        :return:
+        """
+        while True:
+            with self._condition:
+                if self._retrying:
+                    # Take nothing more until the rows already handed over are committed; the queue fills, and
+                    # the policy decides what gives.
+                    if self._stopping:
+                        return
+                    batch = []
+                else:
+                    if not self._queue and not self._stopping:
+                        self._condition.wait(self.idle_interval)
+                    if not self._queue and self._stopping:
+                        return
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    self._in_progress = len(batch)
+                    # Room has been made for blocked writes.
+                    self._condition.notify_all()
+                    if not batch:
+                        continue
+
+            try:
+                with self._database_lock:
+                    # Each batch is committed whole; the batch, not the database's buffer, sets the transaction size.
+                    committed = self.database.commit_many_to_database(batch)
+                failed = False
+            except Exception:
+                # The Database keeps uncommitted rows in its buffer, so they are retried by the next flush.
+                logger.exception("Could not write to the database.")
+                committed = 0
+                failed = True
+
+            with self._condition:
+                self.written += committed
+                if batch:
+                    self.batches += 1
+                if failed:
+                    self.write_errors += 1
+                self._retrying = failed
+                self._in_progress = 0
+                self._condition.notify_all()
+            if failed:
+                time.sleep(self.idle_interval)
@@ -1,11 +1,46 @@
-from flask import Flask, Response, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, abort
 import os, sys
 sys.path.insert(0, os.path.abspath('..'))
 import flask_app.config as config
+import flask_app.cache as cache
+import flask_app.stream as stream
+import app.database as database
+try:
+    import flask_app.downsample as downsample
+except ImportError:  # numpy is not installed; downsample=lttb will be unavailable.
+    downsample = None
 import sqlite3
+import datetime
+import math
+import json
+import queue
 
 __author__ = 'Goyder'
 app = Flask(__name__)
+query_cache = cache.QueryCache(max_entries=config.QUERY_CACHE_SIZE, time_to_live=config.QUERY_CACHE_TTL)
+
+# The compact database layout, as recorded in the file's user_version by app.database.
+SCHEMA_V2 = database.SCHEMA_V2
+# Resolutions of the rollup tables maintained by app.database, and the seconds in each bucket.
+ROLLUP_RESOLUTIONS = database.rollup_resolutions
+
+# Ways of reducing a range to max_points per sensor.
+DOWNSAMPLE_METHODS = ("mean", "lttb")
+
+# Most rows returned by a single /data?since_row= request; the client asks again for the rest.
+DELTA_ROW_LIMIT = 10000
+
+# Watches for rows written by the monitor, and passes them on to every /stream client.
+broadcaster = stream.Broadcaster(
+    config.NOTIFY_LOCATION,
+    retrieve_rows_since=lambda since_row: retrieve_rows_since(since_row, DELTA_ROW_LIMIT),
+    retrieve_latest_row=lambda: retrieve_data_version()[1] or 0,
+    poll_interval=config.STREAM_POLL_INTERVAL
+)
+
+CSV_HEADER = "Datetime,ID,Value\n"
+# Number of rows fetched and written to the response at a time.
+CSV_CHUNK_ROWS = 1000
 
 
 def get_json_data():
@@ -41,41 +76,446 @@ def hello_world():
     else:
         debug = "false"
 
-    date_range = retrieve_date_range()
+    date_range = query_cache.get_or_compute(("date_range",), retrieve_data_version(), retrieve_date_range)
 
     return render_template(
         "index.html",
         debug=debug,
-        earliest_date=retrieve_date_range()[0],
-        latest_date=retrieve_date_range()[1]
+        earliest_date=date_range[0],
+        latest_date=date_range[1]
     )
 
 
 @app.route("/data")
 def return_data():
+    # e.g. "0.0.0.0:5000/data?since_row=1500" yields only the rows written after row 1500, as json.
+    # "since_row=latest" yields no rows, just the cursor to start from.
+    since_row = request.args.get("since_row")
+    if since_row is not None:
+        return return_new_rows(since_row)
+
     start_date = request.args.get("start_datetime", "0001-01-01+00:00:00")
     end_date = request.args.get("end_datetime", "2100-01-01+00:00:00")
-    data = retrieve_data(start_date.replace("+"," "), end_date.replace("+"," "))
-    print(start_date)
-    print(end_date)
-    data = convert_list_to_csv(data)
-    return Response(data)
+    # e.g. "0.0.0.0:5000/data?resolution=hour" yields hourly means rather than every reading.
+    resolution = request.args.get("resolution")
+    if resolution is not None and resolution not in ROLLUP_RESOLUTIONS:
+        abort(400, "resolution must be one of: {0}".format(", ".join(ROLLUP_RESOLUTIONS)))
+    # e.g. "0.0.0.0:5000/data?max_points=500" yields at most 500 points per sensor, whatever the range.
+    max_points = request.args.get("max_points", type=int)
+    if max_points is not None and max_points < 1:
+        abort(400, "max_points must be a positive integer.")
+    # e.g. "0.0.0.0:5000/data?max_points=500&downsample=lttb" picks the 500 points per sensor that best keep the
+    # shape of the line, rather than averaging buckets.
+    downsample_method = request.args.get("downsample", "mean")
+    if downsample_method not in DOWNSAMPLE_METHODS:
+        abort(400, "downsample must be one of: {0}".format(", ".join(DOWNSAMPLE_METHODS)))
+    if downsample_method == "lttb" and max_points is not None and downsample is None:
+        abort(501, "downsample=lttb requires numpy to be installed.")
+    start_date = start_date.replace("+", " ")
+    end_date = end_date.replace("+", " ")
+
+    # Responses of bounded size are cached, as the dashboards all ask for these.
+    if resolution is not None or max_points is not None:
+        try:
+            key = ("data", normalise_datetime(start_date), normalise_datetime(end_date), resolution, max_points,
+                   downsample_method)
+            data = query_cache.get_or_compute(
+                key,
+                retrieve_data_version(),
+                lambda: convert_list_to_csv(
+                    retrieve_bounded_data(start_date, end_date, resolution, max_points, downsample_method)
+                )
+            )
+        except ValueError:
+            abort(400, "start_datetime and end_datetime must be of format YYYY-MM-DD HH:MM:SS.")
+        except LookupError:
+            abort(404, "The database has no {0} rollups. Build them with app/example/backfill_rollups.py.".format(
+                resolution
+            ))
+        return Response(data, mimetype="text/csv")
+
+    # Everything else could be any size, so is streamed. The query runs before the response starts, so bad
+    # parameters can still be reported as such.
+    conn = sqlite3.connect(config.DATABASE_LOCATION)
+    try:
+        cur = query_data(conn.cursor(), start_date, end_date)
+    except ValueError:
+        conn.close()
+        abort(400, "start_datetime and end_datetime must be of format YYYY-MM-DD HH:MM:SS.")
+    except:
+        conn.close()
+        raise
+    return Response(generate_csv(conn, cur), mimetype="text/csv")
+
+
+def return_new_rows(since_row):
+    """
+    Respond with the rows written after a given row, so a client can keep its chart up to date without
+    downloading its whole window again.
+    :param since_row: The cursor from the client's previous request, or "latest" to start from the newest row.
+    :return: json of {"cursor": the cursor for the next request, "more": True if the client should ask again
+    straight away, "rows": [[time, ID, value], ...]}.
+    """
+    if since_row == "latest":
+        return jsonify({"cursor": retrieve_data_version()[1] or 0, "more": False, "rows": []})
+    try:
+        since_row = int(since_row)
+    except ValueError:
+        abort(400, "since_row must be an integer, or 'latest'.")
+
+    rows, cursor = retrieve_rows_since(since_row, DELTA_ROW_LIMIT)
+    return jsonify({"cursor": cursor, "more": len(rows) == DELTA_ROW_LIMIT, "rows": rows})
+
+
+@app.route("/stream")
+def return_stream():
+    """
+    Push new rows to the client as Server-Sent Events, as they are written.
+    Each event's data is json of {"cursor": row ID of the last row, "rows": [[time, ID, value], ...]}, and its id is
+    the cursor, so a reconnecting browser picks up where it left off.
+    Accepts since_row, as /data does, to first send any rows written since the client last loaded its data.
+    :return:
+    """
+    since_row = request.headers.get("Last-Event-ID", request.args.get("since_row"))
+    if since_row is not None:
+        try:
+            since_row = int(since_row)
+        except ValueError:
+            abort(400, "since_row must be an integer.")
+
+    # Subscribe before catching up, so no rows fall between the two.
+    subscriber = broadcaster.subscribe()
+    return Response(generate_events(subscriber, since_row), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def generate_events(subscriber, since_row=None):
+    """
+    Yield Server-Sent Events for the rows handed to a subscriber, until the client goes away.
+    :param subscriber: A queue from broadcaster.subscribe().
+    :param since_row: If given, first send the rows written after this row.
+    :return:
+    """
+    try:
+        cursor = since_row
+        while cursor is not None:
+            rows, new_cursor = retrieve_rows_since(cursor, DELTA_ROW_LIMIT)
+            if not rows:
+                break
+            cursor = new_cursor
+            yield format_event(cursor, rows)
+
+        while True:
+            try:
+                event_cursor, rows = subscriber.get(timeout=config.STREAM_KEEPALIVE)
+            except queue.Empty:
+                # A comment keeps proxies from closing the connection, and finds out if the client has gone.
+                yield ": keep-alive\n\n"
+                continue
+            # Skip anything already sent while catching up.
+            if cursor is not None and event_cursor <= cursor:
+                continue
+            cursor = event_cursor
+            yield format_event(cursor, rows)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def format_event(cursor, rows):
+    """
+    :param cursor: Row ID of the last of the rows.
+    :param rows: Rows of (time, ID, value).
+    :return: A Server-Sent Event carrying the rows.
+    """
+    return "id: {0}\ndata: {1}\n\n".format(cursor, json.dumps({"cursor": cursor, "rows": rows}))
+
+
+def retrieve_rows_since(since_row, limit):
+    """
+    Retrieve the rows written after a given row.
+    :param since_row: Only rows with a greater row_ID are retrieved.
+    :param limit: Maximum number of rows to retrieve.
+    :return: Rows of (time, ID, value) in the order they were written, and the row_ID of the last of them.
+    """
+
+    with sqlite3.connect(config.DATABASE_LOCATION) as conn:
+        cur = conn.cursor()
+        # row_ID is the rowid, so this is a range search on the table itself.
+        if retrieve_schema_version(cur) == SCHEMA_V2:
+            cur.execute(
+                "SELECT readings.row_ID, strftime('%Y-%m-%d %H:%M:%S', readings.Time / 1000, 'unixepoch'), "
+                "sensors.ID, readings.Value "
+                "FROM readings JOIN sensors ON readings.sensor_ID = sensors.sensor_ID "
+                "WHERE readings.row_ID > ? ORDER BY readings.row_ID LIMIT ?",
+                (since_row, limit)
+            )
+        else:
+            cur.execute("SELECT row_ID, Time, ID, Value FROM data WHERE row_ID > ? ORDER BY row_ID LIMIT ?",
+                        (since_row, limit))
+        rows = cur.fetchall()
+
+    if not rows:
+        return [], since_row
+    return [row[1:] for row in rows], rows[-1][0]
+
+
+def retrieve_bounded_data(start_datetime, end_datetime, resolution=None, max_points=None, downsample_method="mean"):
+    """
+    Retrieve data for a date range, reduced in whichever way has been asked for.
+    :param start_datetime:
+    :param end_datetime:
+    :param resolution: If given, one of ROLLUP_RESOLUTIONS to read means from.
+    :param max_points: If given, the maximum number of points wanted per sensor.
+    :param downsample_method: One of DOWNSAMPLE_METHODS, used with max_points.
+    :return: Rows of (time, ID, value), as retrieve_data returns.
+    """
+    if resolution is not None:
+        return retrieve_rollup_data(start_datetime, end_datetime, resolution)
+    if max_points is None:
+        return retrieve_data(start_datetime, end_datetime)
+    if downsample_method == "lttb":
+        return retrieve_downsampled_data(start_datetime, end_datetime, max_points)
+    return retrieve_planned_data(start_datetime, end_datetime, max_points)
 
 
 def retrieve_data(start_datetime="0001-01-01 00:00:00", end_datetime="2100-01-01 00:00:00"):
     """
     Retrieve data from a given database.
-    :param startdate:
-    :param enddate:
+    :param start_datetime:
+    :param end_datetime:
     :return:
     """
 
     with sqlite3.connect(config.DATABASE_LOCATION) as conn:
-        cur  = conn.cursor()
-        insertion = (start_datetime, end_datetime,)
-        cur.execute('SELECT Time, ID, Value FROM data WHERE Time BETWEEN datetime( ? ) AND datetime(?)', insertion)
+        cur = query_data(conn.cursor(), start_datetime, end_datetime)
+    return cur.fetchall()
+
+
+def retrieve_rollup_data(start_datetime, end_datetime, resolution):
+    """
+    Retrieve the mean value of each sensor for each rollup bucket in a date range.
+    :param start_datetime:
+    :param end_datetime:
+    :param resolution: One of ROLLUP_RESOLUTIONS.
+    :return: Rows of (bucket start, ID, mean value), as retrieve_data returns.
+    """
+
+    with sqlite3.connect(config.DATABASE_LOCATION) as conn:
+        cur = query_rollup_data(conn.cursor(), start_datetime, end_datetime, resolution)
     return cur.fetchall()
 
+
+def retrieve_planned_data(start_datetime, end_datetime, max_points):
+    """
+    Retrieve data for a date range at a resolution that keeps the response to a bounded size.
+    :param start_datetime:
+    :param end_datetime:
+    :param max_points: Maximum number of points wanted per sensor, e.g. the width of the chart in pixels.
+    :return: Rows of (time, ID, value), as retrieve_data returns.
+    """
+
+    with sqlite3.connect(config.DATABASE_LOCATION) as conn:
+        cur = query_planned_data(conn.cursor(), start_datetime, end_datetime, max_points)
+    return cur.fetchall()
+
+
+def retrieve_downsampled_data(start_datetime, end_datetime, max_points):
+    """
+    Retrieve data for a date range, reduced to at most max_points per sensor by Largest-Triangle-Three-Buckets.
+    Each sensor is read and reduced in turn, so only one sensor's raw readings are held in memory at once.
+    :param start_datetime:
+    :param end_datetime:
+    :param max_points: Maximum number of points wanted per sensor, e.g. the width of the chart in pixels.
+    :return: Rows of (time, ID, value), in time order, as retrieve_data returns.
+    """
+    selected_rows = []
+
+    with sqlite3.connect(config.DATABASE_LOCATION) as conn:
+        cur = conn.cursor()
+        schema_version = retrieve_schema_version(cur)
+        insertion = (
+            encode_datetime(start_datetime, schema_version),
+            encode_datetime(end_datetime, schema_version),
+        )
+        # Each row also carries its time as a number, for the x axis of the downsampling.
+        if schema_version == SCHEMA_V2:
+            cur.execute(
+                "SELECT strftime('%Y-%m-%d %H:%M:%S', readings.Time / 1000, 'unixepoch'), sensors.ID, "
+                "readings.Value, readings.Time "
+                "FROM readings JOIN sensors ON readings.sensor_ID = sensors.sensor_ID "
+                "WHERE readings.Time >= ? AND readings.Time <= ? ORDER BY readings.sensor_ID, readings.Time",
+                insertion
+            )
+        else:
+            cur.execute(
+                "SELECT Time, ID, Value, julianday(Time) FROM data "
+                "WHERE Time >= ? AND Time <= ? ORDER BY ID, Time",
+                insertion
+            )
+
+        sensor_rows = []
+        for row in cur:
+            if sensor_rows and row[1] != sensor_rows[0][1]:
+                selected_rows += downsample_rows(sensor_rows, max_points)
+                sensor_rows = []
+            sensor_rows.append(row)
+        selected_rows += downsample_rows(sensor_rows, max_points)
+
+    selected_rows.sort(key=lambda row: row[3])
+    return [row[:3] for row in selected_rows]
+
+
+def downsample_rows(rows, max_points):
+    """
+    Reduce the rows of a single sensor to at most max_points.
+    :param rows: Rows of (time, ID, value, numeric time), in time order.
+    :param max_points: Maximum number of rows to keep.
+    :return: List of the rows kept.
+    """
+    if len(rows) <= max_points:
+        return rows
+    # Values can be NULL; plot them as zero for the purposes of choosing points.
+    selected = downsample.largest_triangle_three_buckets(
+        [row[3] for row in rows],
+        [row[2] or 0.0 for row in rows],
+        max_points
+    )
+    return [rows[i] for i in selected]
+
+
+def query_data(cur, start_datetime, end_datetime):
+    """
+    Run the query for every reading in a date range.
+    The bounds are compared directly against the stored column, so the query can use the Time index.
+    :param cur: Database cursor to run the query on.
+    :param start_datetime:
+    :param end_datetime:
+    :return: The cursor, ready to fetch rows of (time, ID, value) from.
+    """
+    schema_version = retrieve_schema_version(cur)
+    insertion = (
+        encode_datetime(start_datetime, schema_version),
+        encode_datetime(end_datetime, schema_version),
+    )
+    if schema_version == SCHEMA_V2:
+        return cur.execute(
+            "SELECT strftime('%Y-%m-%d %H:%M:%S', readings.Time / 1000, 'unixepoch'), sensors.ID, readings.Value "
+            "FROM readings JOIN sensors ON readings.sensor_ID = sensors.sensor_ID "
+            "WHERE readings.Time >= ? AND readings.Time <= ? ORDER BY readings.Time",
+            insertion
+        )
+    return cur.execute('SELECT Time, ID, Value FROM data WHERE Time >= ? AND Time <= ? ORDER BY Time', insertion)
+
+
+def query_rollup_data(cur, start_datetime, end_datetime, resolution):
+    """
+    Run the query for the mean value of each sensor for each rollup bucket in a date range.
+    :param cur: Database cursor to run the query on.
+    :param start_datetime:
+    :param end_datetime:
+    :param resolution: One of ROLLUP_RESOLUTIONS.
+    :return: The cursor, ready to fetch rows of (bucket start, ID, mean value) from.
+    """
+    if resolution not in retrieve_available_rollups(cur):
+        raise LookupError("The database has no rollup_{0} table.".format(resolution))
+    schema_version = retrieve_schema_version(cur)
+    insertion = (
+        encode_datetime(start_datetime, schema_version),
+        encode_datetime(end_datetime, schema_version),
+    )
+    if schema_version == SCHEMA_V2:
+        return cur.execute(
+            "SELECT strftime('%Y-%m-%d %H:%M:%S', rollup.Time / 1000, 'unixepoch'), sensors.ID, "
+            "rollup.Total / rollup.Count "
+            "FROM rollup_{0} AS rollup JOIN sensors ON rollup.sensor_ID = sensors.sensor_ID "
+            "WHERE rollup.Time >= ? AND rollup.Time <= ? ORDER BY rollup.Time".format(resolution),
+            insertion
+        )
+    return cur.execute(
+        "SELECT Time, ID, Total / Count FROM rollup_{0} "
+        "WHERE Time >= ? AND Time <= ? ORDER BY Time".format(resolution),
+        insertion
+    )
+
+
+def query_planned_data(cur, start_datetime, end_datetime, max_points):
+    """
+    Run a query for a date range at a resolution that keeps the response to a bounded size.
+    If the range holds few enough rows they are returned as they are. Otherwise the range is split into roughly
+    max_points buckets (one more at most, as buckets are aligned to the epoch) and the mean of each sensor in each
+    bucket is returned, aggregated from the coarsest rollup table that is fine enough, or from the raw rows.
+    :param cur: Database cursor to run the query on.
+    :param start_datetime:
+    :param end_datetime:
+    :param max_points: Maximum number of points wanted per sensor, e.g. the width of the chart in pixels.
+    :return: The cursor, ready to fetch rows of (time, ID, value) from.
+    """
+    schema_version = retrieve_schema_version(cur)
+    insertion = (
+        encode_datetime(start_datetime, schema_version),
+        encode_datetime(end_datetime, schema_version),
+    )
+    raw_table = "readings" if schema_version == SCHEMA_V2 else "data"
+
+    # A single pass over the Time index tells us how much data there is, and the span it actually covers.
+    row_count, first_time, last_time = cur.execute(
+        "SELECT count(*), min(Time), max(Time) FROM {0} WHERE Time >= ? AND Time <= ?".format(raw_table),
+        insertion
+    ).fetchone()
+    if row_count <= max_points:
+        return query_data(cur, start_datetime, end_datetime)
+
+    if schema_version == SCHEMA_V2:
+        span_seconds = (last_time - first_time) / 1000
+    else:
+        span_seconds = (datetime.datetime.fromisoformat(last_time) -
+                        datetime.datetime.fromisoformat(first_time)).total_seconds()
+    bucket_seconds = max(1, math.ceil(span_seconds / max_points))
+
+    # Read from the coarsest rollup that still fits inside a bucket, with buckets made a whole number of
+    # rollup periods so no rollup row straddles two buckets.
+    source_table = raw_table
+    available_rollups = retrieve_available_rollups(cur)
+    for resolution, seconds in sorted(ROLLUP_RESOLUTIONS.items(), key=lambda item: item[1], reverse=True):
+        if resolution in available_rollups and seconds <= bucket_seconds:
+            source_table = "rollup_{0}".format(resolution)
+            bucket_seconds = math.ceil(bucket_seconds / seconds) * seconds
+            break
+
+    if source_table == raw_table:
+        mean = "avg(Value)"
+    else:
+        mean = "sum(Total) / sum(Count)"
+
+    if schema_version == SCHEMA_V2:
+        return cur.execute(
+            "SELECT strftime('%Y-%m-%d %H:%M:%S', buckets.Bucket / 1000, 'unixepoch'), sensors.ID, buckets.Value "
+            "FROM ("
+            "SELECT Time / {0:d} * {0:d} AS Bucket, sensor_ID, {1} AS Value FROM {2} "
+            "WHERE Time >= ? AND Time <= ? GROUP BY Bucket, sensor_ID"
+            ") AS buckets JOIN sensors ON buckets.sensor_ID = sensors.sensor_ID "
+            "ORDER BY buckets.Bucket".format(bucket_seconds * 1000, mean, source_table),
+            insertion
+        )
+    return cur.execute(
+        "SELECT datetime(CAST(strftime('%s', Time) AS INTEGER) / {0:d} * {0:d}, 'unixepoch') AS Bucket, "
+        "ID, {1} FROM {2} "
+        "WHERE Time >= ? AND Time <= ? GROUP BY Bucket, ID ORDER BY Bucket".format(
+            bucket_seconds, mean, source_table
+        ),
+        insertion
+    )
+
+
+def retrieve_available_rollups(cur):
+    """
+    Find which rollup tables the database has.
+    :param cur: Database cursor.
+    :return: Set of resolutions, e.g. {"minute", "hour", "day"}.
+    """
+    cur = cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'rollup_%'")
+    return set([row[0][len("rollup_"):] for row in cur.fetchall()])
+
 def retrieve_date_range():
     """
     Retrieve the earliest and latest dates in the dataset.
@@ -85,21 +525,104 @@ def retrieve_date_range():
 
     with sqlite3.connect(config.DATABASE_LOCATION) as conn:
         cur = conn.cursor()
-        cur.execute("SELECT min(Time), max(TIME) FROM data WHERE debug = 0")
+        # Separate sub-queries let SQLite answer each from one end of the non-debug index.
+        if retrieve_schema_version(cur) == SCHEMA_V2:
+            cur.execute(
+                "SELECT "
+                "strftime('%Y-%m-%d %H:%M:%S', (SELECT min(Time) FROM readings WHERE Debug = 0) / 1000, 'unixepoch'), "
+                "strftime('%Y-%m-%d %H:%M:%S', (SELECT max(Time) FROM readings WHERE Debug = 0) / 1000, 'unixepoch')"
+            )
+        else:
+            cur.execute(
+                "SELECT (SELECT min(Time) FROM data WHERE Debug = 0), (SELECT max(Time) FROM data WHERE Debug = 0)"
+            )
     # Needs to be returned in Javascript style - so square brackets, and double quotes
     return list(cur.fetchall()[0])
 
 
+def retrieve_data_version():
+    """
+    Retrieve a value that changes whenever data is written to the database, for invalidating cached results.
+    :return: Tuple of the schema version and the latest row ID.
+    """
+
+    with sqlite3.connect(config.DATABASE_LOCATION) as conn:
+        cur = conn.cursor()
+        schema_version = retrieve_schema_version(cur)
+        raw_table = "readings" if schema_version == SCHEMA_V2 else "data"
+        # row_ID is the rowid, so this is a single lookup at the end of the table.
+        latest_row_ID = cur.execute("SELECT max(row_ID) FROM {0}".format(raw_table)).fetchone()[0]
+    return (schema_version, latest_row_ID)
+
+
+def retrieve_schema_version(cur):
+    """
+    Find out which layout the database has.
+    :param cur: Database cursor.
+    :return: SCHEMA_V2 for the compact layout, anything else for the original layout.
+    """
+    return cur.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def encode_datetime(datetime_string, schema_version):
+    """
+    Convert a datetime string into the format the database stores, so it can be compared as-is.
+    :param datetime_string: e.g. "2017-01-23 20:47:40" or "2017-01-23T20:47:40".
+    :param schema_version: Layout of the database being queried.
+    :return: Integer epoch milliseconds for the compact layout, otherwise a string of format "YYYY-MM-DD HH:MM:SS".
+    """
+    value = parse_datetime(datetime_string)
+    if schema_version == SCHEMA_V2:
+        return database.datetime_to_epoch_ms(value)
+    # isoformat, unlike strftime, zero-pads years before 1000 so the strings still sort correctly.
+    return value.isoformat(sep=" ", timespec="seconds")
+
+
+def parse_datetime(datetime_string):
+    """
+    Parse a datetime string as given in a request.
+    :param datetime_string: e.g. "2017-01-23 20:47:40" or "2017-01-23T20:47:40".
+    :return: datetime.
+    """
+    return datetime.datetime.fromisoformat(datetime_string.strip())
+
+
+def normalise_datetime(datetime_string):
+    """
+    Put a datetime string given in a request into a single standard form, so equivalent requests look the same.
+    :param datetime_string: e.g. "2017-01-23 20:47:40" or "2017-01-23T20:47:40".
+    :return: String of format "YYYY-MM-DD HH:MM:SS".
+    """
+    return parse_datetime(datetime_string).isoformat(sep=" ", timespec="seconds")
+
+
 def convert_list_to_csv(list):
     """
     Convert a list (retrieved from a database) to a string in csv format.
     :param list:
     :return:
     """
-    csv_string = "Datetime,ID,Value\n"
-    for row in list:
-        csv_string += "{0},{1},{2}\n".format(row[0], row[1], row[2])
-    return csv_string
+    return CSV_HEADER + "".join(["{0},{1},{2}\n".format(row[0], row[1], row[2]) for row in list])
+
+
+def generate_csv(conn, cur):
+    """
+    Stream the rows of an executed query as csv, a chunk at a time, so the whole result is never held in memory.
+    Closes the connection once the rows run out, or the client goes away.
+    :param conn: Connection the query was run on.
+    :param cur: Cursor the query was run on.
+    :return: Generator of csv strings.
+    """
+    try:
+        yield CSV_HEADER
+        while True:
+            rows = cur.fetchmany(CSV_CHUNK_ROWS)
+            if not rows:
+                break
+            yield "".join(["{0},{1},{2}\n".format(row[0], row[1], row[2]) for row in rows])
+    finally:
+        conn.close()
+
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
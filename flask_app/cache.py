@@ -0,0 +1,80 @@
+import collections
+import threading
+import time
+
+"""
+cache.py
+In-process cache for query results, so repeated dashboard requests don't repeat the same queries.
+"""
+
+__author__ = 'Goyder'
+
+
+class QueryCache(object):
+    """
+    Least-recently-used cache of query results, bounded in both size and age.
+    Every lookup is made against a data version - anything that changes when the database is written to. When the
+    version moves on, everything cached against the old version is discarded.
+    """
+
+    def __init__(self, max_entries=128, time_to_live=60.0):
+        """
+        :param max_entries: Maximum number of results to hold. The least recently used is dropped first.
+        :param time_to_live: Maximum number of seconds a result is served for.
+        :return:
+        """
+        self.max_entries = max_entries
+        self.time_to_live = time_to_live
+
+        self._entries = collections.OrderedDict()
+        self._data_version = None
+        # Flask may serve requests from several threads.
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, data_version, compute):
+        """
+        Return the cached result for a key, computing and caching it if required.
+        :param key: Hashable, normalised description of the query.
+        :param data_version: The current version of the data.
+        :param compute: Function of no arguments that produces the result.
+        :return: The result.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if data_version != self._data_version:
+                self._entries.clear()
+                self._data_version = data_version
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiry, value = entry
+                if expiry > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+
+        # Compute outside the lock, so a slow query doesn't hold up requests that could be served from memory.
+        value = compute()
+
+        with self._lock:
+            # Only cache the result if the data hasn't moved on while it was being computed.
+            if data_version == self._data_version:
+                self._entries[key] = (now + self.time_to_live, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        """
+        Discard everything cached.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
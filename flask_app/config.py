@@ -20,3 +20,13 @@ DATABASE_LOCATION = os.path.join(
 )
 """
 
+
+# Query result cache
+QUERY_CACHE_SIZE = 128  # Number of results held.
+QUERY_CACHE_TTL = 60.0  # Seconds a result is served for, at most.
+
+
+# Live stream
+NOTIFY_LOCATION = DATABASE_LOCATION + ".notify"  # Written by the monitor when run with notify: true.
+STREAM_POLL_INTERVAL = 0.25  # Seconds between checks of the notification file.
+STREAM_KEEPALIVE = 15.0  # Seconds between comments sent to idle /stream clients.
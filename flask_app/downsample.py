@@ -0,0 +1,56 @@
+import numpy
+
+"""
+downsample.py
+Reduce a series of points to fewer points that still draw the same line.
+"""
+
+__author__ = 'Goyder'
+
+
+def largest_triangle_three_buckets(x, y, threshold):
+    """
+    Choose which points of a series to keep, using the Largest-Triangle-Three-Buckets algorithm.
+    The first and last points are always kept. The points between are split into threshold - 2 buckets, and from
+    each bucket the point forming the largest triangle with the point kept from the previous bucket and the mean
+    of the next bucket is kept. Unlike averaging, this keeps spikes.
+    :param x: Sequence of x values, in ascending order.
+    :param y: Sequence of y values, the same length as x.
+    :param threshold: Number of points to keep.
+    :return: numpy array of the indices of the points kept, in ascending order.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n = len(x)
+
+    if threshold >= n:
+        return numpy.arange(n)
+    if threshold <= 2:
+        return numpy.array([0, n - 1][:max(threshold, 0)], dtype=numpy.intp)
+
+    # Measure x from the first point, so the areas aren't swamped by the size of epoch values.
+    x = x - x[0]
+
+    # Bucket i covers indices edges[i] to edges[i + 1]; the final "bucket" is just the last point.
+    every = (n - 2) / (threshold - 2)
+    edges = numpy.empty(threshold, dtype=numpy.intp)
+    edges[:-1] = (numpy.arange(threshold - 1) * every).astype(numpy.intp) + 1
+    edges[-1] = n
+    counts = numpy.diff(edges)
+    x_means = numpy.add.reduceat(x, edges[:-1]) / counts
+    y_means = numpy.add.reduceat(y, edges[:-1]) / counts
+
+    selected = numpy.empty(threshold, dtype=numpy.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        cx, cy = x_means[i + 1], y_means[i + 1]
+        # Twice the triangle area; the factor doesn't change which point is largest.
+        areas = numpy.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(numpy.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
@@ -2,7 +2,10 @@ $(function() {
     console.log(debug_mode);
     console.log('jquery is working!');
     createGraph();
-
+    // Browsers without Server-Sent Events fall back to asking for new rows every poll_interval.
+    if (!window.EventSource) {
+        setInterval(poll_for_new_data, poll_interval);
+    }
 });
 
 /* Further work to be done:
@@ -37,12 +40,25 @@ var frame_width     = 600,
     width           = frame_width - margin.right - margin.left,
     height          = frame_height - margin.top - margin.bottom;
 
+// Ask for no more points per sensor than the chart has pixels across.
+// The server picks the points that keep the shape of each line, so spikes stay visible.
+var max_points = width;
+var downsample = "lttb";
+
 if (debug_mode) {
     var data_source = "/test_data"
 } else {
-    var data_source = "/data"
+    var data_source = "/data?max_points=" + max_points + "&downsample=" + downsample
 }
 
+// Rows currently charted, and the cursor for fetching only the rows written since they were loaded.
+var chart_data          = [],
+    row_cursor          = null,
+    live_stream         = null,
+    poll_interval       = 5000,
+    // Only windows reaching the latest data follow new data; live_lookback is their length, or null for all time.
+    following_live_data = true,
+    live_lookback       = null;
 
 // Develop legend
 var color_hash = { 0 : ["Temperature (C)", "steelblue"],
@@ -129,16 +145,9 @@ function createGraph() {
         .text("Date-time");
 
     // Call the data - initially
-    d3.csv(
+    load_window(
     data_source,
-    function(d) {
-        d.Datetime = parseTime(d.Datetime);
-        d.Value = +d.Value;
-        return d;
-        },
-    function(error, data) {
-        if (error) throw error;
-
+    function(data) {
         x.domain(d3.extent(data, function(d) { return d.Datetime; }));
         y.domain(d3.extent(data, function(d) {
             if (d.ID == "Temperature")
@@ -181,6 +190,128 @@ function createGraph() {
     })
 };
 
+function parse_row(d) {
+    d.Datetime = parseTime(d.Datetime);
+    d.Value = +d.Value;
+    return d;
+};
+
+function load_window(url, callback) {
+    // Take the cursor before loading the window, so rows written while it loads arrive in the next delta.
+    if (debug_mode) {
+        d3.csv(url, parse_row, function(error, data) {
+            if (error) throw error;
+            chart_data = data;
+            callback(data);
+        });
+        return;
+    }
+    d3.json("data?since_row=latest", function(error, delta) {
+        if (error) throw error;
+        row_cursor = delta.cursor;
+        d3.csv(url, parse_row, function(error, data) {
+            if (error) throw error;
+            chart_data = data;
+            callback(data);
+            open_live_stream();
+        });
+    });
+};
+
+function open_live_stream() {
+    // Have new rows pushed to us as they are written. The browser reconnects by itself if the connection drops,
+    // and the server resumes from the last event it sent.
+    if (debug_mode || !window.EventSource || live_stream !== null || row_cursor === null) {
+        return;
+    }
+    live_stream = new EventSource("stream?since_row=" + row_cursor);
+    live_stream.onmessage = function(event) {
+        var delta = JSON.parse(event.data);
+        row_cursor = delta.cursor;
+        if (following_live_data && delta.rows.length > 0) {
+            merge_rows(delta.rows);
+            redraw(chart_data);
+        }
+    };
+};
+
+function poll_for_new_data() {
+    // Fetch only the rows written since the last fetch, and merge them into the chart.
+    if (debug_mode || row_cursor === null || !following_live_data) {
+        return;
+    }
+    d3.json("data?since_row=" + row_cursor, function(error, delta) {
+        if (error) {
+            console.log(error);
+            return;
+        }
+        row_cursor = delta.cursor;
+        if (delta.rows.length > 0) {
+            merge_rows(delta.rows);
+            redraw(chart_data);
+        }
+        // The server limits the rows per response; keep going until we have caught up.
+        if (delta.more) {
+            poll_for_new_data();
+        }
+    });
+};
+
+function merge_rows(rows) {
+    // Rows may overlap the window that was loaded, so skip any we already have.
+    var seen = {};
+    chart_data.forEach(function(d) { seen[d.ID + d.Datetime.getTime()] = true; });
+    rows.forEach(function(row) {
+        var d = parse_row({Datetime: row[0], ID: row[1], Value: row[2]});
+        if (!seen[d.ID + d.Datetime.getTime()]) {
+            chart_data.push(d);
+        }
+    });
+    chart_data.sort(function(a, b) { return a.Datetime - b.Datetime; });
+
+    // Slide the window along with the new data.
+    if (live_lookback !== null) {
+        var window_start = d3.max(chart_data, function(d) { return d.Datetime; }).getTime() - live_lookback;
+        chart_data = chart_data.filter(function(d) { return d.Datetime.getTime() >= window_start; });
+    }
+};
+
+function redraw(data) {
+    var g = d3.select("#graph_container").transition();
+
+    // Data needs to be treated
+    x.domain(d3.extent(data, function(d) { return d.Datetime; }));
+    y.domain(d3.extent(data, function(d) {
+        if (d.ID == "Temperature")
+            {return d.Value; } else
+            {return null;}
+        }));
+    y2.domain(d3.extent(data, function(d) {
+        if (d.ID == "Humidity")
+            {return d.Value; } else
+            {return null; }
+        }));
+
+    // Regenerate lines and axes
+    g.select("#right-y-axis")
+        .duration(500)
+        .call(d3.axisRight(y2));
+
+    g.select("#left-y-axis")
+        .duration(500)
+        .call(d3.axisLeft(y));
+
+    g.select("#x-axis")
+        .duration(500)
+        .call(d3.axisBottom(x));
+
+    g.select("#humidity-line")
+        .attr("d", line2(data.filter(function(d) { return d.ID == "Humidity"})));
+
+    g.select("#temperature-line")
+        .attr("d", line(data.filter(function(d) { return d.ID == "Temperature"})));
+};
+
 function update_data() {
 
     // Retrieve the two dates to be used
@@ -196,54 +327,14 @@ function update_data() {
         "1 week":   1000*60*60*24*7
     }
     var earlier_datetime = new Date(reference_datetime.getTime() - lookback_dict[lookback]);
+    following_live_data = reference_datetime >= latest_datetime;
+    live_lookback = lookback_dict[lookback];
     reference_datetime = dateFormat(reference_datetime, "yyyy-mm-dd+HH:MM:ss");
     earlier_datetime = dateFormat(earlier_datetime, "yyyy-mm-dd+HH:MM:ss");
     console.log(reference_datetime, earlier_datetime);
 
     // Call the data
-    d3.csv(
-    "data?start_datetime="+earlier_datetime+"&end_datetime="+reference_datetime,
-    function(d) {
-        d.Datetime = parseTime(d.Datetime);
-        d.Value = +d.Value;
-        return d;
-    },
-
-    function(error, data) {
-        if (error) throw error;
-
-        var g = d3.select("#graph_container").transition();
-
-        // Data needs to be treated
-        x.domain(d3.extent(data, function(d) { return d.Datetime; }));
-        y.domain(d3.extent(data, function(d) {
-            if (d.ID == "Temperature")
-                {return d.Value; } else
-                {return null;}
-            }));
-        y2.domain(d3.extent(data, function(d) {
-            if (d.ID == "Humidity")
-                {return d.Value; } else
-                {return null; }
-            }));
-
-        // Regenerate lines and axes
-        g.select("#right-y-axis")
-            .duration(500)
-            .call(d3.axisRight(y2));
-
-        g.select("#left-y-axis")
-            .duration(500)
-            .call(d3.axisLeft(y));
-
-        g.select("#x-axis")
-            .duration(500)
-            .call(d3.axisBottom(x));
-
-        g.select("#humidity-line")
-            .attr("d", line2(data.filter(function(d) { return d.ID == "Humidity"})));
-
-        g.select("#temperature-line")
-            .attr("d", line(data.filter(function(d) { return d.ID == "Temperature"})));
-    })
+    load_window(
+    "data?start_datetime="+earlier_datetime+"&end_datetime="+reference_datetime+"&max_points="+max_points+"&downsample="+downsample,
+    redraw)
 };
@@ -0,0 +1,167 @@
+import logging
+import os
+import queue
+import threading
+import time
+import app.notifier
+
+"""
+stream.py
+Fans new rows out to every browser listening on /stream.
+A single background thread watches the notification file written by the monitor, and reads the new rows once for all
+listeners, so the number of open dashboards doesn't change how often the database is queried.
+"""
+
+__author__ = 'Goyder'
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster(object):
+    """
+    Watches for new rows and hands them to each subscriber's queue.
+    """
+
+    def __init__(self, notify_location, retrieve_rows_since, retrieve_latest_row, poll_interval=0.25,
+                 fallback_interval=2.0, queue_size=100):
+        """
+        :param notify_location: Notification file written by the monitor; see app.notifier.
+        :param retrieve_rows_since: Function of a row ID, returning the rows written after it and the new cursor.
+        :param retrieve_latest_row: Function returning the row ID of the latest row in the database.
+        :param poll_interval: Seconds between checks of the notification file. A check is a single os.stat().
+        :param fallback_interval: Seconds between queries of the database itself, used while the notification file
+        doesn't exist - e.g. if the monitor was started without notify.
+        :param queue_size: Events held for a subscriber that isn't keeping up. The oldest are discarded after that.
+        :return:
+        """
+        self.notify_location = notify_location
+        self.retrieve_rows_since = retrieve_rows_since
+        self.retrieve_latest_row = retrieve_latest_row
+        self.poll_interval = poll_interval
+        self.fallback_interval = fallback_interval
+        self.queue_size = queue_size
+
+        self.cursor = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """
+        Start receiving events, starting the watching thread if it isn't already running.
+        :return: A queue that will be given a (cursor, rows) tuple for each batch of new rows.
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self._thread is None:
+                # Start from the latest row now, so anything written from here on is published - even before the
+                # thread's first check.
+                self.cursor = self._latest_row()
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name="stream-broadcaster")
+                self._thread.daemon = True
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Stop receiving events.
+        :param subscriber: A queue returned by subscribe().
+        :return:
+        """
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        """
+        :return: Number of current subscribers.
+        """
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, cursor, rows):
+        """
+        Hand a batch of new rows to every subscriber.
+        :param cursor: Row ID of the last of the rows.
+        :param rows: Rows of (time, ID, value).
+        :return:
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((cursor, rows))
+                    break
+                except queue.Full:
+                    # A slow client loses its oldest events rather than holding up everyone else.
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def check_for_rows(self):
+        """
+        Look for new rows once, and publish any that are found.
+        :return: True if the notification file was available to check, False if the database had to be queried.
+        """
+        latest_row = app.notifier.read_notification(self.notify_location)
+        notified = latest_row is not None
+        if not notified:
+            latest_row = self.retrieve_latest_row()
+
+        # Rows are retrieved in limited batches; keep going until we have caught up.
+        while latest_row is not None and latest_row > self.cursor:
+            rows, cursor = self.retrieve_rows_since(self.cursor)
+            if not rows:
+                break
+            self.cursor = cursor
+            self.publish(cursor, rows)
+        return notified
+
+    def _watch(self):
+        """
+        Check for new rows until there are no subscribers left.
+        :return:
+        """
+        last_stat = None
+        last_fallback = 0.0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    self.cursor = None
+                    return
+
+            # Only read the file when it has changed.
+            try:
+                stat = os.stat(self.notify_location)
+                stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except OSError:
+                stat = None
+
+            if stat is None:
+                due = time.time() - last_fallback >= self.fallback_interval
+                if due:
+                    last_fallback = time.time()
+            else:
+                due = stat != last_stat
+            last_stat = stat
+
+            if due:
+                try:
+                    self.check_for_rows()
+                except Exception:
+                    # The database may be briefly unavailable; the thread has to outlive that.
+                    logger.exception("Could not check for new rows.")
+            time.sleep(self.poll_interval)
+
+    def _latest_row(self):
+        """
+        :return: The latest row ID, from the notification file if there is one, otherwise from the database.
+        """
+        latest_row = app.notifier.read_notification(self.notify_location)
+        if latest_row is None:
+            latest_row = self.retrieve_latest_row()
+        return latest_row or 0
@@ -0,0 +1,257 @@
+import unittest
+import unittest.mock as mock
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import app.database, app.notifier
+import flask_app.app
+import flask_app.config as config
+
+"""
+test_app.py
+Tests of the web front-end's data queries, run against temporary databases written by app.database.
+"""
+
+__author__ = 'Goyder'
+
+START_TIME = datetime.datetime(2017, 1, 23, 0, 0, 0)
+
+
+def generate_database(database_location, schema_version=app.database.SCHEMA_V1, rollups=False, minutes=600):
+    """
+    Helper function to write a database with two sensors, one reading each per minute.
+    :param database_location: Where to write the database.
+    :param schema_version: Layout of the database.
+    :param rollups: If True, the database keeps rollup tables.
+    :param minutes: Number of readings per sensor.
+    :return:
+    """
+    database = app.database.Database(database_location, buffer_size=1000, schema_version=schema_version,
+                                     rollups=rollups)
+    database.create_database()
+    for minute in range(minutes):
+        for sensor_ID, value in (("Temperature", 20.0 + minute % 7), ("Humidity", 50.0 + minute % 11)):
+            database.write_to_database({
+                "ID": sensor_ID,
+                "Time": START_TIME + datetime.timedelta(minutes=minute),
+                "Value": value,
+                "Debug": 0
+            })
+    database.close()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Points the web front-end at a temporary directory for its database.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_location = os.path.join(self.directory, "test.db")
+        patcher = mock.patch.object(config, "DATABASE_LOCATION", self.database_location)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+        # Results cached against another test's database could otherwise be served.
+        flask_app.app.query_cache.clear()
+        self.client = flask_app.app.app.test_client()
+
+
+class TestBoundedData(DatabaseTestCase):
+    """
+    Test the planner behind /data?max_points=, and rollup reads behind /data?resolution=.
+    """
+
+    def count_points_per_sensor(self, rows):
+        """
+        :param rows: Rows of (time, ID, value).
+        :return: Dictionary of the number of rows for each sensor.
+        """
+        counts = {}
+        for row in rows:
+            counts[row[1]] = counts.get(row[1], 0) + 1
+        return counts
+
+    def check_raw_rows_when_few_enough(self, schema_version):
+        generate_database(self.database_location, schema_version, minutes=100)
+        planned = flask_app.app.retrieve_planned_data("2017-01-23 00:00:00", "2017-01-24 00:00:00", 200)
+        raw = flask_app.app.retrieve_data("2017-01-23 00:00:00", "2017-01-24 00:00:00")
+        self.assertEqual(200, len(raw), "Unexpected number of rows written.")
+        self.assertEqual(True, planned == raw, "Rows were bucketed even though they fit within max_points.")
+
+    def test_raw_rows_when_few_enough(self):
+        self.check_raw_rows_when_few_enough(app.database.SCHEMA_V1)
+
+    def test_raw_rows_when_few_enough_compact_schema(self):
+        self.check_raw_rows_when_few_enough(app.database.SCHEMA_V2)
+
+    def check_buckets_are_bounded(self, schema_version):
+        generate_database(self.database_location, schema_version)
+        for max_points in (7, 50, 299):
+            rows = flask_app.app.retrieve_planned_data("2017-01-23 00:00:00", "2017-01-24 00:00:00", max_points)
+            counts = self.count_points_per_sensor(rows)
+            self.assertEqual(True, set(counts) == {"Temperature", "Humidity"}, "A sensor was missing.")
+            for sensor_ID, count in counts.items():
+                # Buckets are aligned to the epoch, so the range may be cut into one more than asked for.
+                self.assertEqual(
+                    True,
+                    count <= max_points + 1,
+                    "{0} had {1} points for max_points={2}.".format(sensor_ID, count, max_points)
+                )
+            times = [row[0] for row in rows]
+            self.assertEqual(True, times == sorted(times), "Buckets were not in time order.")
+
+    def test_buckets_are_bounded(self):
+        self.check_buckets_are_bounded(app.database.SCHEMA_V1)
+
+    def test_buckets_are_bounded_compact_schema(self):
+        self.check_buckets_are_bounded(app.database.SCHEMA_V2)
+
+    def check_rollups_are_used(self, schema_version):
+        """
+        With rollups available, a coarse request should read from them, and agree with reading the raw rows.
+        :param schema_version: Layout of database to test.
+        :return:
+        """
+        generate_database(self.database_location, schema_version, rollups=True)
+        statements = []
+        with sqlite3.connect(self.database_location) as conn:
+            conn.set_trace_callback(statements.append)
+            from_rollups = flask_app.app.query_planned_data(
+                conn.cursor(), "2017-01-23 00:00:00", "2017-01-24 00:00:00", 5
+            ).fetchall()
+        self.assertEqual(True, "rollup_hour" in statements[-1], "The hourly rollup was not read from.")
+
+        # The same database without its rollups has to be read from the raw rows.
+        with sqlite3.connect(self.database_location) as conn:
+            for resolution in app.database.rollup_resolutions:
+                conn.execute("DROP TABLE rollup_{0}".format(resolution))
+            statements = []
+            conn.set_trace_callback(statements.append)
+            flask_app.app.query_planned_data(conn.cursor(), "2017-01-23 00:00:00", "2017-01-24 00:00:00", 5)
+            raw_rows = flask_app.app.query_data(conn.cursor(), "2017-01-23 00:00:00", "2017-01-24 00:00:00").fetchall()
+        self.assertEqual(False, "rollup_" in statements[-1], "A rollup was read from after being dropped.")
+
+        # Buckets read from the hourly rollup are a whole number of hours: here, two.
+        totals = {}
+        for time_string, sensor_ID, value in raw_rows:
+            seconds = (datetime.datetime.strptime(time_string, "%Y-%m-%d %H:%M:%S") - START_TIME).total_seconds()
+            bucket = START_TIME + datetime.timedelta(seconds=seconds // 7200 * 7200)
+            total, count = totals.get((bucket, sensor_ID), (0.0, 0))
+            totals[(bucket, sensor_ID)] = (total + value, count + 1)
+
+        self.assertEqual(len(totals), len(from_rollups), "Rollups gave the wrong number of buckets.")
+        for time_string, sensor_ID, value in from_rollups:
+            total, count = totals[(datetime.datetime.strptime(time_string, "%Y-%m-%d %H:%M:%S"), sensor_ID)]
+            self.assertAlmostEqual(total / count, value, msg="Rollups gave a different mean.")
+
+    def test_rollups_are_used(self):
+        self.check_rollups_are_used(app.database.SCHEMA_V1)
+
+    def test_rollups_are_used_compact_schema(self):
+        self.check_rollups_are_used(app.database.SCHEMA_V2)
+
+    def test_bounded_response(self):
+        generate_database(self.database_location)
+        response = self.client.get("/data?max_points=10")
+        self.assertEqual(200, response.status_code, "Bounded request failed.")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(flask_app.app.CSV_HEADER.strip(), lines[0], "Response was missing its header.")
+        self.assertEqual(True, 1 < len(lines) <= 1 + 2 * 11, "Response was not bounded.")
+
+    def test_missing_rollups_are_not_found(self):
+        generate_database(self.database_location, minutes=10)
+        response = self.client.get("/data?resolution=hour")
+        self.assertEqual(404, response.status_code, "Missing rollups were not reported as such.")
+
+    def test_other_database_errors_are_not_hidden(self):
+        """
+        Only a missing rollup is a 404. Anything else - e.g. a locked database - is a server error.
+        :return:
+        """
+        generate_database(self.database_location, minutes=10)
+        with mock.patch.object(flask_app.app, "retrieve_bounded_data",
+                               side_effect=sqlite3.OperationalError("database is locked")):
+            response = self.client.get("/data?max_points=10")
+        self.assertEqual(500, response.status_code, "A database error was hidden.")
+
+
+class TestNewRows(DatabaseTestCase):
+    """
+    Test /data?since_row=, which returns only the rows written since the client last asked.
+    """
+
+    def check_rows_since(self, schema_version):
+        generate_database(self.database_location, schema_version, minutes=10)
+        delta = self.client.get("/data?since_row=15").get_json()
+        self.assertEqual(20, delta["cursor"], "Cursor was not the last row returned.")
+        self.assertEqual(False, delta["more"], "More rows were reported when there were none.")
+        self.assertEqual(
+            [["2017-01-23 00:07:00", "Humidity", 50.0 + 7],
+             ["2017-01-23 00:08:00", "Temperature", 20.0 + 1],
+             ["2017-01-23 00:08:00", "Humidity", 50.0 + 8]],
+            delta["rows"][:3],
+            "Rows after the cursor were not returned in order."
+        )
+        self.assertEqual(5, len(delta["rows"]), "Wrong number of rows returned.")
+
+        delta = self.client.get("/data?since_row=20").get_json()
+        self.assertEqual((20, []), (delta["cursor"], delta["rows"]), "Rows were returned when there were none new.")
+
+    def test_rows_since(self):
+        self.check_rows_since(app.database.SCHEMA_V1)
+
+    def test_rows_since_compact_schema(self):
+        self.check_rows_since(app.database.SCHEMA_V2)
+
+    def test_latest(self):
+        generate_database(self.database_location, minutes=10)
+        delta = self.client.get("/data?since_row=latest").get_json()
+        self.assertEqual((20, [], False), (delta["cursor"], delta["rows"], delta["more"]), "Wrong latest cursor.")
+
+    def test_more_at_row_limit(self):
+        generate_database(self.database_location, minutes=10)
+        with mock.patch.object(flask_app.app, "DELTA_ROW_LIMIT", 8):
+            delta = self.client.get("/data?since_row=0").get_json()
+            self.assertEqual((8, True), (delta["cursor"], delta["more"]), "A full response did not ask for more.")
+            delta = self.client.get("/data?since_row=16").get_json()
+            self.assertEqual((20, False), (delta["cursor"], delta["more"]), "A short response asked for more.")
+
+    def test_non_integer_is_rejected(self):
+        generate_database(self.database_location, minutes=10)
+        self.assertEqual(400, self.client.get("/data?since_row=abc").status_code, "since_row=abc was accepted.")
+
+
+class TestStream(DatabaseTestCase):
+    """
+    Test /stream, which pushes new rows as Server-Sent Events.
+    """
+
+    def test_stream_catches_up_then_follows(self):
+        generate_database(self.database_location, minutes=10)
+        notify_location = app.notifier.notify_location_for(self.database_location)
+        with mock.patch.object(flask_app.app.broadcaster, "notify_location", notify_location), \
+                mock.patch.object(flask_app.app.broadcaster, "poll_interval", 0.01):
+            response = self.client.get("/stream?since_row=17", buffered=False)
+            self.assertEqual("text/event-stream", response.mimetype, "Wrong content type.")
+            events = iter(response.response)
+
+            event = next(events).decode()
+            self.assertEqual(True, event.startswith("id: 20\n"), "Catch-up event had the wrong id.")
+            self.assertEqual(3, len(json.loads(event.split("data: ")[1])["rows"]), "Catch-up sent the wrong rows.")
+
+            database = app.database.Database(self.database_location, notify=True)
+            database.create_database()
+            database.write_to_database({"ID": "Temperature", "Time": START_TIME, "Value": 1.0, "Debug": 0})
+            database.close()
+            event = next(events).decode()
+            self.assertEqual(True, event.startswith("id: 21\n"), "New row was not pushed.")
+
+            response.close()
+        self.assertEqual(0, flask_app.app.broadcaster.subscriber_count(), "Closed stream was still subscribed.")
+
+    def test_stream_rejects_non_integer(self):
+        self.assertEqual(400, self.client.get("/stream?since_row=abc").status_code, "since_row=abc was accepted.")
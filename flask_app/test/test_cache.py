@@ -0,0 +1,99 @@
+import unittest
+import unittest.mock as mock
+import flask_app.cache as cache
+
+"""
+test_cache.py
+Tests of the query result cache.
+"""
+
+__author__ = 'Goyder'
+
+
+class Computation(object):
+    """
+    Stands in for a query, counting how often it is run.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestQueryCache(unittest.TestCase):
+    """
+    Test what the cache keeps, and for how long.
+    """
+
+    def test_result_is_reused(self):
+        query_cache = cache.QueryCache()
+        compute = Computation("result")
+        for _ in range(3):
+            self.assertEqual("result", query_cache.get_or_compute("key", 1, compute), "Wrong result returned.")
+        self.assertEqual(1, compute.calls, "Cached result was computed again.")
+        self.assertEqual((2, 1), (query_cache.hits, query_cache.misses), "Hits and misses were miscounted.")
+
+    def test_least_recently_used_is_evicted(self):
+        query_cache = cache.QueryCache(max_entries=2)
+        computations = dict((key, Computation(key)) for key in ("a", "b", "c"))
+        query_cache.get_or_compute("a", 1, computations["a"])
+        query_cache.get_or_compute("b", 1, computations["b"])
+        # Using "a" again makes "b" the least recently used.
+        query_cache.get_or_compute("a", 1, computations["a"])
+        query_cache.get_or_compute("c", 1, computations["c"])
+
+        query_cache.get_or_compute("a", 1, computations["a"])
+        query_cache.get_or_compute("b", 1, computations["b"])
+        self.assertEqual(1, computations["a"].calls, "The recently used entry was evicted.")
+        self.assertEqual(2, computations["b"].calls, "The least recently used entry was not evicted.")
+
+    def test_results_expire(self):
+        query_cache = cache.QueryCache(time_to_live=60.0)
+        compute = Computation("result")
+        with mock.patch("flask_app.cache.time.monotonic", return_value=1000.0):
+            query_cache.get_or_compute("key", 1, compute)
+        with mock.patch("flask_app.cache.time.monotonic", return_value=1059.0):
+            query_cache.get_or_compute("key", 1, compute)
+        self.assertEqual(1, compute.calls, "Result expired early.")
+        with mock.patch("flask_app.cache.time.monotonic", return_value=1061.0):
+            query_cache.get_or_compute("key", 1, compute)
+        self.assertEqual(2, compute.calls, "Result was served after it expired.")
+
+    def test_new_data_version_clears_everything(self):
+        query_cache = cache.QueryCache()
+        first, second = Computation("first"), Computation("second")
+        query_cache.get_or_compute("a", 1, first)
+        query_cache.get_or_compute("b", 1, second)
+
+        self.assertEqual("first", query_cache.get_or_compute("a", 2, first), "Wrong result returned.")
+        query_cache.get_or_compute("b", 2, second)
+        self.assertEqual((2, 2), (first.calls, second.calls), "Results from an old data version were served.")
+
+    def test_result_not_stored_if_version_moves_on(self):
+        """
+        A result computed while the data changed belongs to neither version, so shouldn't be kept.
+        :return:
+        """
+        query_cache = cache.QueryCache()
+        late = Computation("late")
+
+        def compute_while_data_changes():
+            # Another request sees the new version while this one is still computing.
+            query_cache.get_or_compute("other", 2, Computation("other"))
+            return "stale"
+
+        self.assertEqual("stale", query_cache.get_or_compute("key", 1, compute_while_data_changes), "Wrong result.")
+        self.assertEqual("late", query_cache.get_or_compute("key", 2, late), "A stale result was stored.")
+        self.assertEqual(1, late.calls, "Result was not computed for the new version.")
+
+    def test_clear(self):
+        query_cache = cache.QueryCache()
+        compute = Computation("result")
+        query_cache.get_or_compute("key", 1, compute)
+        query_cache.clear()
+        query_cache.get_or_compute("key", 1, compute)
+        self.assertEqual(2, compute.calls, "Result was served after clearing.")
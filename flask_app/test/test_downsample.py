@@ -0,0 +1,63 @@
+import unittest
+try:
+    import numpy
+    import flask_app.downsample as downsample
+except ImportError:
+    downsample = None
+
+"""
+test_downsample.py
+Tests of the Largest-Triangle-Three-Buckets downsampling.
+"""
+
+__author__ = 'Goyder'
+
+
+@unittest.skipIf(downsample is None, "numpy is not installed.")
+class TestLargestTriangleThreeBuckets(unittest.TestCase):
+    """
+    Test the choice of points to keep.
+    """
+
+    def setUp(self):
+        self.x = numpy.arange(1000, dtype=numpy.float64) * 60 + 1.4851e12
+        self.y = numpy.sin(numpy.arange(1000) / 50.0)
+
+    def test_first_and_last_points_kept(self):
+        selected = downsample.largest_triangle_three_buckets(self.x, self.y, 20)
+        self.assertEqual(0, selected[0], "First point was not kept.")
+        self.assertEqual(len(self.x) - 1, selected[-1], "Last point was not kept.")
+
+    def test_threshold_indices_in_ascending_order(self):
+        for threshold in (3, 10, 100, 999):
+            selected = downsample.largest_triangle_three_buckets(self.x, self.y, threshold)
+            self.assertEqual(threshold, len(selected), "Wrong number of points for threshold {0}.".format(threshold))
+            self.assertEqual(
+                True,
+                bool(numpy.all(numpy.diff(selected) > 0)),
+                "Indices were not strictly ascending for threshold {0}.".format(threshold)
+            )
+
+    def test_spike_survives(self):
+        y = numpy.zeros(1000)
+        y[537] = 100.0
+        selected = downsample.largest_triangle_three_buckets(self.x, y, 10)
+        self.assertEqual(True, 537 in selected, "A single spike was lost.")
+
+    def test_threshold_at_least_length_keeps_everything(self):
+        for threshold in (1000, 5000):
+            selected = downsample.largest_triangle_three_buckets(self.x, self.y, threshold)
+            self.assertEqual(True, list(selected) == list(range(1000)), "Not every point was kept.")
+
+    def test_small_thresholds(self):
+        self.assertEqual(
+            [0, 999],
+            list(downsample.largest_triangle_three_buckets(self.x, self.y, 2)),
+            "Threshold of 2 should keep the ends."
+        )
+        self.assertEqual([0], list(downsample.largest_triangle_three_buckets(self.x, self.y, 1)), "Threshold of 1.")
+        self.assertEqual([], list(downsample.largest_triangle_three_buckets(self.x, self.y, 0)), "Threshold of 0.")
+
+    def test_short_series(self):
+        self.assertEqual([], list(downsample.largest_triangle_three_buckets([], [], 5)), "Empty series.")
+        self.assertEqual([0], list(downsample.largest_triangle_three_buckets([1.0], [2.0], 5)), "Single point.")
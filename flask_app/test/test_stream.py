@@ -0,0 +1,100 @@
+import unittest
+import unittest.mock as mock
+import os
+import shutil
+import tempfile
+import app.notifier
+import flask_app.stream as stream
+
+"""
+test_stream.py
+Tests of the Broadcaster behind /stream.
+"""
+
+__author__ = 'Goyder'
+
+
+class FakeDatabase(object):
+    """
+    Stands in for the database: a list of rows, whose row IDs are their positions plus one.
+    """
+
+    def __init__(self, row_count=0):
+        self.rows = [("2017-01-23 00:00:00", "Temperature", float(i)) for i in range(row_count)]
+
+    def add_rows(self, count):
+        self.rows.extend(("2017-01-23 00:00:00", "Temperature", float(len(self.rows) + i)) for i in range(count))
+
+    def retrieve_rows_since(self, since_row):
+        rows = self.rows[since_row:since_row + 3]
+        return rows, since_row + len(rows)
+
+    def retrieve_latest_row(self):
+        return len(self.rows)
+
+
+class TestBroadcaster(unittest.TestCase):
+    """
+    Test the fanning out of new rows to subscribers.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.notify_location = os.path.join(self.directory, "test.db.notify")
+        self.database = FakeDatabase(row_count=5)
+
+    def generate_broadcaster(self, **kwargs):
+        return stream.Broadcaster(self.notify_location, self.database.retrieve_rows_since,
+                                  self.database.retrieve_latest_row, **kwargs)
+
+    def test_rows_written_before_first_check_are_published(self):
+        """
+        The cursor is taken when the first subscriber arrives, so rows written before the watching thread first
+        looks are still sent.
+        :return:
+        """
+        broadcaster = self.generate_broadcaster()
+        with mock.patch("flask_app.stream.threading.Thread"):
+            subscriber = broadcaster.subscribe()
+        self.database.add_rows(2)
+        broadcaster.check_for_rows()
+
+        cursor, rows = subscriber.get_nowait()
+        self.assertEqual(7, cursor, "Wrong cursor published.")
+        self.assertEqual(True, rows == self.database.rows[5:], "The new rows were not published.")
+
+    def test_rows_are_published_in_batches_until_caught_up(self):
+        broadcaster = self.generate_broadcaster()
+        with mock.patch("flask_app.stream.threading.Thread"):
+            subscribers = [broadcaster.subscribe(), broadcaster.subscribe()]
+        self.database.add_rows(5)
+        app.notifier.FileNotifier(self.notify_location).notify(10)
+        self.assertEqual(True, broadcaster.check_for_rows(), "Notification file was not used.")
+
+        for subscriber in subscribers:
+            self.assertEqual(8, subscriber.get_nowait()[0], "First batch was not published to every subscriber.")
+            self.assertEqual(10, subscriber.get_nowait()[0], "Second batch was not published to every subscriber.")
+
+    def test_slow_subscriber_loses_oldest_events(self):
+        broadcaster = self.generate_broadcaster(queue_size=2)
+        with mock.patch("flask_app.stream.threading.Thread"):
+            subscriber = broadcaster.subscribe()
+        for cursor in (1, 2, 3):
+            broadcaster.publish(cursor, [])
+        self.assertEqual([2, 3], [subscriber.get_nowait()[0] for _ in range(2)], "Newest events were not kept.")
+
+    def test_watching_thread_follows_notifications(self):
+        broadcaster = self.generate_broadcaster(poll_interval=0.01)
+        subscriber = broadcaster.subscribe()
+        notifier = app.notifier.FileNotifier(self.notify_location)
+
+        self.database.add_rows(1)
+        notifier.notify(6)
+        self.assertEqual(6, subscriber.get(timeout=2)[0], "Notified row was not published.")
+
+        broadcaster.unsubscribe(subscriber)
+        thread = broadcaster._thread
+        if thread is not None:
+            thread.join(2)
+        self.assertEqual(None, broadcaster._thread, "Watching thread outlived its subscribers.")